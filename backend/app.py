@@ -2,11 +2,13 @@
 SafeCircle - Women Safety & Support Platform
 Main Flask Application with 4 Core Modules
 """
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 from dotenv import load_dotenv
+import importlib
 import os
+import time
 
 # Load environment variables
 load_dotenv()
@@ -17,19 +19,79 @@ app = Flask(__name__,
             static_folder='../frontend/static')
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Import routes
-from routes.toxicity_routes import toxicity_bp
-from routes.emotion_routes import emotion_bp
-from routes.safety_routes import safety_bp
-from routes.sos_routes import sos_bp
+# Socket.IO server: 'threading' for `python app.py`, 'gevent' under serve.py
+SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+# Engine.IO transports; serve.py allows only 'websocket' when workers share a port
+SOCKETIO_TRANSPORTS = os.getenv('SOCKETIO_TRANSPORTS', 'polling,websocket').split(',')
 
-# Register blueprints
-app.register_blueprint(toxicity_bp, url_prefix='/api/toxicity')
-app.register_blueprint(emotion_bp, url_prefix='/api/emotion')
-app.register_blueprint(safety_bp, url_prefix='/api/safety')
-app.register_blueprint(sos_bp, url_prefix='/api/sos')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE,
+                    transports=SOCKETIO_TRANSPORTS)
+
+from modules import lazy
+from modules.metrics import metrics, CONTENT_TYPE
+
+# Blueprint per module: (routes module, blueprint name, URL prefix)
+BLUEPRINTS = {
+    'toxicity': ('routes.toxicity_routes', 'toxicity_bp', '/api/toxicity'),
+    'emotion': ('routes.emotion_routes', 'emotion_bp', '/api/emotion'),
+    'safety': ('routes.safety_routes', 'safety_bp', '/api/safety'),
+    'sos': ('routes.sos_routes', 'sos_bp', '/api/sos')
+}
+
+# Only the modules this worker hosts (SHESAFE_MODULES) are imported and registered
+HOSTED_MODULES = lazy.hosted_modules()
+
+for name in HOSTED_MODULES:
+    module_path, blueprint_name, url_prefix = BLUEPRINTS[name]
+    app.register_blueprint(getattr(importlib.import_module(module_path), blueprint_name), url_prefix=url_prefix)
+
+# Combined /api/analyze and streaming conversations need both text models
+if {'toxicity', 'emotion'} <= set(HOSTED_MODULES):
+    from routes.analysis_routes import analysis_bp
+    from routes.stream_events import register_stream_events
+    app.register_blueprint(analysis_bp, url_prefix='/api')
+    register_stream_events(socketio)
+
+# Models load in the background; /api/ready reports when they are done
+if lazy.MODEL_WARMUP:
+    lazy.start_warmup(HOSTED_MODULES)
+
+
+def _collect_module_metrics():
+    """Gauges read at scrape time"""
+    for name, state in lazy.status(HOSTED_MODULES).items():
+        yield 'shesafe_module_ready', {'module': name}, int(state['state'] == 'ready')
+    if {'toxicity', 'emotion'} & set(HOSTED_MODULES):
+        from modules.inference_server import inference_server
+        for name, stats in inference_server.stats()['batchers'].items():
+            yield 'shesafe_inference_queue_depth', {'batcher': name}, stats['queued']
+
+
+# Route timings and /metrics (nothing is recorded with METRICS_ENABLED=0)
+if metrics.enabled:
+    metrics.add_collector(_collect_module_metrics)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            # The route pattern, not the path, keeps the number of series bounded
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.observe('shesafe_http_request_duration_seconds', time.perf_counter() - started,
+                            method=request.method, route=route)
+            metrics.inc('shesafe_http_requests_total', method=request.method, route=route,
+                        status=response.status_code)
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus text exposition of counters, histograms and gauges"""
+        return Response(metrics.render(), content_type=CONTENT_TYPE)
 
 
 @app.route('/')
@@ -40,18 +102,23 @@ def index():
 
 @app.route('/api/health')
 def health_check():
-    """Health check endpoint"""
+    """Liveness: the process is up (models may still be loading)"""
     return jsonify({
         'status': 'healthy',
-        'modules': {
-            'toxicity_detection': 'active',
-            'emotion_analysis': 'active',
-            'safety_scoring': 'active',
-            'sos_system': 'active'
-        }
+        'modules': {name: state['state'] for name, state in lazy.status(HOSTED_MODULES).items()}
     })
 
 
+@app.route('/api/ready')
+def readiness_check():
+    """Readiness: every hosted module has loaded"""
+    ready = lazy.is_ready(HOSTED_MODULES)
+    return jsonify({
+        'status': 'ready' if ready else 'loading',
+        'modules': lazy.status(HOSTED_MODULES)
+    }), 200 if ready else 503
+
+
 @socketio.on('connect')
 def handle_connect():
     """Handle WebSocket connection for real-time alerts"""
@@ -0,0 +1,379 @@
+"""
+Durable Outbound Alert Queue
+SQLite-backed outbox for SMS alerts with priority lanes, retries with
+exponential backoff and idempotency keys. Messages survive restarts; a
+worker pool drains them in lane order, with some workers reserved for SOS
+so a burst of check-ins can never delay an emergency alert.
+
+Lanes (lower is more urgent):
+    0 - SOS alerts
+    1 - live location shares
+    2 - safety check-ins
+
+Delivery is at-least-once: a message whose send was interrupted by a crash
+is sent again after its lease expires. Retries after a reported failure
+reuse the same row, so they never create a second message.
+"""
+from modules.database import DATA_DIR
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LANE_SOS = 0
+LANE_LOCATION = 1
+LANE_CHECKIN = 2
+LANE_NAMES = {LANE_SOS: 'sos', LANE_LOCATION: 'location', LANE_CHECKIN: 'checkin'}
+
+ALERT_QUEUE_PATH = os.getenv('ALERT_QUEUE_PATH', os.path.join(DATA_DIR, 'alert_queue.db'))
+ALERT_QUEUE_WORKERS = int(os.getenv('ALERT_QUEUE_WORKERS', '8'))
+ALERT_QUEUE_SOS_WORKERS = int(os.getenv('ALERT_QUEUE_SOS_WORKERS', '4'))
+ALERT_MAX_ATTEMPTS = int(os.getenv('ALERT_MAX_ATTEMPTS', '8'))
+
+# Retry delays grow as BASE * 2**attempt up to MAX seconds, with jitter
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 300.0
+
+# A claimed message not finished within this many seconds is sent again
+SEND_LEASE_SECONDS = 120.0
+
+# Finished rows are kept this long for status lookups
+FINISHED_RETENTION_SECONDS = 7 * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    lane INTEGER NOT NULL,
+    to_number TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_sid TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (status, lane, next_attempt_at);
+"""
+
+
+class AlertQueue:
+    """Persistent, prioritized SMS outbox with a worker pool"""
+
+    def __init__(self, send_fn, path=None, workers=None, sos_workers=None, max_attempts=None):
+        """
+        Initialize the queue (workers start on first use)
+
+        Args:
+            send_fn (callable): send_fn(to_number, body) -> dict with 'status'
+                ('sent', 'simulated' or 'failed'), and for failures 'error'
+                and 'retryable'
+            path (str): SQLite database file (':memory:' is not durable)
+            workers (int): Workers serving every lane, most urgent first
+            sos_workers (int): Extra workers that only serve the SOS lane
+            max_attempts (int): Attempts before a message is marked failed
+        """
+        self.send_fn = send_fn
+        self.path = path or ALERT_QUEUE_PATH
+        self.workers = ALERT_QUEUE_WORKERS if workers is None else workers
+        self.sos_workers = ALERT_QUEUE_SOS_WORKERS if sos_workers is None else sos_workers
+        self.max_attempts = max_attempts or ALERT_MAX_ATTEMPTS
+
+        self._local = threading.local()
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        # Bumped on every enqueue, so a worker can tell it missed a notify
+        self._enqueued = 0
+        self._listeners = []
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+
+        # Shared in-memory databases need one connection kept open
+        if self.path == ':memory:':
+            self.path = f"file:alert_queue_{id(self)}?mode=memory&cache=shared"
+            self._keepalive = self._connect()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def enqueue(self, recipients, body, lane, idempotency_key):
+        """
+        Add one message per recipient to the queue
+
+        Args:
+            recipients (list): Phone numbers
+            body (str): Message text
+            lane (int): LANE_SOS, LANE_LOCATION or LANE_CHECKIN
+            idempotency_key (str): Identifies the alert; combined with each
+                recipient so enqueueing the same alert twice adds nothing
+
+        Returns:
+            list: {'contact', 'status', 'message_id'} per recipient, with
+                  'duplicate' set for messages that were already queued
+        """
+        now = time.time()
+        rows = [(f"{idempotency_key}:{contact}", lane, contact, body, now, now, now)
+                for contact in recipients]
+
+        with self._connection() as conn:
+            existing = self._existing_keys(conn, [row[0] for row in rows])
+            conn.executemany(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, lane, to_number, body, "
+                "next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            found = {
+                key: (message_id, status)
+                for key, message_id, status in conn.execute(
+                    f"SELECT idempotency_key, id, status FROM outbox WHERE idempotency_key IN "
+                    f"({','.join('?' * len(rows))})",
+                    [row[0] for row in rows]
+                )
+            } if rows else {}
+
+        self.start()
+        with self._wakeup:
+            self._enqueued += 1
+            self._wakeup.notify_all()
+
+        entries = []
+        for row in rows:
+            message_id, status = found[row[0]]
+            entry = {
+                'contact': row[2],
+                'status': 'queued' if status in ('pending', 'sending') else status,
+                'message_id': message_id
+            }
+            if row[0] in existing:
+                entry['duplicate'] = True
+            entries.append(entry)
+        return entries
+
+    @staticmethod
+    def _existing_keys(conn, keys):
+        """Which of the idempotency keys are already in the outbox"""
+        if not keys:
+            return set()
+        return {row[0] for row in conn.execute(
+            f"SELECT idempotency_key FROM outbox WHERE idempotency_key IN ({','.join('?' * len(keys))})",
+            keys
+        )}
+
+    def add_listener(self, listener):
+        """Call listener(message_id, result) when a message reaches a final state"""
+        self._listeners.append(listener)
+
+    def get_status(self, message_ids):
+        """Current status of messages by id"""
+        if not message_ids:
+            return {}
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT id, status, attempts, message_sid, last_error FROM outbox "
+                f"WHERE id IN ({','.join('?' * len(message_ids))})",
+                list(message_ids)
+            ).fetchall()
+        return {
+            row[0]: {'status': row[1], 'attempts': row[2], 'message_sid': row[3], 'error': row[4]}
+            for row in rows
+        }
+
+    def start(self):
+        """Start the worker threads in this process if they are not running"""
+        if self._pid == os.getpid() or self.workers + self.sos_workers == 0:
+            return
+        with self._wakeup:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive fork; a child starts its own
+            self._pid = os.getpid()
+            self._stopping = False
+            self._threads = []
+            for index in range(self.workers + self.sos_workers):
+                max_lane = LANE_SOS if index >= self.workers else LANE_CHECKIN
+                thread = threading.Thread(
+                    target=self._run_worker, args=(max_lane,),
+                    name=f"alert-{LANE_NAMES[max_lane]}-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def resume(self):
+        """Start workers if unfinished messages were left by an earlier run"""
+        with self._connection() as conn:
+            outstanding = conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')"
+            ).fetchone()[0]
+        if outstanding:
+            logger.info(f"Resuming {outstanding} queued alert messages")
+            self.start()
+        return outstanding
+
+    def stop(self, timeout=5.0):
+        """Stop the workers after their current message"""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def wait_idle(self, timeout=10.0):
+        """Block until nothing is ready to send (tests and benchmarks)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._connection() as conn:
+                busy = conn.execute(
+                    "SELECT COUNT(*) FROM outbox WHERE status = 'sending' OR "
+                    "(status = 'pending' AND next_attempt_at <= ?)", (time.time(),)
+                ).fetchone()[0]
+            if not busy:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self):
+        """Message counts by lane and status"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT lane, status, COUNT(*) FROM outbox GROUP BY lane, status"
+            ).fetchall()
+        counts = {}
+        for lane, status, count in rows:
+            counts.setdefault(LANE_NAMES.get(lane, str(lane)), {})[status] = count
+        return {
+            'workers': self.workers,
+            'sos_workers': self.sos_workers,
+            'running': self._pid == os.getpid(),
+            'messages': counts
+        }
+
+    def purge_finished(self, older_than=FINISHED_RETENTION_SECONDS):
+        """Delete sent and failed messages older than the retention period"""
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM outbox WHERE status IN ('sent', 'simulated', 'failed') AND updated_at < ?",
+                (time.time() - older_than,)
+            ).rowcount
+
+    def _run_worker(self, max_lane):
+        """Claim and send messages until stopped"""
+        while not self._stopping:
+            enqueued = self._enqueued
+            try:
+                claimed = self._claim(max_lane)
+                wait = None if claimed else self._next_due(max_lane)
+            except sqlite3.Error as e:
+                logger.error(f"❌ Alert queue error: {e}")
+                claimed, wait = None, 1.0
+
+            if claimed:
+                self._deliver(*claimed)
+                continue
+            with self._wakeup:
+                # A message enqueued since the claim was missed; look again instead of sleeping
+                if not self._stopping and self._enqueued == enqueued:
+                    self._wakeup.wait(wait)
+
+    def _claim(self, max_lane):
+        """Atomically take the most urgent ready message"""
+        now = time.time()
+        with self._claim_lock, self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Messages whose sender died mid-send become ready again
+            conn.execute(
+                "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND lease_expires_at < ?",
+                (now,)
+            )
+            row = conn.execute(
+                "SELECT id, lane, to_number, body, attempts FROM outbox "
+                "WHERE status = 'pending' AND lane <= ? AND next_attempt_at <= ? "
+                "ORDER BY lane, next_attempt_at, id LIMIT 1",
+                (max_lane, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE outbox SET status = 'sending', lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                (now + SEND_LEASE_SECONDS, now, row[0])
+            )
+        return row
+
+    def _deliver(self, message_id, lane, to_number, body, attempts):
+        """Send one message and record the outcome"""
+        try:
+            result = self.send_fn(to_number, body)
+        except Exception as e:
+            result = {'status': 'failed', 'error': str(e), 'retryable': True}
+
+        attempts += 1
+        now = time.time()
+        status = result.get('status', 'failed')
+        error = result.get('error')
+
+        if status == 'failed' and result.get('retryable', True) and attempts < self.max_attempts:
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+            delay *= random.uniform(0.5, 1.0)
+            with self._connection() as conn:
+                conn.execute(
+                    "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, "
+                    "lease_expires_at = NULL, updated_at = ?, last_error = ? WHERE id = ?",
+                    (attempts, now + delay, now, error, message_id)
+                )
+            logger.warning(f"SMS to {to_number} failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+            return
+
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, lease_expires_at = NULL, updated_at = ?, "
+                "message_sid = ?, last_error = ? WHERE id = ?",
+                (status, attempts, now, result.get('message_sid'), error, message_id)
+            )
+        if status == 'failed':
+            logger.error(f"❌ SMS to {to_number} failed permanently after {attempts} attempts: {error}")
+
+        for listener in self._listeners:
+            try:
+                listener(message_id, dict(result, status=status, attempts=attempts))
+            except Exception as e:
+                logger.error(f"Alert queue listener error: {e}")
+
+    def _next_due(self, max_lane):
+        """Seconds until the next scheduled retry this worker could take"""
+        with self._connection() as conn:
+            due = conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending' AND lane <= ?",
+                (max_lane,)
+            ).fetchone()[0]
+        if due is None:
+            return SEND_LEASE_SECONDS
+        return min(SEND_LEASE_SECONDS, max(0.01, due - time.time()))
+
+    def _connection(self):
+        """Per-thread connection (usable as a context manager)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _connect(self):
+        # Autocommit; _claim opens its own write transaction
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                               uri=self.path.startswith('file:'), check_same_thread=False)
+        if not self.path.startswith('file:'):
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
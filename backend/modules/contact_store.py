@@ -0,0 +1,258 @@
+"""
+Emergency Contact Store
+Per-user emergency contacts keyed by normalized E.164 number, written
+through to the shared database and served from an in-memory cache so an
+SOS fan-out only reads a cached tuple.
+"""
+from sqlalchemy import Table, Column, Integer, Float, String, Index, UniqueConstraint, select, delete
+from sqlalchemy.exc import IntegrityError
+from modules import database
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER = 'default'
+
+# Prefix for numbers entered without one, e.g. '+91' (optional; without it
+# such numbers are kept as entered, minus separators)
+CONTACTS_DEFAULT_COUNTRY_CODE = os.getenv('CONTACTS_DEFAULT_COUNTRY_CODE', '')
+
+# Cached contact sets are reloaded after this many seconds so writes from
+# other worker processes show up
+CONTACT_CACHE_TTL = float(os.getenv('CONTACT_CACHE_TTL', '30'))
+
+_SEPARATORS = re.compile(r'[\s\-().\/]')
+
+emergency_contacts = Table(
+    'emergency_contacts', database.metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', String(128), nullable=False),
+    Column('phone_e164', String(16), nullable=False),
+    Column('name', String(256)),
+    Column('created_at', Float, nullable=False),
+    UniqueConstraint('user_id', 'phone_e164', name='uq_emergency_contacts_user_phone'),
+    Index('ix_emergency_contacts_phone', 'phone_e164'),
+)
+
+# Users whose initial contacts were seeded, so contacts they delete stay deleted
+contact_seeds = Table(
+    'contact_seeds', database.metadata,
+    Column('user_id', String(128), primary_key=True),
+    Column('seeded_at', Float, nullable=False),
+)
+
+
+def normalize_phone(phone_number, default_country_code=None):
+    """
+    Normalize a phone number to E.164 (+<country><number>)
+
+    A number without a country code gets the default one. If there is no
+    default it is returned as entered, minus separators, as before numbers
+    were normalized.
+
+    Args:
+        phone_number (str): Number as entered
+        default_country_code (str): Prefix for numbers without one (e.g. '+91')
+
+    Returns:
+        str: Normalized number
+
+    Raises:
+        ValueError: If the number cannot be normalized
+    """
+    number = _SEPARATORS.sub('', str(phone_number or ''))
+    if number.startswith('00'):
+        number = '+' + number[2:]
+
+    if not number.startswith('+'):
+        prefix = CONTACTS_DEFAULT_COUNTRY_CODE if default_country_code is None else default_country_code
+        if prefix:
+            number = '+' + prefix.lstrip('+') + number.lstrip('0')
+
+    digits = number[1:] if number.startswith('+') else number
+    if not digits.isdigit() or not 6 <= len(digits) <= 15:
+        raise ValueError(f"Invalid phone number: {phone_number}")
+    return number
+
+
+class ContactStore:
+    """Per-user emergency contacts with a write-through cache"""
+
+    def __init__(self, engine=None, cache_ttl=None):
+        """
+        Args:
+            engine: SQLAlchemy engine (defaults to the shared DATABASE_URL engine)
+            cache_ttl (float): Seconds before a cached contact set is reloaded
+        """
+        self._engine = engine
+        self.cache_ttl = CONTACT_CACHE_TTL if cache_ttl is None else cache_ttl
+
+        # user_id -> (loaded_at, {phone: name}, numbers tuple)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            return database.get_engine()
+        return self._engine
+
+    def numbers(self, user_id=None):
+        """
+        A user's contact numbers in the order they were added
+
+        Returns:
+            tuple: E.164 numbers (cached; no database access on a hit)
+        """
+        return self._entry(user_id or DEFAULT_USER)[2]
+
+    def contacts(self, user_id=None):
+        """A user's contacts as [{'phone_number', 'name'}]"""
+        names = self._entry(user_id or DEFAULT_USER)[1]
+        return [{'phone_number': phone, 'name': name} for phone, name in names.items()]
+
+    def has(self, phone_number, user_id=None):
+        """Whether a number is one of the user's contacts"""
+        try:
+            phone = normalize_phone(phone_number)
+        except ValueError:
+            return False
+        return phone in self._entry(user_id or DEFAULT_USER)[1]
+
+    def add(self, phone_number, name='', user_id=None):
+        """
+        Add a contact
+
+        Returns:
+            tuple: (added, normalized_number); added is False if it already existed
+
+        Raises:
+            ValueError: If the number is invalid
+        """
+        user_id = user_id or DEFAULT_USER
+        phone = normalize_phone(phone_number)
+        if phone in self._entry(user_id)[1]:
+            return False, phone
+
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(emergency_contacts.insert().values(
+                    user_id=user_id, phone_e164=phone, name=name or None, created_at=time.time()
+                ))
+        except IntegrityError:
+            # Added meanwhile by another worker
+            self.invalidate(user_id)
+            return False, phone
+
+        self._update(user_id, lambda names: names.__setitem__(phone, name or None))
+        return True, phone
+
+    def remove(self, phone_number, user_id=None):
+        """
+        Remove a contact
+
+        Returns:
+            bool: Whether the contact existed
+        """
+        user_id = user_id or DEFAULT_USER
+        try:
+            phone = normalize_phone(phone_number)
+        except ValueError:
+            return False
+
+        with self.engine.begin() as conn:
+            removed = conn.execute(delete(emergency_contacts).where(
+                emergency_contacts.c.user_id == user_id,
+                emergency_contacts.c.phone_e164 == phone
+            )).rowcount
+
+        self._update(user_id, lambda names: names.pop(phone, None))
+        return bool(removed)
+
+    def seed(self, phone_numbers, user_id=None):
+        """
+        Add a user's initial contacts (e.g. from EMERGENCY_CONTACTS), once
+
+        Seeding is recorded with the contacts in one transaction, so it
+        happens once across workers and restarts and contacts the user
+        removes later are not added back. A user who already has contacts
+        is only marked as seeded.
+
+        Returns:
+            int: Number of contacts added
+        """
+        user_id = user_id or DEFAULT_USER
+        phones = []
+        for number in phone_numbers:
+            try:
+                phone = normalize_phone(number)
+            except ValueError as e:
+                logger.warning(f"Skipping emergency contact: {e}")
+                continue
+            if phone not in phones:
+                phones.append(phone)
+
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(contact_seeds.insert().values(user_id=user_id, seeded_at=time.time()))
+                existing = conn.execute(
+                    select(emergency_contacts.c.id).where(emergency_contacts.c.user_id == user_id).limit(1)
+                ).first()
+                if existing is not None:
+                    phones = []
+                now = time.time()
+                for phone in phones:
+                    conn.execute(emergency_contacts.insert().values(
+                        user_id=user_id, phone_e164=phone, name=None, created_at=now
+                    ))
+        except IntegrityError:
+            # Seeded before, possibly by another worker just now
+            return 0
+        finally:
+            self.invalidate(user_id)
+        return len(phones)
+
+    def users_with_contact(self, phone_number):
+        """Users who list a number as an emergency contact"""
+        phone = normalize_phone(phone_number)
+        with self.engine.connect() as conn:
+            return [row[0] for row in conn.execute(
+                select(emergency_contacts.c.user_id).where(emergency_contacts.c.phone_e164 == phone)
+            )]
+
+    def invalidate(self, user_id=None):
+        """Drop cached contacts for one user, or for everyone"""
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+    def _entry(self, user_id):
+        """Cached (loaded_at, names, numbers) for a user, loading on a miss"""
+        entry = self._cache.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self.cache_ttl:
+            return entry
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(emergency_contacts.c.phone_e164, emergency_contacts.c.name)
+                .where(emergency_contacts.c.user_id == user_id)
+                .order_by(emergency_contacts.c.id)
+            ).all()
+        names = {phone: name for phone, name in rows}
+        entry = (time.monotonic(), names, tuple(names))
+        with self._lock:
+            self._cache[user_id] = entry
+        return entry
+
+    def _update(self, user_id, change):
+        """Apply a write to the cached set, replacing it atomically"""
+        names = dict(self._entry(user_id)[1])
+        change(names)
+        with self._lock:
+            self._cache[user_id] = (time.monotonic(), names, tuple(names))
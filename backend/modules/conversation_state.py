@@ -0,0 +1,188 @@
+"""
+Conversation State
+Compact running aggregates of a conversation's per-message results: counts,
+per-label score sums in flat arrays and a small ring buffer of recent
+distress scores. Adding a message, taking a snapshot and merging two states
+all cost the same however many messages the conversation has.
+"""
+from array import array
+
+NEGATIVE_EMOTIONS = frozenset(('sadness', 'fear', 'anger'))
+
+# Emotions above this score count as extreme distress
+EXTREME_EMOTION_SCORE = 0.8
+
+# Share of negative-dominant messages for persistent_negative_emotions
+PERSISTENT_NEGATIVE_SHARE = 0.6
+
+# Consecutive rising distress scores for escalating_distress
+DISTRESS_WINDOW = 3
+
+
+class ConversationState:
+    """Running toxicity and emotion aggregates for one conversation"""
+
+    __slots__ = (
+        'message_count',
+        'toxicity_count', 'toxic_count', 'toxicity_labels', 'toxicity_sums',
+        'emotion_count', 'high_risk_count', 'negative_count', 'extreme_count',
+        'emotion_labels', 'emotion_sums', 'net_score_sum',
+        'distress', 'distress_next', 'distress_size'
+    )
+
+    def __init__(self):
+        # Messages seen, including ones that could not be analyzed
+        self.message_count = 0
+
+        self.toxicity_count = 0
+        self.toxic_count = 0
+        self.toxicity_labels = ()
+        self.toxicity_sums = array('d')
+
+        self.emotion_count = 0
+        self.high_risk_count = 0
+        self.negative_count = 0
+        self.extreme_count = 0
+        self.emotion_labels = ()
+        self.emotion_sums = array('d')
+        self.net_score_sum = 0.0
+
+        # Ring buffer of the latest distress scores, oldest at distress_next once full
+        self.distress = array('d', bytes(8 * DISTRESS_WINDOW))
+        self.distress_next = 0
+        self.distress_size = 0
+
+    def add_toxicity(self, result):
+        """Add a ToxicityDetector.analyze_text result (errors are skipped)"""
+        if result.get('error'):
+            return
+        scores = result['scores']
+        if not self.toxicity_labels:
+            self.toxicity_labels = tuple(scores)
+            self.toxicity_sums = array('d', bytes(8 * len(scores)))
+        sums = self.toxicity_sums
+        for i, label in enumerate(self.toxicity_labels):
+            sums[i] += scores.get(label, 0.0)
+        self.toxicity_count += 1
+        if result['is_toxic']:
+            self.toxic_count += 1
+
+    def add_emotion(self, result):
+        """Add an EmotionDetector.analyze_emotion result (errors are skipped)"""
+        if result.get('error'):
+            return
+        emotions = result['emotions']
+        if not self.emotion_labels:
+            self.emotion_labels = tuple(emotions)
+            self.emotion_sums = array('d', bytes(8 * len(emotions)))
+        sums = self.emotion_sums
+        for i, label in enumerate(self.emotion_labels):
+            sums[i] += emotions.get(label, 0.0)
+        self.emotion_count += 1
+
+        risk = result['mental_health_risk']
+        if risk['level'] in ('HIGH', 'CRITICAL'):
+            self.high_risk_count += 1
+        if result['dominant_emotion']['name'] in NEGATIVE_EMOTIONS:
+            self.negative_count += 1
+        if emotions.get('fear', 0) > EXTREME_EMOTION_SCORE or emotions.get('sadness', 0) > EXTREME_EMOTION_SCORE:
+            self.extreme_count += 1
+        self.net_score_sum += risk['net_score']
+
+        self.distress[self.distress_next] = risk['distress_score']
+        self.distress_next = (self.distress_next + 1) % DISTRESS_WINDOW
+        self.distress_size = min(self.distress_size + 1, DISTRESS_WINDOW)
+
+    def add(self, toxicity=None, emotion=None):
+        """Add one message with whichever results it has"""
+        self.message_count += 1
+        if toxicity is not None:
+            self.add_toxicity(toxicity)
+        if emotion is not None:
+            self.add_emotion(emotion)
+
+    def recent_distress(self):
+        """Latest distress scores, oldest first"""
+        start = (self.distress_next - self.distress_size) % DISTRESS_WINDOW
+        return [self.distress[(start + i) % DISTRESS_WINDOW] for i in range(self.distress_size)]
+
+    def toxicity_averages(self):
+        if not self.toxicity_count:
+            return {}
+        return {label: total / self.toxicity_count for label, total in zip(self.toxicity_labels, self.toxicity_sums)}
+
+    def emotion_averages(self):
+        if not self.emotion_count:
+            return {}
+        return {label: total / self.emotion_count for label, total in zip(self.emotion_labels, self.emotion_sums)}
+
+    def average_net_score(self):
+        return self.net_score_sum / self.emotion_count if self.emotion_count else 0.0
+
+    def patterns(self):
+        """Concerning emotional patterns over the messages so far"""
+        patterns = []
+        if self.negative_count > self.emotion_count * PERSISTENT_NEGATIVE_SHARE:
+            patterns.append("persistent_negative_emotions")
+        if self.distress_size == DISTRESS_WINDOW:
+            recent = self.recent_distress()
+            if all(recent[i] < recent[i + 1] for i in range(DISTRESS_WINDOW - 1)):
+                patterns.append("escalating_distress")
+        if self.extreme_count > 0:
+            patterns.append("extreme_emotional_distress")
+        return patterns
+
+    def copy(self):
+        state = ConversationState()
+        for name in self.__slots__:
+            value = getattr(self, name)
+            setattr(state, name, array(value.typecode, value) if isinstance(value, array) else value)
+        return state
+
+    def merge(self, later):
+        """
+        Combine with the state of the messages that followed this one
+
+        Args:
+            later (ConversationState): State of the next part of the conversation
+
+        Returns:
+            ConversationState: State of both parts, in order
+        """
+        state = self.copy()
+        state.message_count += later.message_count
+
+        state.toxicity_count += later.toxicity_count
+        state.toxic_count += later.toxic_count
+        state.toxicity_labels, state.toxicity_sums = _merge_sums(
+            state.toxicity_labels, state.toxicity_sums, later.toxicity_labels, later.toxicity_sums
+        )
+
+        state.emotion_count += later.emotion_count
+        state.high_risk_count += later.high_risk_count
+        state.negative_count += later.negative_count
+        state.extreme_count += later.extreme_count
+        state.net_score_sum += later.net_score_sum
+        state.emotion_labels, state.emotion_sums = _merge_sums(
+            state.emotion_labels, state.emotion_sums, later.emotion_labels, later.emotion_sums
+        )
+
+        # The most recent distress scores come from the later part, topped up from this one
+        recent = (state.recent_distress() + later.recent_distress())[-DISTRESS_WINDOW:]
+        state.distress = array('d', recent + [0.0] * (DISTRESS_WINDOW - len(recent)))
+        state.distress_size = len(recent)
+        state.distress_next = len(recent) % DISTRESS_WINDOW
+        return state
+
+
+def _merge_sums(labels, sums, other_labels, other_sums):
+    if not other_labels:
+        return labels, sums
+    if not labels:
+        return other_labels, array('d', other_sums)
+    merged = array('d', sums)
+    index = {label: i for i, label in enumerate(labels)}
+    for label, total in zip(other_labels, other_sums):
+        if label in index:
+            merged[index[label]] += total
+    return labels, merged
@@ -0,0 +1,234 @@
+"""
+Streaming Conversation Analysis
+A chat monitor opens a session and pushes messages one at a time. Only the
+new message is scored; the session keeps running aggregates (average
+scores, toxic and high-risk counts, recent distress trend) so each update
+costs the same however long the conversation gets, and reports alerts
+when a message or pattern first crosses a threshold.
+
+Messages are numbered when they arrive and applied to the aggregates in
+that order, whatever order their scoring finishes in. Only the connection
+that opened a session can use it, plus any connection that presents the
+session's resume token (a server-generated secret). user_id is only a
+label; there is no authentication to tie it to the client.
+"""
+from modules.conversation_state import ConversationState
+from modules.emotion_detector import EmotionDetector
+from modules.toxicity_detector import ToxicityDetector
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Idle sessions are dropped after this many seconds (clients may reconnect before)
+STREAM_SESSION_TTL = float(os.getenv('STREAM_SESSION_TTL', '1800'))
+# Most open sessions per process; the least recently used one is dropped beyond it
+STREAM_MAX_SESSIONS = int(os.getenv('STREAM_MAX_SESSIONS', '10000'))
+
+
+class ConversationSession:
+    """Running toxicity and emotion aggregates for one conversation"""
+
+    def __init__(self, conversation_id, user_id=None, sid=None):
+        """
+        Args:
+            conversation_id (str): Session id
+            user_id (str): Owner of the conversation (optional, not verified)
+            sid (str): Socket.IO connection that opened it
+        """
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.sids = {sid} if sid else set()
+        # Given only to the connection that opened the session; proves ownership on reconnect
+        self.resume_token = secrets.token_urlsafe(24)
+        self.created_at = time.time()
+        self.last_active = time.monotonic()
+        self.lock = threading.Lock()
+        self.state = ConversationState()
+        self._active_patterns = set()
+        # Arrival numbers: the next one to hand out and the next one to apply
+        self._next_received = 0
+        self._next_applied = 0
+        # Scored messages waiting for an earlier one to finish
+        self._completed = {}
+
+    def owned_by(self, sid=None, resume_token=None):
+        """Whether a connection (or a new one holding the resume token) may use this session"""
+        if sid is not None and sid in self.sids:
+            return True
+        return isinstance(resume_token, str) and hmac.compare_digest(resume_token, self.resume_token)
+
+    @property
+    def message_count(self):
+        return self.state.message_count
+
+    def add(self, toxicity, emotion):
+        """
+        Add one scored message
+
+        Args:
+            toxicity (dict): ToxicityDetector.analyze_text result
+            emotion (dict): EmotionDetector.analyze_emotion result
+
+        Returns:
+            list: Alerts raised by this message
+        """
+        self.last_active = time.monotonic()
+        self.state.add(toxicity, emotion)
+        alerts = []
+
+        if not toxicity.get('error') and toxicity['risk_level'] in ('HIGH', 'CRITICAL'):
+            alerts.append({
+                'type': 'toxic_message',
+                'risk_level': toxicity['risk_level'],
+                'max_score': toxicity['max_score']
+            })
+
+        if not emotion.get('error'):
+            risk_level = emotion['mental_health_risk']['level']
+            if risk_level in ('HIGH', 'CRITICAL'):
+                alerts.append({'type': 'needs_support', 'risk_level': risk_level})
+
+            # Patterns alert when they first appear, not on every message while they last
+            patterns = set(self.state.patterns())
+            for pattern in sorted(patterns - self._active_patterns):
+                alerts.append({'type': pattern})
+            self._active_patterns = patterns
+
+        return alerts
+
+    def receive(self):
+        """
+        Number a message on arrival (call with lock held)
+
+        Returns:
+            int: Arrival number to pass to complete()
+        """
+        self.last_active = time.monotonic()
+        number = self._next_received
+        self._next_received += 1
+        return number
+
+    def complete(self, number, result):
+        """
+        Record a scored message and apply every message now in arrival order (call with lock held)
+
+        Args:
+            number (int): Arrival number from receive()
+            result (dict): MultiAnalyzer result, or None if scoring failed
+
+        Returns:
+            list: One update per applied message: message_index, message, aggregates, alerts
+        """
+        self._completed[number] = result
+        updates = []
+        while self._next_applied in self._completed:
+            result = self._completed.pop(self._next_applied)
+            self._next_applied += 1
+            if result is None:
+                continue
+            alerts = self.add(result['toxicity'], result['emotion'])
+            updates.append({
+                'message_index': self.state.message_count - 1,
+                'message': result,
+                'aggregates': self.snapshot(),
+                'alerts': alerts
+            })
+        return updates
+
+    def snapshot(self):
+        """Current aggregates in the analyze-conversation formats"""
+        return {
+            'conversation_id': self.conversation_id,
+            'message_count': self.state.message_count,
+            'toxicity': ToxicityDetector.summary_from_state(self.state),
+            'emotion': EmotionDetector.summary_from_state(self.state)
+        }
+
+
+class ConversationStreams:
+    """Open streaming sessions, expired when idle"""
+
+    def __init__(self, ttl=None, max_sessions=None):
+        """
+        Args:
+            ttl (float): Idle seconds before a session is dropped
+            max_sessions (int): Most open sessions
+        """
+        self.ttl = STREAM_SESSION_TTL if ttl is None else ttl
+        self.max_sessions = STREAM_MAX_SESSIONS if max_sessions is None else max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def open(self, conversation_id=None, user_id=None, sid=None, resume_token=None):
+        """
+        Start a session (without conversation_id), or resume an open one
+
+        A session is resumed only from the connection that opened it or with
+        its resume token. Sessions live in this process only, so an id it does
+        not know (expired, or opened on another worker) cannot be resumed.
+
+        Returns:
+            ConversationSession: Or None if the session is unknown here or belongs to someone else
+        """
+        with self._lock:
+            self._expire()
+            if not conversation_id:
+                session = ConversationSession(uuid.uuid4().hex, user_id, sid)
+                self._sessions[session.conversation_id] = session
+                if len(self._sessions) > self.max_sessions:
+                    oldest = min(self._sessions.values(), key=lambda s: s.last_active)
+                    del self._sessions[oldest.conversation_id]
+                return session
+
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                # A new empty session under the old id would silently drop its aggregates
+                logger.info(f"Cannot resume conversation {conversation_id}: not open in this process")
+                return None
+            if not session.owned_by(sid, resume_token):
+                logger.warning(f"Rejected resume of conversation {conversation_id} by another client")
+                return None
+            if sid:
+                session.sids.add(sid)
+            session.last_active = time.monotonic()
+            return session
+
+    def get(self, conversation_id, sid=None):
+        """Open session by id, or None (also when `sid` is given and does not own it)"""
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                return None
+            if time.monotonic() - session.last_active > self.ttl:
+                del self._sessions[conversation_id]
+                return None
+            if sid is not None and not session.owned_by(sid):
+                return None
+            return session
+
+    def close(self, conversation_id, sid=None):
+        """End a session; returns it, or None if it was not open (or `sid` does not own it)"""
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None or (sid is not None and not session.owned_by(sid)):
+                return None
+            return self._sessions.pop(conversation_id)
+
+    def stats(self):
+        with self._lock:
+            return {'open_sessions': len(self._sessions), 'ttl': self.ttl}
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        for conversation_id in [cid for cid, s in self._sessions.items() if s.last_active < cutoff]:
+            del self._sessions[conversation_id]
+
+
+# Initialize global session registry
+conversation_streams = ConversationStreams()
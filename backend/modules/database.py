@@ -0,0 +1,66 @@
+"""
+Shared Database Access
+One SQLAlchemy engine per process for the persistent stores, configured by
+DATABASE_URL (SQLite by default, PostgreSQL in production).
+"""
+from sqlalchemy import create_engine, event, MetaData
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Local SQLite files live here, not in whatever directory the server was started from
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('SHESAFE_DATA_DIR', os.path.join(BACKEND_DIR, 'data'))
+
+DATABASE_URL = os.getenv('DATABASE_URL', f"sqlite:///{os.path.join(DATA_DIR, 'shesafe.db')}")
+
+# Tables of every store register here so create_all() covers them
+metadata = MetaData()
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Engine for DATABASE_URL, created on first use
+
+    Pooled connections must not cross fork(), so a forked worker gets its
+    own engine the first time it asks.
+    """
+    global _engine, _engine_pid
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+
+    with _engine_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            if _engine is not None:
+                _engine.dispose(close=False)
+            _engine = _create_engine(DATABASE_URL)
+            _engine_pid = os.getpid()
+            metadata.create_all(_engine)
+            logger.info(f"✅ Database ready ({_engine.url.get_backend_name()})")
+    return _engine
+
+
+def _create_engine(url):
+    """Engine with SQLite tuned for concurrent readers and a single writer"""
+    if not url.startswith('sqlite'):
+        return create_engine(url, pool_pre_ping=True, future=True)
+
+    engine = create_engine(url, connect_args={'check_same_thread': False, 'timeout': 30}, future=True)
+    if engine.url.database and ':memory:' not in url:
+        os.makedirs(os.path.dirname(os.path.abspath(engine.url.database)), exist_ok=True)
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        if ':memory:' not in url:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return engine
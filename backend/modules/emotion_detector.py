@@ -3,37 +3,113 @@ Module 2: Emotion & Mental Health Detection
 Uses Transformers with emotion classification models (MIT/Apache License)
 Detects: Sadness, Fear, Anger, Joy, Surprise, Love
 """
-from transformers import pipeline
+from modules import lazy
+from modules.conversation_state import ConversationState
+from modules.metrics import metrics
+from modules.result_cache import result_cache
+import contextlib
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Number of messages sent through each pipeline in one forward pass
+DEFAULT_BATCH_SIZE = int(os.getenv('EMOTION_BATCH_SIZE', '32'))
+
+# 'torch' or 'onnx' (ONNX Runtime, INT8 quantized; see modules/onnx_backend.py)
+EMOTION_BACKEND = os.getenv('EMOTION_BACKEND', 'torch')
+
+
+def _inference_mode(backend):
+    if backend == 'onnx':
+        return contextlib.nullcontext()
+    # torch is imported on first inference so importing this module stays cheap
+    import torch
+    return torch.inference_mode()
+
 
 class EmotionDetector:
     """Emotion and mental health analysis using transformer models"""
     
-    def __init__(self):
+    # Using distilbert-based emotion classifier
+    EMOTION_MODEL = "j-hartmann/emotion-english-distilroberta-base"
+    
+    # Sentiment analysis for additional context
+    SENTIMENT_MODEL = "distilbert-base-uncased-finetuned-sst-2-english"
+    
+    def __init__(self, batch_size=None, cache=None, backend=None):
         """Initialize emotion detection pipeline"""
+        self.batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+        self.cache = cache if cache is not None else result_cache
+        self.backend = backend or EMOTION_BACKEND
+        self.model_name = f"{self.EMOTION_MODEL}+{self.SENTIMENT_MODEL}"
+        self.load_error = None
         try:
-            # Using distilbert-based emotion classifier
-            self.emotion_classifier = pipeline(
-                "text-classification",
-                model="j-hartmann/emotion-english-distilroberta-base",
-                return_all_scores=True
-            )
+            pipelines = self._load_onnx() if self.backend == 'onnx' else None
+            if pipelines:
+                self.emotion_classifier, self.sentiment_analyzer = pipelines
+            else:
+                from transformers import pipeline
+                
+                self.backend = 'torch'
+                models = self._load_stored()
+                self.emotion_classifier = pipeline(
+                    "text-classification",
+                    return_all_scores=True,
+                    **models.get(self.EMOTION_MODEL, {'model': self.EMOTION_MODEL})
+                )
+                
+                self.sentiment_analyzer = pipeline(
+                    "sentiment-analysis",
+                    **models.get(self.SENTIMENT_MODEL, {'model': self.SENTIMENT_MODEL})
+                )
             
-            # Sentiment analysis for additional context
-            self.sentiment_analyzer = pipeline(
-                "sentiment-analysis",
-                model="distilbert-base-uncased-finetuned-sst-2-english"
-            )
-            
-            logger.info("✅ Emotion detection models loaded successfully")
+            logger.info(f"✅ Emotion detection models loaded successfully ({self.backend})")
         except Exception as e:
             logger.error(f"❌ Error loading emotion models: {e}")
+            self.load_error = str(e)
             self.emotion_classifier = None
             self.sentiment_analyzer = None
     
+    def _load_stored(self):
+        """Pipeline arguments (model, tokenizer) mapped from the model store, or {} to load normally"""
+        from modules.model_store import model_store, pretrained_loader
+        
+        if not model_store.enabled:
+            return {}
+        try:
+            models = {}
+            for name in (self.EMOTION_MODEL, self.SENTIMENT_MODEL):
+                model, tokenizer, _ = model_store.load(name, pretrained_loader(name))
+                models[name] = {'model': model, 'tokenizer': tokenizer}
+            return models
+        except Exception as e:
+            logger.error(f"❌ Model store unavailable for emotions, loading normally: {e}")
+            return {}
+    
+    def _load_onnx(self):
+        """ONNX Runtime (emotion, sentiment) pipelines, or None to fall back to PyTorch"""
+        from modules import onnx_backend
+        
+        if not onnx_backend.available():
+            logger.warning("onnx/onnxruntime not installed - using PyTorch for emotions")
+            return None
+        
+        try:
+            emotion = onnx_backend.load_classifier(
+                self.EMOTION_MODEL, onnx_backend.transformers_loader(self.EMOTION_MODEL)
+            )
+            sentiment = onnx_backend.load_classifier(
+                self.SENTIMENT_MODEL, onnx_backend.transformers_loader(self.SENTIMENT_MODEL)
+            )
+        except Exception as e:
+            logger.error(f"❌ ONNX emotion models unavailable, using PyTorch: {e}")
+            return None
+        
+        # ONNX scores differ slightly, so they are cached separately
+        self.model_name += '-onnx-int8' if emotion.meta['quantized'] else '-onnx'
+        return onnx_backend.OnnxPipeline(emotion, all_scores=True), onnx_backend.OnnxPipeline(sentiment)
+    
     def analyze_emotion(self, text):
         """
         Analyze emotions in text
@@ -47,38 +123,96 @@ class EmotionDetector:
         if not self.emotion_classifier or not self.sentiment_analyzer:
             return {"error": "Models not loaded"}
         
+        key = self.cache.make_key(self.model_name, text) if isinstance(text, str) else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return self._with_preview(cached, text)
+        
         try:
-            # Get emotion scores
-            emotion_results = self.emotion_classifier(text)[0]
-            emotions = {item['label']: float(item['score']) for item in emotion_results}
-            
-            # Get sentiment
-            sentiment = self.sentiment_analyzer(text)[0]
-            
-            # Find dominant emotion
-            dominant_emotion = max(emotions.items(), key=lambda x: x[1])
+            with _inference_mode(self.backend):
+                # Get emotion scores
+                with metrics.stage('inference', model='emotion'):
+                    emotion_results = self.emotion_classifier(text, truncation=True)[0]
+                
+                # Get sentiment
+                with metrics.stage('inference', model='sentiment'):
+                    sentiment = self.sentiment_analyzer(text, truncation=True)[0]
             
-            # Assess mental health risk
-            mental_health_risk = self._assess_mental_health_risk(emotions)
-            
-            return {
-                'emotions': emotions,
-                'dominant_emotion': {
-                    'name': dominant_emotion[0],
-                    'score': dominant_emotion[1]
-                },
-                'sentiment': {
-                    'label': sentiment['label'],
-                    'score': float(sentiment['score'])
-                },
-                'mental_health_risk': mental_health_risk,
-                'needs_support': bool(mental_health_risk['level'] in ['HIGH', 'CRITICAL']),
-                'text_analyzed': text[:100] + '...' if len(text) > 100 else text
-            }
+            analysis = self._build_result(text, emotion_results, sentiment)
+            if key:
+                self.cache.set(key, analysis)
+            return analysis
         except Exception as e:
             logger.error(f"Error analyzing emotions: {e}")
             return {"error": str(e)}
     
+    def analyze_batch(self, texts, batch_size=None):
+        """
+        Analyze emotions for a list of texts in batched forward passes
+        
+        Texts are ordered by length before batching so each batch pads to
+        a similar length, then results are restored to the input order.
+        
+        Args:
+            texts (list): List of text strings
+            batch_size (int): Messages per forward pass (defaults to self.batch_size)
+            
+        Returns:
+            list: One result dict per text, same format as analyze_emotion
+        """
+        if not self.emotion_classifier or not self.sentiment_analyzer:
+            return [{"error": "Models not loaded"} for _ in texts]
+        
+        batch_size = max(1, int(batch_size or self.batch_size))
+        results = [None] * len(texts)
+        
+        # Cached texts are answered directly; identical misses share one inference
+        pending = {}
+        for i, text in enumerate(texts):
+            if not isinstance(text, str):
+                # Only strings can be batched; anything else is analyzed alone
+                results[i] = self.analyze_emotion(text)
+                continue
+            key = self.cache.make_key(self.model_name, text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[i] = self._with_preview(cached, text)
+            else:
+                pending.setdefault(key, []).append(i)
+        
+        if not pending:
+            return results
+        
+        # Length bucketing: neighbouring texts end up in the same batch
+        keys = sorted(pending, key=lambda key: len(texts[pending[key][0]]))
+        ordered_texts = [texts[pending[key][0]] for key in keys]
+        
+        try:
+            with _inference_mode(self.backend):
+                with metrics.stage('inference', model='emotion'):
+                    emotion_batches = self.emotion_classifier(
+                        ordered_texts, batch_size=batch_size, truncation=True
+                    )
+                with metrics.stage('inference', model='sentiment'):
+                    sentiments = self.sentiment_analyzer(
+                        ordered_texts, batch_size=batch_size, truncation=True
+                    )
+            
+            for key, text, emotion_results, sentiment in zip(keys, ordered_texts, emotion_batches, sentiments):
+                analysis = self._build_result(text, emotion_results, sentiment)
+                self.cache.set(key, analysis)
+                for i in pending[key]:
+                    results[i] = self._with_preview(analysis, texts[i])
+        except Exception as e:
+            # Fall back to per-message analysis so one bad input does not sink the batch
+            logger.error(f"Error analyzing emotion batch, retrying messages individually: {e}")
+            for key in keys:
+                for i in pending[key]:
+                    results[i] = self.analyze_emotion(texts[i])
+        
+        return results
+    
     def analyze_conversation_emotions(self, messages):
         """
         Analyze emotions across multiple messages to detect patterns
@@ -92,40 +226,90 @@ class EmotionDetector:
         if not messages:
             return {"error": "No messages provided"}
         
-        results = []
-        high_risk_count = 0
+        return self.summarize_conversation(messages, self.analyze_batch(messages))
+    
+    @classmethod
+    def summarize_conversation(cls, messages, analyses, include_results=False):
+        """
+        Aggregate per-message results into the conversation summary
         
-        for msg in messages:
-            analysis = self.analyze_emotion(msg)
-            if not analysis.get('error'):
-                results.append(analysis)
-                if analysis['mental_health_risk']['level'] in ['HIGH', 'CRITICAL']:
-                    high_risk_count += 1
+        Args:
+            messages (list): The conversation's messages
+            analyses (list): One analyze_emotion result per message
+            include_results (bool): Include the valid per-message results
+            
+        Returns:
+            dict: Emotional pattern analysis
+        """
+        state = ConversationState()
+        for analysis in analyses:
+            state.add_emotion(analysis)
+        state.message_count = len(messages)
         
-        if not results:
+        summary = cls.summary_from_state(state)
+        if summary is None:
             return {"error": "No valid analyses"}
+        if include_results:
+            summary['individual_results'] = [a for a in analyses if not a.get('error')]
+        return summary
+    
+    @classmethod
+    def summary_from_state(cls, state):
+        """
+        Conversation summary from running aggregates
         
-        # Aggregate emotions
-        emotion_totals = {}
-        for result in results:
-            for emotion, score in result['emotions'].items():
-                emotion_totals[emotion] = emotion_totals.get(emotion, 0) + score
-        
-        # Calculate averages
-        emotion_averages = {k: v/len(results) for k, v in emotion_totals.items()}
+        Args:
+            state (ConversationState): Aggregates of the conversation so far
+            
+        Returns:
+            dict: Emotional pattern analysis, or None before any valid result
+        """
+        if not state.emotion_count:
+            return None
         
         # Detect concerning patterns
-        patterns = self._detect_emotional_patterns(results)
+        patterns = state.patterns()
         
         return {
-            'message_count': len(messages),
-            'high_risk_message_count': high_risk_count,
-            'average_emotions': emotion_averages,
+            'message_count': state.message_count,
+            'high_risk_message_count': state.high_risk_count,
+            'average_emotions': state.emotion_averages(),
             'emotional_patterns': patterns,
-            'overall_mental_health_risk': self._aggregate_mental_health_risk(results),
-            'recommendation': self._get_recommendation(patterns, high_risk_count, len(messages))
+            'overall_mental_health_risk': cls._net_score_level(state.average_net_score()),
+            'recommendation': cls._get_recommendation(patterns, state.high_risk_count, state.message_count)
         }
     
+    @classmethod
+    def _build_result(cls, text, emotion_results, sentiment):
+        """Build the response dict from raw pipeline outputs for one text"""
+        emotions = {item['label']: float(item['score']) for item in emotion_results}
+        
+        # Find dominant emotion
+        dominant_emotion = max(emotions.items(), key=lambda x: x[1])
+        
+        # Assess mental health risk
+        mental_health_risk = cls._assess_mental_health_risk(emotions)
+        
+        return {
+            'emotions': emotions,
+            'dominant_emotion': {
+                'name': dominant_emotion[0],
+                'score': dominant_emotion[1]
+            },
+            'sentiment': {
+                'label': sentiment['label'],
+                'score': float(sentiment['score'])
+            },
+            'mental_health_risk': mental_health_risk,
+            'needs_support': bool(mental_health_risk['level'] in ['HIGH', 'CRITICAL']),
+            'text_analyzed': text[:100] + '...' if len(text) > 100 else text
+        }
+    
+    @staticmethod
+    def _with_preview(analysis, text):
+        """Return a copy of a (possibly cached) result labelled with this text"""
+        return dict(analysis, text_analyzed=text[:100] + '...' if len(text) > 100 else text)
+    
     @staticmethod
     def _assess_mental_health_risk(emotions):
         """Assess mental health risk based on emotion scores"""
@@ -144,58 +328,21 @@ class EmotionDetector:
         # Net emotional state
         net_score = distress_score - positive_score
         
-        if net_score < 0.3:
-            level = "LOW"
-        elif net_score < 0.6:
-            level = "MEDIUM"
-        elif net_score < 0.9:
-            level = "HIGH"
-        else:
-            level = "CRITICAL"
-        
         return {
-            'level': level,
+            'level': EmotionDetector._net_score_level(net_score),
             'distress_score': float(distress_score),
             'positive_score': float(positive_score),
             'net_score': float(net_score)
         }
     
     @staticmethod
-    def _detect_emotional_patterns(results):
-        """Detect concerning emotional patterns"""
-        patterns = []
-        
-        # Check for persistent negative emotions
-        negative_count = sum(1 for r in results 
-                           if r['dominant_emotion']['name'] in ['sadness', 'fear', 'anger'])
-        if negative_count > len(results) * 0.6:
-            patterns.append("persistent_negative_emotions")
-        
-        # Check for emotional escalation
-        if len(results) >= 3:
-            recent_distress = [r['mental_health_risk']['distress_score'] for r in results[-3:]]
-            if all(recent_distress[i] < recent_distress[i+1] for i in range(len(recent_distress)-1)):
-                patterns.append("escalating_distress")
-        
-        # Check for extreme fear or sadness
-        extreme_emotions = sum(1 for r in results 
-                              if r['emotions'].get('fear', 0) > 0.8 or 
-                              r['emotions'].get('sadness', 0) > 0.8)
-        if extreme_emotions > 0:
-            patterns.append("extreme_emotional_distress")
-        
-        return patterns
-    
-    @staticmethod
-    def _aggregate_mental_health_risk(results):
-        """Calculate overall mental health risk"""
-        avg_net_score = sum(r['mental_health_risk']['net_score'] for r in results) / len(results)
-        
-        if avg_net_score < 0.3:
+    def _net_score_level(net_score):
+        """Risk level for a (distress - positive) net score"""
+        if net_score < 0.3:
             return "LOW"
-        elif avg_net_score < 0.6:
+        elif net_score < 0.6:
             return "MEDIUM"
-        elif avg_net_score < 0.9:
+        elif net_score < 0.9:
             return "HIGH"
         else:
             return "CRITICAL"
@@ -214,5 +361,5 @@ class EmotionDetector:
 
 
 # Initialize global detector instance
-emotion_detector = EmotionDetector()
+emotion_detector = lazy.register('emotion', EmotionDetector)
 
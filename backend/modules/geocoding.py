@@ -0,0 +1,362 @@
+"""
+Geocoding Layer
+Reverse geocoding behind a quantized-coordinate cache (in-memory LRU plus an
+optional SQLite store) with an optional offline gazetteer, so location
+scoring never has to wait on Nominatim.
+
+Reverse modes (REVERSE_GEOCODE_MODE):
+    - async: answer from cache or gazetteer, fetch misses in the background
+    - offline: answer from cache or gazetteer only, never touch the network
+    - blocking: fetch misses inline (the original behaviour)
+
+Forward geocoding (place name to coordinates) is cached by normalized query,
+including negative results, and concurrent identical lookups share a single
+upstream call. The upstream backend is pluggable (GEOCODER_BACKEND).
+"""
+from concurrent.futures import Future
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from modules.metrics import metrics
+from modules.result_cache import ResultCache
+from modules.spatial_index import GeoGridIndex
+import pandas as pd
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REVERSE_GEOCODE_MODE = os.getenv('REVERSE_GEOCODE_MODE', 'async')
+REVERSE_GEOCODE_MODES = ('async', 'offline', 'blocking')
+
+# Coordinates are rounded to this many decimals before lookup (3 ~ 110 m cells)
+REVERSE_GEOCODE_PRECISION = int(os.getenv('REVERSE_GEOCODE_PRECISION', '3'))
+
+GEOCODE_CACHE_PATH = os.getenv('GEOCODE_CACHE_PATH', '')
+GEOCODE_CACHE_SIZE = int(os.getenv('GEOCODE_CACHE_SIZE', '50000'))
+GEOCODE_CACHE_TTL = float(os.getenv('GEOCODE_CACHE_TTL', str(30 * 86400)))
+GEOCODE_NEGATIVE_TTL = float(os.getenv('GEOCODE_NEGATIVE_TTL', '86400'))
+
+# Optional CSV of named places (columns: name, lat, lng)
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH', '')
+GAZETTEER_MAX_KM = float(os.getenv('GAZETTEER_MAX_KM', '5'))
+
+# Public Nominatim allows about one request per second
+NOMINATIM_MIN_INTERVAL = 1.0
+NOMINATIM_TIMEOUT = 10
+
+UNKNOWN_LOCATION = "Unknown Location"
+
+# Forward geocoding backend: 'nominatim' or 'static' (JSON file of places)
+GEOCODER_BACKEND = os.getenv('GEOCODER_BACKEND', 'nominatim')
+GEOCODER_STATIC_PLACES = os.getenv('GEOCODER_STATIC_PLACES', '')
+
+
+class ReverseGeocoder:
+    """Cached, non-blocking coordinate-to-name lookup"""
+
+    def __init__(self, geolocator=None, mode=None, precision=None, cache=None, gazetteer_path=None):
+        """
+        Initialize the reverse geocoder
+
+        Args:
+            geolocator: geopy geocoder used for network lookups
+            mode (str): 'async', 'offline' or 'blocking'
+            precision (int): Decimal places kept when quantizing coordinates
+            cache (ResultCache): Cache for resolved names
+            gazetteer_path (str): CSV of named places for offline lookups
+        """
+        self.geolocator = geolocator or Nominatim(user_agent="shesafe_app")
+        self.mode = mode or REVERSE_GEOCODE_MODE
+        if self.mode not in REVERSE_GEOCODE_MODES:
+            raise ValueError(f"Unknown reverse geocode mode: {self.mode}")
+        self.precision = REVERSE_GEOCODE_PRECISION if precision is None else int(precision)
+        self.cache = cache or ResultCache(
+            max_entries=GEOCODE_CACHE_SIZE, ttl=GEOCODE_CACHE_TTL, path=GEOCODE_CACHE_PATH
+        )
+
+        self.gazetteer = self._load_gazetteer(GAZETTEER_PATH if gazetteer_path is None else gazetteer_path)
+
+        # Background fetches for cache misses in async mode
+        self._queue = queue.Queue(maxsize=1000)
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+        self._rate_lock = threading.Lock()
+        self._last_request = 0.0
+
+    def reverse(self, latitude, longitude):
+        """
+        Resolve a coordinate to a human-readable name
+
+        Args:
+            latitude (float): Location latitude
+            longitude (float): Location longitude
+
+        Returns:
+            str: Address or place name ("Unknown Location" if unresolved)
+        """
+        cell = self._quantize(latitude, longitude)
+        key = self.cache.make_key('nominatim-reverse', f"{cell[0]},{cell[1]}")
+
+        cached = self.cache.get(key)
+        if cached is not None and cached.get('address'):
+            return cached['address']
+
+        if self.mode == 'blocking' and cached is None:
+            address = self._fetch(cell, key)
+            if address:
+                return address
+
+        if self.mode == 'async' and cached is None:
+            self._schedule(cell, key)
+
+        return self._nearest_place(latitude, longitude) or UNKNOWN_LOCATION
+
+    def stats(self):
+        """Cache counters plus background queue state"""
+        return {
+            'mode': self.mode,
+            'gazetteer_places': len(self.gazetteer) if self.gazetteer else 0,
+            'pending_lookups': len(self._pending),
+            'cache': self.cache.stats()
+        }
+
+    def _quantize(self, latitude, longitude):
+        """Centre of the coordinate cell used as the cache key"""
+        return (round(float(latitude), self.precision), round(float(longitude), self.precision))
+
+    def _nearest_place(self, latitude, longitude):
+        """Closest gazetteer entry within GAZETTEER_MAX_KM, if any"""
+        if not self.gazetteer:
+            return None
+        nearest = self.gazetteer.nearest(latitude, longitude, k=1, max_km=GAZETTEER_MAX_KM)
+        return nearest[0][1]['name'] if nearest else None
+
+    def _schedule(self, cell, key):
+        """Queue a background lookup unless one is already pending"""
+        if self._worker_pid != os.getpid():
+            with self._start_lock:
+                if self._worker_pid != os.getpid():
+                    # The queue of a forked parent belongs to its worker thread, which did not survive fork
+                    self._queue = queue.Queue(maxsize=1000)
+                    self._pending = set()
+                    self._pending_lock = threading.Lock()
+                    self._worker = None
+                    self._worker_pid = os.getpid()
+
+        with self._pending_lock:
+            if key in self._pending:
+                return
+            try:
+                self._queue.put_nowait((cell, key))
+            except queue.Full:
+                return
+            self._pending.add(key)
+
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run_worker, name='reverse-geocoder', daemon=True
+                )
+                self._worker.start()
+
+    def _run_worker(self):
+        """Drain queued lookups one at a time at the rate Nominatim allows"""
+        while True:
+            cell, key = self._queue.get()
+            try:
+                self._fetch(cell, key)
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+    def _fetch(self, cell, key):
+        """Look a cell up on the network and cache the answer"""
+        with self._rate_lock:
+            wait = self._last_request + NOMINATIM_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request = time.monotonic()
+
+        try:
+            with metrics.stage('reverse_geocode'):
+                location = self.geolocator.reverse(f"{cell[0]}, {cell[1]}", timeout=NOMINATIM_TIMEOUT)
+        except Exception as e:
+            # Transient failures are not cached so the next request retries
+            logger.warning(f"Reverse geocoding failed for {cell}: {e}")
+            return None
+
+        address = location.address if location else None
+        self.cache.set(key, {'address': address}, ttl=None if address else GEOCODE_NEGATIVE_TTL)
+        return address
+
+    @staticmethod
+    def _load_gazetteer(path):
+        """Load named places into a spatial index"""
+        if not path:
+            return None
+        try:
+            places = pd.read_csv(path, usecols=['name', 'lat', 'lng']).dropna().to_dict('records')
+            logger.info(f"✅ Loaded {len(places)} gazetteer places from {path}")
+            return GeoGridIndex(places, cell_km=GAZETTEER_MAX_KM)
+        except Exception as e:
+            logger.error(f"❌ Error loading gazetteer: {e}")
+            return None
+
+
+class NominatimBackend:
+    """Forward geocoding against OpenStreetMap Nominatim"""
+
+    def __init__(self, geolocator=None):
+        self.geolocator = geolocator or Nominatim(user_agent="safecircle_app")
+
+    def geocode(self, query, timeout=NOMINATIM_TIMEOUT):
+        """Return {'latitude', 'longitude', 'address'} or None"""
+        with metrics.stage('geocode'):
+            location = self.geolocator.geocode(query, timeout=timeout)
+        if location:
+            return {
+                'latitude': location.latitude,
+                'longitude': location.longitude,
+                'address': location.address
+            }
+        return None
+
+
+class StaticGeocoderBackend:
+    """Local stand-in geocoder backed by a fixed set of places (tests, offline runs)"""
+
+    def __init__(self, places):
+        """
+        Args:
+            places (dict): Place name -> {'latitude', 'longitude', 'address'}
+        """
+        self.places = {ForwardGeocoder.normalize_query(name): place for name, place in places.items()}
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path):
+        """Load places from a JSON object of name -> location"""
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def geocode(self, query, timeout=None):
+        """Return the stored location for a query, or None"""
+        self.calls += 1
+        place = self.places.get(ForwardGeocoder.normalize_query(query))
+        if place is None:
+            return None
+        return {
+            'latitude': float(place['latitude']),
+            'longitude': float(place['longitude']),
+            'address': place.get('address', query)
+        }
+
+
+class ForwardGeocoder:
+    """Cached, coalescing place-name-to-coordinate lookup"""
+
+    def __init__(self, backend=None, cache=None, timeout=NOMINATIM_TIMEOUT):
+        """
+        Initialize the forward geocoder
+
+        Args:
+            backend: Object with geocode(query, timeout) returning a location dict or None
+            cache (ResultCache): Cache for resolved queries
+            timeout (float): Upstream timeout in seconds
+        """
+        self.backend = backend or make_geocoder_backend()
+        self.cache = cache or ResultCache(
+            max_entries=GEOCODE_CACHE_SIZE, ttl=GEOCODE_CACHE_TTL, path=GEOCODE_CACHE_PATH
+        )
+        self.timeout = timeout
+
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+    @staticmethod
+    def normalize_query(place_name):
+        """Case- and whitespace-insensitive form of a place query"""
+        return ResultCache.normalize_text(place_name).casefold()
+
+    def geocode(self, place_name):
+        """
+        Convert a place name to coordinates
+
+        Args:
+            place_name (str): Free-text place name
+
+        Returns:
+            dict: {'latitude', 'longitude', 'address'} or None if not found
+        """
+        query = self.normalize_query(place_name)
+        if not query:
+            return None
+        key = self.cache.make_key('geocode-forward', query)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached['location']
+
+        # Only the first caller for a query goes upstream; the rest wait on it
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced_calls += 1
+
+        if not owner:
+            try:
+                return future.result(timeout=self.timeout * 2)
+            except Exception:
+                return None
+
+        try:
+            location = self._lookup(place_name.strip(), key)
+            future.set_result(location)
+            return location
+        finally:
+            if not future.done():
+                future.set_result(None)
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        """Upstream, coalescing and cache counters"""
+        return {
+            'upstream_calls': self.upstream_calls,
+            'coalesced_calls': self.coalesced_calls,
+            'inflight': len(self._inflight),
+            'cache': self.cache.stats()
+        }
+
+    def _lookup(self, place_name, key):
+        """Query the backend and cache the answer (misses included)"""
+        self.upstream_calls += 1
+        try:
+            location = self.backend.geocode(place_name, timeout=self.timeout)
+        except (GeocoderTimedOut, GeocoderServiceError) as e:
+            # Transient failures are not cached so the next request retries
+            logger.warning(f"Geocoding failed for '{place_name}': {e}")
+            return None
+
+        self.cache.set(key, {'location': location}, ttl=None if location else GEOCODE_NEGATIVE_TTL)
+        return location
+
+
+def make_geocoder_backend():
+    """Build the forward geocoding backend selected by GEOCODER_BACKEND"""
+    if GEOCODER_BACKEND == 'static':
+        return StaticGeocoderBackend.from_file(GEOCODER_STATIC_PLACES)
+    return NominatimBackend()
@@ -0,0 +1,462 @@
+"""
+Inference Server
+Sits between the routes and the text models. Requests are queued per model
+and a scheduler thread groups them into micro-batches (bounded by batch size
+and wait time) so concurrent requests share one forward pass. Batches run
+in this process or, with INFERENCE_PROCESSES > 0, on a pool of worker
+processes pinned to separate CPU sets. PyTorch weights come from the
+model store (modules/model_store.py), so the workers share one mapped copy.
+A pool whose worker died is replaced on the next batch.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from modules import lazy
+from modules.metrics import metrics
+import multiprocessing
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Most texts in one micro-batch
+INFERENCE_MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', '32'))
+# How long the first request of a batch waits for others to join (ms)
+INFERENCE_MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', '5'))
+# Worker processes holding the models (0 runs inference in this process)
+INFERENCE_PROCESSES = int(os.getenv('INFERENCE_PROCESSES', '0'))
+# torch threads per worker process (0 splits the CPUs evenly)
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', '0'))
+# Seconds a request waits for its result
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', '30'))
+
+MODELS = ('toxicity', 'emotion')
+
+# Batchers: one per model plus the combined analyzer (modules/multi_analyzer.py)
+BATCHERS = MODELS + ('multi',)
+
+# Seconds to wait for every worker to pick up its model load task
+WORKER_LOAD_TIMEOUT = 600
+
+_STOP = object()
+
+
+class InferenceUnavailable(Exception):
+    """No result in time (status 504) or no working inference workers (status 503)"""
+
+    def __init__(self, message, status=503):
+        super().__init__(message)
+        self.status = status
+
+
+class MicroBatcher:
+    """Queue that turns single requests into batched calls"""
+
+    def __init__(self, run_batch, max_batch=None, max_wait_ms=None, concurrency=1, name='batcher'):
+        """
+        Args:
+            run_batch (callable): list of items -> Future resolving to a list of results
+            max_batch (int): Most items per batch
+            max_wait_ms (float): Longest a batch waits to fill after its first item
+            concurrency (int): Batches allowed in flight at once
+            name (str): Scheduler thread name
+        """
+        self.run_batch = run_batch
+        self.max_batch = max(1, int(max_batch or INFERENCE_MAX_BATCH))
+        self.max_wait = (INFERENCE_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue = queue.SimpleQueue()
+        self._slots = threading.Semaphore(max(1, concurrency))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._counters = {'requests': 0, 'batches': 0, 'largest_batch': 0}
+
+    def submit(self, item):
+        """Queue one item; returns a Future for its result"""
+        self.start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def start(self):
+        """Start the scheduler in this process if it is not running"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive fork; a child starts its own
+            self._queue = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        if self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._pid = None
+
+    def stats(self):
+        counters = dict(self._counters)
+        counters['average_batch'] = round(counters['requests'] / counters['batches'], 2) if counters['batches'] else 0
+        counters['queued'] = self._queue.qsize()
+        return counters
+
+    def _run(self):
+        while True:
+            # Wait for a free slot first so requests arriving meanwhile join the next batch
+            self._slots.acquire()
+            batch = self._collect()
+            if batch is None:
+                return
+            self._counters['requests'] += len(batch)
+            self._counters['batches'] += 1
+            self._counters['largest_batch'] = max(self._counters['largest_batch'], len(batch))
+            metrics.observe('shesafe_inference_batch_size', len(batch), batcher=self.name)
+
+            futures = [future for _, future in batch]
+            try:
+                pending = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                self._slots.release()
+                self._fail(futures, e)
+                continue
+            pending.add_done_callback(lambda done, futures=futures: self._resolve(futures, done))
+
+    def _collect(self):
+        """Block for the first item, then take more until the batch is full or time is up"""
+        entry = self._queue.get()
+        if entry is _STOP:
+            return None
+        batch = [entry]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _resolve(self, futures, done):
+        self._slots.release()
+        try:
+            results = done.result()
+        except Exception as e:
+            self._fail(futures, e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(futures, error):
+        logger.error(f"Error running inference batch: {error}")
+        for future in futures:
+            future.set_exception(error)
+
+
+class InferenceServer:
+    """Micro-batched access to the toxicity and emotion models"""
+
+    def __init__(self, processes=None, max_batch=None, max_wait_ms=None, threads=None):
+        """
+        Args:
+            processes (int): Worker processes (0 runs batches on a thread here)
+            max_batch (int): Most texts per batch
+            max_wait_ms (float): Longest a batch waits to fill
+            threads (int): torch threads per worker process (0 splits the CPUs)
+        """
+        self.processes = INFERENCE_PROCESSES if processes is None else max(0, int(processes))
+        self.threads = INFERENCE_THREADS if threads is None else int(threads)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+        concurrency = self.processes or 1
+        self._executor = None
+        self._executor_pid = None
+        self.batchers = {
+            name: MicroBatcher(
+                lambda texts, name=name: self._run_batch(name, texts),
+                max_batch, max_wait_ms, concurrency, name=f"batcher-{name}"
+            )
+            for name in BATCHERS
+        }
+
+        if self.processes:
+            # The models live in the workers; readiness tracks them instead of local
+            # copies (imported first so this registration replaces theirs)
+            for name in MODELS:
+                _detector(name)
+                lazy.register(name, lambda name=name: self._load_in_workers(name))
+
+    def analyze(self, model, text, timeout=None):
+        """
+        Analyze one text, batched with concurrent requests
+
+        Args:
+            model (str): 'toxicity', 'emotion' or 'multi' (all models at once)
+            text (str): Text to analyze
+
+        Returns:
+            dict: Same result as the detector's (or MultiAnalyzer's) single-text analysis
+
+        Raises:
+            InferenceUnavailable: On a timeout (504) or when the workers died (503)
+        """
+        timeout = timeout or INFERENCE_TIMEOUT
+        try:
+            return self.batchers[model].submit(text).result(timeout)
+        except FutureTimeoutError:
+            raise InferenceUnavailable(f"No {model} result within {timeout:g}s", 504)
+        except BrokenProcessPool:
+            raise InferenceUnavailable("Inference workers are restarting", 503)
+        except Exception as e:
+            logger.error(f"Error analyzing text with {model}: {e}")
+            return {"error": str(e) or type(e).__name__}
+
+    def analyze_many(self, model, texts, timeout=None):
+        """
+        Analyze several texts; each one joins whichever batch is forming
+
+        Raises:
+            InferenceUnavailable: Like analyze, if any text gets no result
+        """
+        futures = [self.batchers[model].submit(text) for text in texts]
+        timeout = timeout or INFERENCE_TIMEOUT
+        deadline = time.monotonic() + timeout
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(max(0.0, deadline - time.monotonic())))
+            except FutureTimeoutError:
+                raise InferenceUnavailable(f"No {model} results within {timeout:g}s", 504)
+            except BrokenProcessPool:
+                raise InferenceUnavailable("Inference workers are restarting", 503)
+            except Exception as e:
+                results.append({"error": str(e) or type(e).__name__})
+        return results
+
+    def analyze_conversation(self, model, messages, timeout=None, **options):
+        """
+        Conversation summary built from micro-batched per-message results
+
+        Extra keyword options (e.g. include_results) go to the detector's
+        summarize_conversation.
+        """
+        if not messages:
+            return {"error": "No messages provided"}
+        return _detector_class(model).summarize_conversation(
+            messages, self.analyze_many(model, messages, timeout), **options
+        )
+
+    def is_loaded(self, model):
+        return lazy.status([model])[model]['state'] == 'ready'
+
+    def stats(self, model=None):
+        names = [model] if model else list(self.batchers)
+        return {
+            'processes': self.processes,
+            'batchers': {name: self.batchers[name].stats() for name in names}
+        }
+
+    def shutdown(self):
+        for batcher in self.batchers.values():
+            batcher.stop()
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _run_batch(self, model, texts):
+        if not self.processes:
+            return self._local_executor().submit(_analyze_batch, model, texts)
+        pool = self._worker_pool()
+        try:
+            pending = pool.submit(_analyze_batch, model, texts)
+        except BrokenProcessPool:
+            self._replace_pool(pool)
+            raise
+        pending.add_done_callback(lambda done: self._check_pool(pool, done))
+        return pending
+
+    def _check_pool(self, pool, done):
+        """Replace the pool once a worker death has broken it"""
+        if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+            self._replace_pool(pool)
+
+    def _replace_pool(self, pool):
+        """Drop a broken pool; the next batch starts a new one and reloads the models there"""
+        with self._pool_lock:
+            if self._pool is not pool:
+                return
+            logger.error("❌ An inference worker died; restarting the worker pool")
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        # Load in the new workers ahead of the next requests, as at startup
+        loaded = [name for name in MODELS if self.is_loaded(name)]
+        threading.Thread(target=self._reload_in_workers, args=(loaded,), name='inference-reload',
+                         daemon=True).start()
+
+    def _reload_in_workers(self, models):
+        for model in models:
+            try:
+                error = self._load_in_workers(model).load_error
+            except Exception as e:
+                error = str(e)
+            if error:
+                logger.error(f"❌ Error reloading {model} in the inference workers: {error}")
+
+    def _local_executor(self):
+        """Thread running in-process batches, started per process like the pool"""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            return self._executor
+        with self._pool_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = _native_executor()
+                self._executor_pid = os.getpid()
+        return self._executor
+
+    def _worker_pool(self):
+        """Process pool for this process, started on first use"""
+        if self._pool is not None and self._pool_pid == os.getpid():
+            return self._pool
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                # Forked before any model is loaded here, so workers start small
+                context = multiprocessing.get_context('fork')
+                self._barrier = context.Barrier(self.processes)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=context, initializer=_init_worker,
+                    initargs=(context.Value('i', 0), self.processes, self.threads, self._barrier)
+                )
+                self._pool_pid = os.getpid()
+        return self._pool
+
+    def _load_in_workers(self, model):
+        """Load a model in every worker process (one task per worker via a barrier)"""
+        with self._load_lock:
+            pool = self._worker_pool()
+            tasks = [pool.submit(_load_model, model) for _ in range(self.processes)]
+            errors = [error for error in (task.result() for task in tasks) if error]
+        return _RemoteModel(model, errors[0] if errors else None)
+
+
+class _RemoteModel:
+    """Load result of a model held by the worker processes"""
+
+    def __init__(self, name, load_error):
+        self.name = name
+        self.load_error = load_error
+
+
+def _native_executor():
+    """
+    Single-thread executor for forward passes
+
+    Under gevent (serve.py) threads are greenlets, and a forward pass on one
+    would stall the event loop; gevent's executor uses a real OS thread, so
+    sockets keep being served while torch (which releases the GIL) computes.
+    """
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            return NativeThreadPoolExecutor(max_workers=1)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+
+
+def _detector_class(model):
+    if model == 'toxicity':
+        from modules.toxicity_detector import ToxicityDetector
+        return ToxicityDetector
+    from modules.emotion_detector import EmotionDetector
+    return EmotionDetector
+
+
+def _detector(model):
+    if model == 'toxicity':
+        from modules.toxicity_detector import toxicity_detector
+        return toxicity_detector
+    from modules.emotion_detector import emotion_detector
+    return emotion_detector
+
+
+def _analyze_batch(model, texts):
+    if model == 'multi':
+        from modules.multi_analyzer import multi_analyzer
+        return multi_analyzer.analyze_batch(texts)
+    return _detector(model).analyze_batch(texts)
+
+
+# Worker process state
+_worker_barrier = None
+
+
+def _init_worker(counter, processes, threads, barrier):
+    """Pin a worker to its share of the CPUs and size torch's thread pool to match"""
+    global _worker_barrier
+    _worker_barrier = barrier
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    pin_process(index, processes, threads)
+
+
+def pin_process(index, processes, threads=0):
+    """
+    Pin this process to its share of the CPUs and size torch's thread pool to match
+
+    Args:
+        index (int): This process's position among its siblings
+        processes (int): Number of sibling processes splitting the CPUs
+        threads (int): torch threads (0 uses the CPUs this process got)
+
+    Returns:
+        int: torch threads set
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+    per_worker = max(1, len(cpus) // processes) if cpus else 0
+    if cpus:
+        start = (index * per_worker) % len(cpus)
+        os.sched_setaffinity(0, cpus[start:start + per_worker])
+
+    threads = threads or per_worker or 1
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    return threads
+
+
+def _load_model(model):
+    """Load a model here; the barrier holds this worker until every worker has a task"""
+    try:
+        _worker_barrier.wait(WORKER_LOAD_TIMEOUT)
+    except threading.BrokenBarrierError:
+        return "Inference workers did not all start"
+    detector = _detector(model)
+    try:
+        detector.lazy_load()
+    except Exception as e:
+        return str(e)
+    return getattr(detector, 'load_error', None)
+
+
+# Initialize global inference server instance
+inference_server = InferenceServer()
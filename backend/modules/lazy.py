@@ -0,0 +1,148 @@
+"""
+Lazy Component Loading
+Module singletons (models, scorers, the SOS system) are registered as lazy
+proxies that build the real object on first use, so importing the app is
+cheap and /api/health answers immediately. A background warm-up thread
+loads the components a worker hosts, and readiness is reported separately
+from liveness.
+
+SHESAFE_MODULES selects which components a worker hosts (comma separated,
+default: all of them).
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ALL_MODULES = ('sos', 'safety', 'toxicity', 'emotion')
+
+SHESAFE_MODULES = os.getenv('SHESAFE_MODULES', ','.join(ALL_MODULES))
+
+# Load hosted components in the background at startup ('0' to disable)
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', '1') not in ('0', 'false', 'no')
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class LazyProxy:
+    """Stands in for an object until it is first used, then forwards to it"""
+
+    def __init__(self, name, factory):
+        """
+        Args:
+            name (str): Component name (one of ALL_MODULES)
+            factory (callable): Builds the real object
+        """
+        object.__setattr__(self, '_lazy_name', name)
+        object.__setattr__(self, '_lazy_factory', factory)
+        object.__setattr__(self, '_lazy_target', None)
+        object.__setattr__(self, '_lazy_lock', threading.Lock())
+        object.__setattr__(self, '_lazy_state', {'state': 'pending'})
+
+    def __getattr__(self, attribute):
+        return getattr(self.lazy_load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self.lazy_load(), attribute, value)
+
+    def __repr__(self):
+        return f"<LazyProxy {self._lazy_name} ({self._lazy_state['state']})>"
+
+    @property
+    def lazy_loaded(self):
+        return self._lazy_target is not None
+
+    def lazy_load(self):
+        """Build the object if needed and return it"""
+        target = self._lazy_target
+        if target is not None:
+            return target
+
+        with self._lazy_lock:
+            if self._lazy_target is None:
+                started = time.monotonic()
+                object.__setattr__(self, '_lazy_state', {'state': 'loading'})
+                try:
+                    target = self._lazy_factory()
+                except Exception as e:
+                    object.__setattr__(self, '_lazy_state', {'state': 'failed', 'error': str(e)})
+                    logger.error(f"❌ Error loading {self._lazy_name}: {e}")
+                    raise
+                object.__setattr__(self, '_lazy_target', target)
+                state = {'state': 'ready', 'load_seconds': round(time.monotonic() - started, 2)}
+                # Components that degrade instead of raising report it via load_error
+                load_error = getattr(target, 'load_error', None)
+                if load_error:
+                    state.update(state='failed', error=load_error)
+                else:
+                    logger.info(f"✅ {self._lazy_name} loaded in {state['load_seconds']}s")
+                object.__setattr__(self, '_lazy_state', state)
+        return self._lazy_target
+
+    def lazy_status(self):
+        """{'state': pending | loading | ready | failed, ...}"""
+        return dict(self._lazy_state)
+
+
+def register(name, factory):
+    """Create and register the lazy singleton for a component"""
+    proxy = LazyProxy(name, factory)
+    with _registry_lock:
+        _registry[name] = proxy
+    return proxy
+
+
+def override(name, factory):
+    """Swap a component's factory before it loads (e.g. stub models for load tests)"""
+    with _registry_lock:
+        proxy = _registry[name]
+    with proxy._lazy_lock:
+        if proxy._lazy_target is not None:
+            raise RuntimeError(f"{name} is already loaded")
+        object.__setattr__(proxy, '_lazy_factory', factory)
+    return proxy
+
+
+def hosted_modules():
+    """Component names this worker serves, from SHESAFE_MODULES"""
+    names = [name.strip() for name in SHESAFE_MODULES.split(',') if name.strip()]
+    unknown = [name for name in names if name not in ALL_MODULES]
+    if unknown:
+        raise ValueError(f"Unknown SHESAFE_MODULES entries: {', '.join(unknown)}")
+    return names
+
+
+def status(names=None):
+    """Load state of registered components"""
+    names = names or list(_registry)
+    return {
+        name: _registry[name].lazy_status() if name in _registry else {'state': 'not registered'}
+        for name in names
+    }
+
+
+def is_ready(names=None):
+    """Whether every listed component has loaded"""
+    return all(state['state'] == 'ready' for state in status(names).values())
+
+
+def warm_up(names=None):
+    """Load components now, in order, logging instead of raising failures"""
+    for name in names or list(_registry):
+        proxy = _registry.get(name)
+        if proxy is None:
+            continue
+        try:
+            proxy.lazy_load()
+        except Exception:
+            pass
+
+
+def start_warmup(names=None):
+    """Load components on a background thread"""
+    thread = threading.Thread(target=warm_up, args=(names,), name='warmup', daemon=True)
+    thread.start()
+    return thread
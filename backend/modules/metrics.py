@@ -0,0 +1,251 @@
+"""
+Metrics
+Counters and latency histograms for routes and internal stages
+(tokenization, forward pass, geodesic loop, reverse geocoding, Twilio),
+exposed in the Prometheus text format on /metrics.
+
+Each thread records into its own shard, so the hot path takes no lock:
+a timer is two perf_counter calls, a bisect and two list updates. Shards
+are only summed when /metrics is scraped. With METRICS_ENABLED=0 every
+call returns immediately.
+"""
+from bisect import bisect_left
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Record metrics and serve /metrics (0 turns every timer into a no-op)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the inference batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Timer:
+    """Context manager that observes its elapsed time into a histogram"""
+
+    __slots__ = ('registry', 'name', 'labels', 'started')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry._observe(self.name, self.labels, time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    """Shared do-nothing timer used while metrics are disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """Lock-free counters and histograms with per-thread shards"""
+
+    def __init__(self, enabled=None):
+        """
+        Args:
+            enabled (bool): Record metrics (defaults to METRICS_ENABLED)
+        """
+        self.enabled = METRICS_ENABLED if enabled is None else enabled
+        self._metrics = {}
+        self._collectors = []
+        self._local = threading.local()
+        self._shards = []
+        # Totals of shards whose threads have exited
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text, buckets=None):
+        """
+        Declare a metric
+
+        Args:
+            name (str): Metric name
+            kind (str): 'counter', 'histogram' or 'gauge'
+            help_text (str): HELP line
+            buckets (tuple): Histogram bucket upper bounds (defaults to LATENCY_BUCKETS)
+        """
+        self._metrics[name] = (kind, help_text, tuple(buckets or LATENCY_BUCKETS))
+
+    def add_collector(self, collect):
+        """
+        Add a callable run on every scrape
+
+        It returns (name, labels, value) tuples for gauges declared with describe().
+        """
+        self._collectors.append(collect)
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter"""
+        if not self.enabled:
+            return
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record a histogram observation"""
+        if self.enabled:
+            self._observe(name, tuple(sorted(labels.items())), value)
+
+    def timer(self, name, **labels):
+        """Context manager timing its block into a histogram"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, tuple(sorted(labels.items())))
+
+    def stage(self, stage, **labels):
+        """Time an internal stage (tokenize, forward, geodesic, ...)"""
+        if not self.enabled:
+            return _NULL_TIMER
+        labels['stage'] = stage
+        return _Timer(self, 'shesafe_stage_duration_seconds', tuple(sorted(labels.items())))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        totals = self._totals()
+        series = {}
+        for (name, labels), value in totals.items():
+            series.setdefault(name, []).append((labels, value))
+
+        gauges = {}
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {e}")
+
+        lines = []
+        for name in sorted(set(series) | set(gauges)):
+            kind, help_text, buckets = self._metrics.get(name, ('untyped', '', LATENCY_BUCKETS))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(gauges.get(name, [])):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for labels, value in sorted(series.get(name, [])):
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (math.inf,), value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Current totals as {(name, labels): value}, mainly for tests and benchmarks"""
+        return self._totals()
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+            self._retired.clear()
+
+    def _observe(self, name, labels, value):
+        shard = self._shard()
+        key = (name, labels)
+        histogram = shard.get(key)
+        if histogram is None:
+            buckets = self._metrics.get(name, (None, None, LATENCY_BUCKETS))[2]
+            # One count per bucket plus +Inf, then the sum and the bucket bounds
+            histogram = shard[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram.append(buckets)
+        histogram[bisect_left(histogram[-1], value)] += 1
+        histogram[-2] += value
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            # Fold the shard into the retired totals when its thread goes away
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+            return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards = [s for s in self._shards if s is not shard]
+            _add_into(self._retired, shard)
+
+    def _totals(self):
+        with self._lock:
+            totals = {}
+            _add_into(totals, self._retired)
+            for shard in self._shards:
+                _add_into(totals, shard)
+        return {key: value[:-1] if isinstance(value, list) else value for key, value in totals.items()}
+
+
+def _add_into(totals, shard):
+    # list() copies the items in one step, so other threads may keep recording
+    for key, value in list(shard.items()):
+        if isinstance(value, list):
+            current = totals.get(key)
+            if current is None:
+                totals[key] = list(value)
+            else:
+                for i in range(len(value) - 1):
+                    current[i] += value[i]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Initialize global metrics registry
+metrics = MetricsRegistry()
+
+metrics.describe('shesafe_http_requests_total', 'counter', 'HTTP requests by route and status')
+metrics.describe('shesafe_http_request_duration_seconds', 'histogram', 'HTTP request latency by route')
+metrics.describe('shesafe_stage_duration_seconds', 'histogram', 'Time spent in internal stages')
+metrics.describe('shesafe_inference_batch_size', 'histogram', 'Texts per micro-batch', BATCH_SIZE_BUCKETS)
+metrics.describe('shesafe_module_ready', 'gauge', 'Whether a hosted module has loaded (1) or not (0)')
+metrics.describe('shesafe_inference_queue_depth', 'gauge', 'Texts waiting for a micro-batch')
@@ -0,0 +1,275 @@
+"""
+Model Store
+Local safetensors cache for the PyTorch models. Weights are memory-mapped
+read-only from the cache and become the model's parameters without a copy.
+Every process that loads a model maps the same file, so they all share one
+copy in the page cache. This covers serve.py workers, inference worker
+processes and separate app instances: each extra process adds almost no
+memory.
+
+The first process to need a model loads it from its original source
+(Detoxify checkpoint, Hugging Face hub) and writes it to the store while
+holding a file lock. Processes that arrive meanwhile wait for the lock and
+then map the finished files. A model is loaded the slow way once and
+shared by every worker after that.
+"""
+from contextlib import contextmanager
+import inspect
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import warnings
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Directory of memory-mapped model weights ('' loads models the usual way)
+MODEL_STORE_DIR = os.getenv('MODEL_STORE_DIR', 'models/store')
+# Seconds a process waits for another one to finish storing a model
+MODEL_STORE_LOCK_TIMEOUT = float(os.getenv('MODEL_STORE_LOCK_TIMEOUT', '1800'))
+
+WEIGHTS_FILE = 'model.safetensors'
+META_FILE = 'store.json'
+
+# safetensors dtype names -> torch dtype names
+DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'bfloat16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool'
+}
+
+
+def available():
+    """Whether torch (with load_state_dict(assign=...)), transformers and safetensors are installed"""
+    try:
+        import safetensors  # noqa: F401
+        import torch
+        import transformers  # noqa: F401
+    except ImportError:
+        return False
+    return 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+
+class ModelStore:
+    """Memory-mapped safetensors copies of PyTorch sequence classifiers"""
+
+    def __init__(self, directory=None):
+        """
+        Args:
+            directory (str): Store root (defaults to MODEL_STORE_DIR; '' disables the store)
+        """
+        self.directory = MODEL_STORE_DIR if directory is None else directory
+        self._lock = threading.Lock()
+        # Open mappings; the parameters are views into them
+        self._maps = {}
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and available()
+
+    def path(self, name):
+        return os.path.join(self.directory, name.replace('/', '--'))
+
+    def load(self, name, load_model):
+        """
+        Model and tokenizer for `name`, with the weights mapped from the store
+
+        Args:
+            name (str): Model name (e.g. a Hugging Face id)
+            load_model (callable): Returns (model, tokenizer, meta) from the
+                original source; only called while the store has no copy.
+                meta is a JSON-serializable dict kept with the weights.
+
+        Returns:
+            tuple: (model, tokenizer, meta)
+        """
+        path = self.path(name)
+        with self._lock:
+            if not _complete(path):
+                os.makedirs(self.directory, exist_ok=True)
+                with _file_lock(f"{path}.lock", MODEL_STORE_LOCK_TIMEOUT):
+                    # Another process may have stored it while this one waited
+                    if not _complete(path):
+                        started = time.monotonic()
+                        model, tokenizer, meta = load_model()
+                        self._save(path, model, tokenizer, meta)
+                        logger.info(f"✅ Stored {name} in {path} ({time.monotonic() - started:.1f}s)")
+                        # Dropped here: this process maps the stored copy like every other one
+                        del model
+            return self._open(path)
+
+    def mapped_bytes(self):
+        """Bytes of weights mapped by this process"""
+        return sum(len(mapped) for mapped in self._maps.values())
+
+    @staticmethod
+    def _save(path, model, tokenizer, meta):
+        """Write the model under a temporary name, then rename it into place"""
+        from safetensors.torch import save_model
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        # save_model keeps one name per group of tied (shared) tensors
+        save_model(model, os.path.join(tmp_path, WEIGHTS_FILE))
+        model.config.save_pretrained(tmp_path)
+        tokenizer.save_pretrained(tmp_path)
+        with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+            json.dump(dict(meta or {}, model_class=type(model).__name__), f, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+
+    def _open(self, path):
+        """Build the model around tensors mapped from the stored weights"""
+        import transformers
+
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        config = transformers.AutoConfig.from_pretrained(path)
+        with _skip_init():
+            model = getattr(transformers, meta.pop('model_class'))(config)
+        # Skipping init also skips tying (from_pretrained would tie after loading)
+        if hasattr(model, 'tie_weights'):
+            model.tie_weights()
+
+        # Groups of parameter names that are one tensor (tied weights)
+        shared = {}
+        for key, tensor in model.state_dict(keep_vars=True).items():
+            shared.setdefault(id(tensor), []).append(key)
+
+        weights = os.path.join(path, WEIGHTS_FILE)
+        if weights not in self._maps:
+            self._maps[weights] = _map_file(weights)
+        state = map_tensors(self._maps[weights])
+        missing, unexpected = model.load_state_dict(state, strict=False, assign=True)
+        _retie(model, [keys for keys in shared.values() if len(keys) > 1], state)
+
+        tied = {key for keys in shared.values() if len(keys) > 1 for key in keys}
+        missing = [key for key in missing if key not in tied]
+        if missing or unexpected:
+            raise ValueError(f"Stored weights in {path} do not match the model "
+                             f"(missing {missing[:5]}, unexpected {unexpected[:5]})")
+
+        model.eval()
+        model.requires_grad_(False)
+        return model, transformers.AutoTokenizer.from_pretrained(path), meta
+
+
+def pretrained_loader(model_name):
+    """load_model callable for a Hugging Face sequence classification model"""
+    def load():
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        return (AutoModelForSequenceClassification.from_pretrained(model_name),
+                AutoTokenizer.from_pretrained(model_name), {})
+    return load
+
+
+def map_tensors(mapped):
+    """
+    Tensors of a safetensors file as views into its mapping (no copy)
+
+    Args:
+        mapped (mmap.mmap): Read-only mapping of the file
+
+    Returns:
+        dict: name -> torch.Tensor
+    """
+    import torch
+
+    header_size = struct.unpack('<Q', mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_size])
+    header.pop('__metadata__', None)
+    base = 8 + header_size
+
+    tensors = {}
+    with warnings.catch_warnings():
+        # The mapping is read-only on purpose; nothing writes to inference weights
+        warnings.filterwarnings('ignore', message='The given buffer is not writable')
+        for name, info in header.items():
+            dtype = getattr(torch, DTYPES[info['dtype']])
+            start, end = info['data_offsets']
+            count = (end - start) // dtype.itemsize
+            tensor = (torch.frombuffer(mapped, dtype=dtype, count=count, offset=base + start)
+                      if count else torch.empty(0, dtype=dtype))
+            tensors[name] = tensor.view(info['shape'])
+    return tensors
+
+
+def _map_file(path):
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # Read ahead now rather than page-faulting through the first requests
+    if hasattr(mmap, 'MADV_WILLNEED'):
+        mapped.madvise(mmap.MADV_WILLNEED)
+    return mapped
+
+
+def _complete(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def _retie(model, groups, state):
+    """Point every name of a tied group at the stored tensor (assign replaced only one)"""
+    for keys in groups:
+        stored = next((key for key in keys if key in state), None)
+        if stored is None:
+            continue
+        source = model.get_parameter(stored) if _is_parameter(model, stored) else model.get_buffer(stored)
+        for key in keys:
+            if key != stored:
+                module_name, _, attribute = key.rpartition('.')
+                setattr(model.get_submodule(module_name), attribute, source)
+
+
+def _is_parameter(model, key):
+    try:
+        model.get_parameter(key)
+        return True
+    except AttributeError:
+        return False
+
+
+@contextmanager
+def _skip_init():
+    """Skip random weight initialization; every weight is replaced by a stored one"""
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        yield
+        return
+    with no_init_weights():
+        yield
+
+
+@contextmanager
+def _file_lock(path, timeout):
+    """Exclusive lock shared by every process using the store"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'w') as f:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for {path}")
+                time.sleep(0.5)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Initialize global model store instance
+model_store = ModelStore()
@@ -0,0 +1,308 @@
+"""
+Combined Text Analysis
+Runs toxicity, emotion and sentiment for a message in one pass. Each text
+is tokenized and truncated once per distinct tokenizer (heads whose
+tokenizers are identical share the encoding, e.g. Detoxify's BERT and the
+DistilBERT sentiment model), the model heads run concurrently (one after
+another under gevent), and the outputs are merged into one response built with the detectors' own result
+formats, so each part matches /api/toxicity/analyze and /api/emotion/analyze.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from modules import onnx_backend
+from modules.metrics import metrics
+from modules.emotion_detector import EmotionDetector, emotion_detector
+from modules.toxicity_detector import ToxicityDetector, toxicity_detector
+import numpy as np
+import hashlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAX_SEQUENCE_LENGTH = 512
+
+
+class ModelHead:
+    """One classifier (PyTorch or ONNX Runtime) fed with pre-tokenized input"""
+
+    def __init__(self, name, encoder, max_length, pad_id, pad_token, labels, run):
+        """
+        Args:
+            name (str): Head name
+            encoder: tokenizers.Tokenizer without truncation or padding set
+            max_length (int): Truncation length in tokens
+            pad_id (int): Padding token id
+            pad_token (str): Padding token
+            labels (list): Class names in output order
+            run (callable): (input_ids, attention_mask) -> probabilities array
+        """
+        self.name = name
+        self.labels = list(labels)
+        self.run = run
+        # Heads with the same fingerprint produce identical input ids
+        self.fingerprint = hashlib.sha1(
+            f"{encoder.to_str()}|{max_length}|{pad_id}".encode()
+        ).hexdigest()
+
+        encoder.enable_truncation(max_length)
+        encoder.enable_padding(pad_id=pad_id, pad_token=pad_token)
+        self.encoder = encoder
+
+    @classmethod
+    def from_torch(cls, name, model, tokenizer, labels, activation):
+        """Head for a transformers sequence classification model"""
+        import torch
+
+        def run(input_ids, attention_mask):
+            with torch.inference_mode():
+                logits = model(
+                    input_ids=torch.from_numpy(input_ids), attention_mask=torch.from_numpy(attention_mask)
+                ).logits
+            return onnx_backend.activate(logits.float().numpy(), activation)
+
+        model.eval()
+        return cls(
+            name, onnx_backend.fast_tokenizer(tokenizer),
+            min(int(tokenizer.model_max_length), MAX_SEQUENCE_LENGTH),
+            tokenizer.pad_token_id, tokenizer.pad_token, labels, run
+        )
+
+    @classmethod
+    def from_onnx(cls, name, classifier):
+        """Head for an onnx_backend.OnnxClassifier"""
+        from tokenizers import Tokenizer
+
+        encoder = Tokenizer.from_str(classifier.tokenizer.to_str())
+        encoder.no_truncation()
+        encoder.no_padding()
+        meta = classifier.meta
+        return cls(name, encoder, meta['max_length'], meta['pad_id'], meta['pad_token'],
+                   classifier.labels, classifier.run)
+
+    def forward(self, input_ids, attention_mask):
+        """Probabilities for tokenized input, timed as this head's forward pass"""
+        with metrics.stage('forward', model=self.name):
+            return self.run(input_ids, attention_mask)
+
+    def encode(self, texts):
+        """Token ids and attention mask (int64 arrays) for a list of texts"""
+        encodings = self.encoder.encode_batch(texts)
+        return (
+            np.array([e.ids for e in encodings], dtype=np.int64),
+            np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        )
+
+
+class MultiAnalyzer:
+    """Toxicity, emotion and sentiment for the same texts with shared tokenization"""
+
+    def __init__(self, toxicity=None, emotion=None):
+        """
+        Args:
+            toxicity: ToxicityDetector (defaults to the global detector)
+            emotion: EmotionDetector (defaults to the global detector)
+        """
+        self.toxicity = toxicity if toxicity is not None else toxicity_detector
+        self.emotion = emotion if emotion is not None else emotion_detector
+        self._heads = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def analyze(self, text):
+        """
+        Analyze one text with every model
+
+        Returns:
+            dict: {'toxicity', 'emotion', 'sentiment', 'text_analyzed'}
+        """
+        return self.analyze_batch([text])[0]
+
+    def analyze_batch(self, texts):
+        """
+        Analyze a list of texts with every model
+
+        Cached per-model results are reused and new ones are cached under the
+        same keys the individual detectors use.
+
+        Returns:
+            list: One merged result per text
+        """
+        toxicity_results = [None] * len(texts)
+        emotion_results = [None] * len(texts)
+
+        # Texts whose results are not cached yet, per detector
+        pending = {'toxicity': [], 'emotion': []}
+        for i, text in enumerate(texts):
+            if not isinstance(text, str):
+                toxicity_results[i] = self.toxicity.analyze_text(text)
+                emotion_results[i] = self.emotion.analyze_emotion(text)
+                continue
+            for name, detector, results in (('toxicity', self.toxicity, toxicity_results),
+                                            ('emotion', self.emotion, emotion_results)):
+                cached = detector.cache.get(detector.cache.make_key(detector.model_name, text))
+                if cached is not None:
+                    results[i] = detector._with_preview(cached, text)
+                else:
+                    pending[name].append(i)
+
+        if pending['toxicity'] or pending['emotion']:
+            try:
+                self._run_heads(texts, pending, toxicity_results, emotion_results)
+            except Exception as e:
+                # Fall back to the detectors so one bad input does not sink the batch
+                logger.error(f"Error in combined analysis, using the detectors directly: {e}")
+                for i in pending['toxicity']:
+                    toxicity_results[i] = self.toxicity.analyze_text(texts[i])
+                for i in pending['emotion']:
+                    emotion_results[i] = self.emotion.analyze_emotion(texts[i])
+
+        return [
+            self._merge(text, toxicity, emotion)
+            for text, toxicity, emotion in zip(texts, toxicity_results, emotion_results)
+        ]
+
+    def stats(self):
+        """Heads and how many tokenizations each text needs"""
+        heads = self._heads or {}
+        return {
+            'heads': {name: head.fingerprint[:12] for name, head in heads.items()},
+            'tokenizations_per_text': len({head.fingerprint for head in heads.values()})
+        }
+
+    def _run_heads(self, texts, pending, toxicity_results, emotion_results):
+        heads = self._load_heads()
+        toxicity_pending = pending['toxicity']
+        emotion_pending = pending['emotion']
+
+        # Missing models report their error the same way the detectors do
+        if toxicity_pending and 'toxicity' not in heads:
+            for i in toxicity_pending:
+                toxicity_results[i] = {"error": "Model not loaded"}
+            toxicity_pending = []
+        if emotion_pending and not ('emotion' in heads and 'sentiment' in heads):
+            for i in emotion_pending:
+                emotion_results[i] = {"error": "Models not loaded"}
+            emotion_pending = []
+
+        needed = {'toxicity': toxicity_pending, 'emotion': emotion_pending, 'sentiment': emotion_pending}
+
+        # Tokenize once per distinct tokenizer, over the union of texts its heads need
+        groups = {}
+        for name, indices in needed.items():
+            if indices:
+                groups.setdefault(heads[name].fingerprint, []).append(name)
+
+        calls = {}
+        for names in groups.values():
+            indices = sorted(set().union(*(needed[name] for name in names)))
+            with metrics.stage('tokenize', model='+'.join(names)):
+                input_ids, attention_mask = heads[names[0]].encode([texts[i] for i in indices])
+            position = {i: row for row, i in enumerate(indices)}
+            for name in names:
+                rows = [position[i] for i in needed[name]]
+                calls[name] = (heads[name], input_ids[rows], attention_mask[rows])
+        outputs = self._forward_all(calls)
+
+        if 'toxicity' in outputs:
+            scores = outputs['toxicity']
+            labels = heads['toxicity'].labels
+            for row, i in enumerate(needed['toxicity']):
+                analysis = ToxicityDetector._build_result(texts[i], dict(zip(labels, scores[row])))
+                self.toxicity.cache.set(self.toxicity.cache.make_key(self.toxicity.model_name, texts[i]), analysis)
+                toxicity_results[i] = analysis
+
+        if 'emotion' in outputs:
+            emotion_scores = outputs['emotion']
+            sentiment_scores = outputs['sentiment']
+            emotion_labels = heads['emotion'].labels
+            sentiment_labels = heads['sentiment'].labels
+            for row, i in enumerate(needed['emotion']):
+                emotions = [{'label': label, 'score': score} for label, score in zip(emotion_labels, emotion_scores[row])]
+                best = int(np.argmax(sentiment_scores[row]))
+                sentiment = {'label': sentiment_labels[best], 'score': sentiment_scores[row][best]}
+                analysis = EmotionDetector._build_result(texts[i], emotions, sentiment)
+                self.emotion.cache.set(self.emotion.cache.make_key(self.emotion.model_name, texts[i]), analysis)
+                emotion_results[i] = analysis
+
+    def _forward_all(self, calls):
+        """Run each head's forward pass on its inputs; returns name -> probabilities"""
+        executor = self._head_executor()
+        if executor is None or len(calls) < 2:
+            return {name: head.forward(*inputs) for name, (head, *inputs) in calls.items()}
+        futures = {name: executor.submit(head.forward, *inputs) for name, (head, *inputs) in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _head_executor(self):
+        """
+        Threads running the heads concurrently, or None to run them in turn
+
+        Under gevent (serve.py) a thread pool is a greenlet pool, which cannot
+        be used from the native thread that runs inference batches there.
+        """
+        if _threads_patched():
+            return None
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                # Pool threads do not survive fork; a child starts its own
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='analyzer')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _load_heads(self):
+        """Model heads of the detectors, built on first use"""
+        if self._heads is not None:
+            return self._heads
+        with self._lock:
+            if self._heads is None:
+                heads = {}
+                toxicity_model = self.toxicity.model
+                if toxicity_model is not None:
+                    if isinstance(toxicity_model, onnx_backend.OnnxDetoxify):
+                        heads['toxicity'] = ModelHead.from_onnx('toxicity', toxicity_model.classifier)
+                    else:
+                        heads['toxicity'] = ModelHead.from_torch(
+                            'toxicity', toxicity_model.model, toxicity_model.tokenizer,
+                            toxicity_model.class_names, 'sigmoid'
+                        )
+                for name, pipeline in (('emotion', self.emotion.emotion_classifier),
+                                       ('sentiment', self.emotion.sentiment_analyzer)):
+                    if pipeline is None:
+                        continue
+                    if isinstance(pipeline, onnx_backend.OnnxPipeline):
+                        heads[name] = ModelHead.from_onnx(name, pipeline.classifier)
+                    else:
+                        config = pipeline.model.config
+                        # Same choice the text-classification pipeline makes
+                        multi_label = config.problem_type == 'multi_label_classification' or config.num_labels == 1
+                        heads[name] = ModelHead.from_torch(
+                            name, pipeline.model, pipeline.tokenizer,
+                            [config.id2label[i] for i in range(config.num_labels)],
+                            'sigmoid' if multi_label else 'softmax'
+                        )
+                self._heads = heads
+                logger.info(f"✅ Combined analyzer ready ({self.stats()['tokenizations_per_text']} tokenizations per text)")
+        return self._heads
+
+    @staticmethod
+    def _merge(text, toxicity, emotion):
+        return {
+            'toxicity': toxicity,
+            'emotion': emotion,
+            'sentiment': emotion.get('sentiment') if not emotion.get('error') else None,
+            'text_analyzed': text[:100] + '...' if isinstance(text, str) and len(text) > 100 else text
+        }
+
+
+def _threads_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+# Initialize global analyzer instance
+multi_analyzer = MultiAnalyzer()
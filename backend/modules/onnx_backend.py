@@ -0,0 +1,361 @@
+"""
+ONNX Runtime Inference Backend
+Exports a transformer classifier to ONNX once, applies dynamic INT8
+quantization, and serves it with ONNX Runtime. Exports are checked against
+the PyTorch model on sample texts before they are used, and reused on later
+starts without loading PyTorch weights.
+
+Requires the optional onnx and onnxruntime packages; detectors fall back to
+PyTorch when they are missing.
+"""
+from modules.metrics import metrics
+import numpy as np
+import json
+import logging
+import os
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', 'models/onnx')
+# Quantize weights to INT8 ('0' keeps the FP32 export)
+ONNX_QUANTIZE = os.getenv('ONNX_QUANTIZE', '1') not in ('0', 'false', 'no')
+# ONNX Runtime intra-op threads (0 lets the runtime decide)
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))
+# Largest allowed difference from PyTorch in any output probability
+ONNX_PARITY_TOLERANCE = float(os.getenv('ONNX_PARITY_TOLERANCE', '0.05'))
+
+OPSET_VERSION = 17
+MAX_SEQUENCE_LENGTH = 512
+
+PARITY_TEXTS = [
+    "Hope you have a lovely day!",
+    "I'm so scared, someone has been following me home every night.",
+    "You are worthless and everyone hates you.",
+    "If you tell anyone I will hurt you.",
+    "I feel really sad and alone lately.",
+    "Thanks for checking in, I got home safe.",
+    "Shut up, you stupid idiot.",
+    "The meeting moved to 3pm, see you there.",
+]
+
+
+class OnnxParityError(Exception):
+    """Exported model disagrees with the PyTorch model"""
+
+
+def available():
+    """Whether the onnx and onnxruntime packages are installed"""
+    try:
+        import onnx  # noqa: F401
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class OnnxClassifier:
+    """Sequence classifier running on ONNX Runtime"""
+
+    def __init__(self, directory, threads=None):
+        """
+        Args:
+            directory (str): Export directory (model files, tokenizer.json, model.json)
+            threads (int): Intra-op threads (0 lets the runtime decide)
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(directory, 'model.json')) as f:
+            self.meta = json.load(f)
+        self.name = os.path.basename(os.path.normpath(directory))
+        self.labels = self.meta['labels']
+        self.activation = self.meta['activation']
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(self.meta['max_length'])
+        self.tokenizer.enable_padding(pad_id=self.meta['pad_id'], pad_token=self.meta['pad_token'])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = ONNX_THREADS if threads is None else threads
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            os.path.join(directory, self.meta['model_file']), options, providers=['CPUExecutionProvider']
+        )
+
+    def scores(self, texts):
+        """
+        Class probabilities for a list of texts
+
+        Returns:
+            np.ndarray: (len(texts), len(labels)) probabilities
+        """
+        with metrics.stage('tokenize', model=self.name):
+            encodings = self.tokenizer.encode_batch(list(texts))
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        with metrics.stage('forward', model=self.name):
+            return self.run(input_ids, attention_mask)
+
+    def run(self, input_ids, attention_mask):
+        """Class probabilities for already tokenized input (int64 arrays)"""
+        logits = self.session.run(['logits'], {'input_ids': input_ids, 'attention_mask': attention_mask})[0]
+        return activate(logits, self.activation)
+
+
+class OnnxDetoxify:
+    """Drop-in for Detoxify.predict backed by an OnnxClassifier"""
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.class_names = classifier.labels
+
+    def predict(self, text):
+        single = isinstance(text, str)
+        scores = self.classifier.scores([text] if single else text)
+        return {
+            label: scores[0][i] if single else scores[:, i].tolist()
+            for i, label in enumerate(self.class_names)
+        }
+
+
+class OnnxPipeline:
+    """Drop-in for a transformers text-classification pipeline backed by an OnnxClassifier"""
+
+    def __init__(self, classifier, all_scores=False):
+        """
+        Args:
+            classifier (OnnxClassifier): Exported model
+            all_scores (bool): Return every label's score (return_all_scores=True)
+                instead of the top label
+        """
+        self.classifier = classifier
+        self.all_scores = all_scores
+
+    def __call__(self, texts, batch_size=None, truncation=True):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        batch_size = batch_size or len(texts) or 1
+
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            for row in self.classifier.scores(texts[start:start + batch_size]):
+                if self.all_scores:
+                    outputs.append([
+                        {'label': label, 'score': float(score)}
+                        for label, score in zip(self.classifier.labels, row)
+                    ])
+                else:
+                    best = int(np.argmax(row))
+                    outputs.append({'label': self.classifier.labels[best], 'score': float(row[best])})
+
+        # Pipelines wrap a single input's all-scores list in another list
+        if single and self.all_scores:
+            return [outputs[0]]
+        return outputs
+
+
+def load_classifier(name, load_torch, quantize=None, model_dir=None):
+    """
+    Exported classifier for a model, exporting it on first use
+
+    Args:
+        name (str): Export name (directory under model_dir)
+        load_torch (callable): Returns (model, tokenizer, labels, activation)
+            for the PyTorch model; only called when exporting
+        quantize (bool): Use dynamic INT8 weights (defaults to ONNX_QUANTIZE)
+        model_dir (str): Export root (defaults to ONNX_MODEL_DIR)
+
+    Returns:
+        OnnxClassifier
+
+    Raises:
+        OnnxParityError: If the export does not match PyTorch
+        ImportError: If onnx/onnxruntime are not installed
+    """
+    quantize = ONNX_QUANTIZE if quantize is None else quantize
+    export_name = name.replace('/', '--')
+    directory = os.path.join(model_dir or ONNX_MODEL_DIR, f"{export_name}-int8" if quantize else export_name)
+    meta_path = os.path.join(directory, 'model.json')
+
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            parity = json.load(f).get('parity', {})
+        if not parity.get('passed'):
+            raise OnnxParityError(
+                f"Export in {directory} failed the parity check "
+                f"(max difference {parity.get('max_abs_diff')}); delete it to re-export"
+            )
+        return OnnxClassifier(directory)
+
+    model, tokenizer, labels, activation = load_torch()
+    export(model, tokenizer, labels, activation, directory, quantize)
+    classifier = OnnxClassifier(directory)
+
+    parity = parity_check(model, tokenizer, activation, classifier)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta['parity'] = classifier.meta['parity'] = parity
+    _write_json(meta_path, meta)
+
+    if not parity['passed']:
+        raise OnnxParityError(
+            f"{name} ONNX export differs from PyTorch by {parity['max_abs_diff']:.4f} "
+            f"(tolerance {parity['tolerance']})"
+        )
+    logger.info(
+        f"✅ Exported {name} to ONNX{' (INT8)' if quantize else ''}: "
+        f"max difference {parity['max_abs_diff']:.4f}, label agreement {parity['label_agreement']:.0%}"
+    )
+    return classifier
+
+
+def transformers_loader(model_name, activation='softmax'):
+    """load_torch callable for a Hugging Face sequence classification model"""
+    def load():
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        labels = [model.config.id2label[i] for i in range(model.config.num_labels)]
+        return model, AutoTokenizer.from_pretrained(model_name), labels, activation
+    return load
+
+
+def export(model, tokenizer, labels, activation, directory, quantize=True):
+    """
+    Export a PyTorch sequence classifier and its tokenizer
+
+    Args:
+        model: transformers *ForSequenceClassification model
+        tokenizer: Its tokenizer (slow tokenizers are converted)
+        labels (list): Class names in logit order
+        activation (str): 'sigmoid' (multi-label) or 'softmax'
+        directory (str): Output directory
+        quantize (bool): Also write dynamic INT8 weights and use them
+    """
+    import inspect
+    import torch
+
+    staging = directory + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, classifier):
+            super().__init__()
+            self.classifier = classifier
+
+        def forward(self, input_ids, attention_mask):
+            return self.classifier(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    started = time.monotonic()
+    model.eval()
+    sample = tokenizer(PARITY_TEXTS[:2], return_tensors='pt', padding=True, truncation=True)
+    options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    fp32_path = os.path.join(staging, 'model.onnx')
+    with torch.inference_mode():
+        torch.onnx.export(
+            # The exporter restores the wrapper's mode afterwards, so it must be eval too
+            LogitsOnly(model).eval(), (sample['input_ids'], sample['attention_mask']), fp32_path,
+            input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'logits': {0: 'batch'}
+            },
+            opset_version=OPSET_VERSION, **options
+        )
+
+    model_file = 'model.onnx'
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(staging, 'model.int8.onnx'), weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+        model_file = 'model.int8.onnx'
+
+    _export_tokenizer(tokenizer, os.path.join(staging, 'tokenizer.json'))
+    _write_json(os.path.join(staging, 'model.json'), {
+        'model_file': model_file,
+        'labels': list(labels),
+        'activation': activation,
+        'quantized': bool(quantize),
+        'max_length': min(int(getattr(tokenizer, 'model_max_length', MAX_SEQUENCE_LENGTH)), MAX_SEQUENCE_LENGTH),
+        'pad_id': tokenizer.pad_token_id,
+        'pad_token': tokenizer.pad_token,
+        'exported_at': time.time(),
+        'export_seconds': round(time.monotonic() - started, 1)
+    })
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(staging, directory)
+
+
+def parity_check(model, tokenizer, activation, classifier, texts=None, tolerance=None):
+    """
+    Compare an exported classifier with the PyTorch model
+
+    Returns:
+        dict: max_abs_diff, label_agreement (share of texts with the same top
+            label), tolerance and passed
+    """
+    import torch
+
+    texts = texts or PARITY_TEXTS
+    tolerance = ONNX_PARITY_TOLERANCE if tolerance is None else tolerance
+    model.eval()
+    with torch.inference_mode():
+        inputs = tokenizer(texts, return_tensors='pt', padding=True, truncation=True)
+        logits = model(input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask']).logits
+    expected = activate(logits.float().numpy(), activation)
+    actual = classifier.scores(texts)
+
+    max_abs_diff = float(np.abs(expected - actual).max())
+    label_agreement = float(np.mean(expected.argmax(axis=1) == actual.argmax(axis=1)))
+    return {
+        'max_abs_diff': round(max_abs_diff, 6),
+        'label_agreement': label_agreement,
+        'tolerance': tolerance,
+        'texts': len(texts),
+        'passed': bool(max_abs_diff <= tolerance)
+    }
+
+
+def fast_tokenizer(tokenizer):
+    """
+    Standalone tokenizers.Tokenizer equivalent to a transformers tokenizer
+
+    Slow tokenizers are converted. The copy has no truncation or padding set.
+    """
+    from tokenizers import Tokenizer
+
+    if getattr(tokenizer, 'is_fast', False):
+        backend = Tokenizer.from_str(tokenizer.backend_tokenizer.to_str())
+    else:
+        from transformers.convert_slow_tokenizer import convert_slow_tokenizer
+        backend = convert_slow_tokenizer(tokenizer)
+        # As transformers does when it builds a fast tokenizer from a slow one
+        backend.add_special_tokens(tokenizer.all_special_tokens)
+    backend.no_truncation()
+    backend.no_padding()
+    return backend
+
+
+def _export_tokenizer(tokenizer, path):
+    """Save the tokenizer as a standalone tokenizers JSON file"""
+    fast_tokenizer(tokenizer).save(path)
+
+
+def activate(logits, activation):
+    """Probabilities from logits ('sigmoid' for multi-label, else softmax)"""
+    if activation == 'sigmoid':
+        return 1.0 / (1.0 + np.exp(-logits))
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + '.tmp', path)
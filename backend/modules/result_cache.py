@@ -0,0 +1,247 @@
+"""
+Shared Result Cache
+Bounded LRU + TTL cache for model outputs, keyed by a hash of the normalized
+text and the model name. Optionally persisted to a local SQLite file so
+entries survive restarts. The file is opened on first use in each process
+(never shared across fork) and kept to max_entries rows.
+"""
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_SIZE', '10000'))
+DEFAULT_TTL_SECONDS = float(os.getenv('RESULT_CACHE_TTL', '86400'))
+DEFAULT_PATH = os.getenv('RESULT_CACHE_PATH', '')
+
+_WHITESPACE = re.compile(r'\s+')
+
+# Inserts between prunes of the disk store back to max_entries rows
+PRUNE_INTERVAL = 1000
+
+
+class ResultCache:
+    """Thread-safe LRU cache with per-entry expiry and optional disk store"""
+
+    def __init__(self, max_entries=None, ttl=None, path=None):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries (int): Maximum entries kept in memory (0 disables the cache)
+            ttl (float): Default time-to-live in seconds
+            path (str): SQLite file for persistence (None or '' for memory only)
+        """
+        self.max_entries = DEFAULT_MAX_ENTRIES if max_entries is None else int(max_entries)
+        self.ttl = DEFAULT_TTL_SECONDS if ttl is None else float(ttl)
+        self.path = DEFAULT_PATH if path is None else path
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+        # Disk store connection, opened lazily by the process that uses it
+        self._db = None
+        self._db_pid = None
+        self._inserts = 0
+
+    @property
+    def enabled(self):
+        """Whether the cache stores anything at all"""
+        return self.max_entries > 0
+
+    @staticmethod
+    def normalize_text(text):
+        """Normalize text so trivially different copies share a cache entry"""
+        return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+    @classmethod
+    def make_key(cls, model_name, text):
+        """
+        Build a content-addressed cache key
+
+        Args:
+            model_name (str): Name of the model that produced the result
+            text (str): Input text
+
+        Returns:
+            str: Hex digest identifying (model, normalized text)
+        """
+        payload = f"{model_name}\x00{cls.normalize_text(text)}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached value
+
+        Args:
+            key (str): Cache key from make_key
+
+        Returns:
+            Copy of the cached value, or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self._counters['expirations'] += 1
+
+            if self._connection() is not None:
+                loaded = self._load(key, now)
+                if loaded is not None:
+                    value, expires_at = loaded
+                    self._store(key, value, expires_at, persist=False)
+                    self._counters['disk_hits'] += 1
+                    return copy.deepcopy(value)
+
+            self._counters['misses'] += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value
+
+        Args:
+            key (str): Cache key from make_key
+            value: JSON-serializable value
+            ttl (float): Time-to-live in seconds (defaults to self.ttl)
+        """
+        if not self.enabled:
+            return
+
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, copy.deepcopy(value), expires_at)
+
+    def clear(self):
+        """Remove all entries from memory and disk"""
+        with self._lock:
+            self._entries.clear()
+            if self._connection() is not None:
+                self._db.execute('DELETE FROM cache')
+                self._db.commit()
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current size"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['max_entries'] = self.max_entries
+        stats['hit_rate'] = round((stats['hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['persistent'] = bool(self.path) and self.enabled
+        return stats
+
+    def _connection(self):
+        """This process's disk store connection, or None (lock held)"""
+        if not self.path or not self.enabled:
+            return None
+        if self._db_pid != os.getpid():
+            # A connection inherited across fork belongs to the parent; never use it
+            self._db_pid = os.getpid()
+            self._inserts = 0
+            try:
+                self._db = self._open_store(self.path, self.max_entries)
+                logger.info(f"✅ Result cache persisted to {self.path}")
+            except Exception as e:
+                logger.error(f"❌ Error opening result cache store: {e}")
+                self._db = None
+        return self._db
+
+    def _store(self, key, value, expires_at, persist=True):
+        """Insert an entry and evict the least recently used ones (lock held)"""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+        if persist and self._connection() is not None:
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value), expires_at)
+                )
+                self._inserts += 1
+                if self._inserts % PRUNE_INTERVAL == 0:
+                    _prune(self._db, self.max_entries)
+                self._db.commit()
+            except Exception as e:
+                logger.error(f"Error persisting cache entry: {e}")
+
+    def _load(self, key, now):
+        """Read an unexpired entry from the disk store (lock held)"""
+        try:
+            row = self._db.execute(
+                'SELECT value, expires_at FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+        except Exception as e:
+            logger.error(f"Error reading cache entry: {e}")
+            return None
+
+        if row is None:
+            return None
+        if row[1] <= now:
+            self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._db.commit()
+            self._counters['expirations'] += 1
+            return None
+        return json.loads(row[0]), row[1]
+
+    @staticmethod
+    def _open_store(path, max_entries):
+        """Open (and create if needed) the SQLite store"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        _prune(db, max_entries)
+        db.commit()
+        return db
+
+
+def _prune(db, max_entries):
+    """Drop expired rows, then all but the max_entries most recently written"""
+    db.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+    # INSERT OR REPLACE gives a rewritten key a new rowid, so rowid order is write order
+    db.execute(
+        'DELETE FROM cache WHERE rowid <= '
+        '(SELECT rowid FROM cache ORDER BY rowid DESC LIMIT 1 OFFSET ?)',
+        (max_entries,)
+    )
+
+
+# Initialize global cache shared by the text analysis modules
+result_cache = ResultCache()
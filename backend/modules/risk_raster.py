@@ -0,0 +1,393 @@
+"""
+Precomputed Risk Raster
+Rasterizes the near-field hotspot risk onto a fixed latitude/longitude grid
+stored as memory-mapped NumPy chunks, so a point's crime risk is a bilinear
+lookup instead of a distance computation, and heatmap tiles are rendered
+from the grid instead of from the raw hotspots.
+
+Layout under the raster directory:
+    manifest.json           parameters and a fingerprint per chunk
+    L<level>/<row>_<col>.npy  risk samples for one chunk at one level
+    tiles/<z>/<x>/<y>.png   rendered heatmap tiles (cache)
+
+Level 0 holds the full resolution. Each further level halves the
+resolution and keeps the maximum of the samples it covers, so zoomed-out
+tiles still show small hotspots. Only chunks whose hotspots changed are
+rebuilt, and only the tiles over those chunks are discarded.
+"""
+from modules.spatial_index import KM_PER_DEG_LAT, KM_PER_DEG_LNG, SEARCH_MARGIN
+import numpy as np
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import struct
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Enables the raster when set
+RISK_RASTER_DIR = os.getenv('RISK_RASTER_DIR', '')
+RISK_RASTER_LEVELS = int(os.getenv('RISK_RASTER_LEVELS', '4'))
+
+# Chunk edge in degrees (~5.5 km) and cells per chunk edge (~43 m cells)
+CHUNK_DEG = 0.05
+CHUNK_CELLS = 128
+
+TILE_SIZE = 256
+
+# Heatmap colours, interpolated by risk from 0 to 1 (RGBA)
+COLOR_STOPS = np.array([
+    [0.0, 46, 204, 113, 0],
+    [0.2, 241, 196, 15, 90],
+    [0.5, 230, 126, 34, 150],
+    [1.0, 192, 57, 43, 200],
+])
+
+
+class RiskRaster:
+    """Chunked, multi-resolution grid of near-field crime risk"""
+
+    def __init__(self, directory, levels=None):
+        """
+        Open (or create) a raster directory
+
+        Args:
+            directory (str): Where chunks, manifest and tiles are stored
+            levels (int): Number of resolution levels, including the full one
+        """
+        self.directory = directory
+        self.levels = max(1, RISK_RASTER_LEVELS if levels is None else int(levels))
+        self.floor = 0.0
+
+        self._lock = threading.Lock()
+        self._arrays = {}
+        self._manifest = self._read_manifest()
+
+        for level in range(self.levels):
+            os.makedirs(os.path.join(directory, f"L{level}"), exist_ok=True)
+
+    @property
+    def chunk_count(self):
+        return len(self._manifest['chunks'])
+
+    def update(self, hotspot_lats, hotspot_lngs, severities, near_risk_fn, radius_km, floor=0.0, params=None):
+        """
+        Bring the raster in line with a hotspot set
+
+        Chunks are fingerprinted by the hotspots that can reach them, so only
+        chunks whose hotspots changed are recomputed.
+
+        Args:
+            hotspot_lats, hotspot_lngs, severities: Hotspot column arrays
+            near_risk_fn (callable): Maps (latitudes, longitudes) to near-field risk
+            radius_km (float): Distance beyond which a hotspot adds no near-field risk
+            floor (float): Risk applied everywhere (far-field contribution)
+            params (dict): Settings that invalidate the whole raster when changed
+
+        Returns:
+            dict: Counts of rebuilt, removed and unchanged chunks
+        """
+        params = dict(params or {}, chunk_deg=CHUNK_DEG, chunk_cells=CHUNK_CELLS,
+                      levels=self.levels, radius_km=radius_km)
+        if self._manifest.get('params') != params:
+            self._manifest = {'params': params, 'chunks': {}}
+
+        fingerprints = self._fingerprints(hotspot_lats, hotspot_lngs, severities, radius_km)
+        old = self._manifest['chunks']
+        changed = [key for key, digest in fingerprints.items() if old.get(key) != digest]
+        removed = [key for key in old if key not in fingerprints]
+
+        for key in changed:
+            self._build_chunk(key, near_risk_fn)
+        for key in removed:
+            self._remove_chunk(key)
+
+        floor_changed = float(floor) != self.floor
+        with self._lock:
+            for key in changed + removed:
+                for level in range(self.levels):
+                    self._arrays.pop((level, key), None)
+            self.floor = float(floor)
+            self._manifest = {'params': params, 'chunks': fingerprints, 'floor': self.floor}
+        self._write_manifest()
+
+        # The floor colours every tile, so a change in it clears all of them
+        if floor_changed:
+            self.clear_tiles()
+        else:
+            self._invalidate_tiles(changed + removed)
+
+        if changed or removed:
+            logger.info(f"✅ Risk raster updated: {len(changed)} chunks rebuilt, {len(removed)} removed")
+        return {'rebuilt': len(changed), 'removed': len(removed),
+                'unchanged': len(fingerprints) - len(changed)}
+
+    def sample(self, latitudes, longitudes, level=0):
+        """
+        Near-field risk at arbitrary points by bilinear interpolation
+
+        Args:
+            latitudes, longitudes: Point coordinates in degrees
+            level (int): Resolution level to read
+
+        Returns:
+            np.ndarray: Risk per point (0 outside every chunk)
+        """
+        lats = np.atleast_1d(np.asarray(latitudes, dtype=float))
+        lngs = np.atleast_1d(np.asarray(longitudes, dtype=float))
+        result = np.zeros(lats.size)
+        if lats.size == 0:
+            return result
+
+        cells = CHUNK_CELLS >> level
+        rows = np.floor(lats / CHUNK_DEG).astype(np.int64)
+        cols = np.floor(lngs / CHUNK_DEG).astype(np.int64)
+
+        # Position within the chunk in cell units
+        y = (lats / CHUNK_DEG - rows) * cells
+        x = (lngs / CHUNK_DEG - cols) * cells
+        y0 = np.minimum(np.floor(y).astype(np.int64), cells - 1)
+        x0 = np.minimum(np.floor(x).astype(np.int64), cells - 1)
+        ty, tx = y - y0, x - x0
+
+        # Points are looked up one chunk at a time
+        keys = rows * 1_000_000 + cols
+        if keys.size == 1 or (keys == keys[0]).all():
+            blocks = [np.arange(keys.size)]
+        else:
+            order = np.argsort(keys, kind='stable')
+            _, starts = np.unique(keys[order], return_index=True)
+            blocks = np.split(order, starts[1:])
+
+        for block in blocks:
+            grid = self._chunk_array(level, f"{rows[block[0]]}_{cols[block[0]]}")
+            if grid is None:
+                continue
+            i, j = y0[block], x0[block]
+            wy, wx = ty[block], tx[block]
+            result[block] = (
+                grid[i, j] * (1 - wy) * (1 - wx) + grid[i, j + 1] * (1 - wy) * wx +
+                grid[i + 1, j] * wy * (1 - wx) + grid[i + 1, j + 1] * wy * wx
+            )
+        return result
+
+    def risk(self, latitudes, longitudes):
+        """Total crime risk (near field combined with the floor), capped at 1"""
+        return np.minimum(np.maximum(self.sample(latitudes, longitudes), self.floor), 1.0)
+
+    def tile_png(self, z, x, y):
+        """
+        PNG heatmap tile in the standard slippy-map scheme
+
+        Tiles are cached on disk until a chunk under them is rebuilt.
+
+        Args:
+            z, x, y (int): Zoom level and tile coordinates
+
+        Returns:
+            bytes: PNG image data
+        """
+        path = os.path.join(self.directory, 'tiles', str(z), str(x), f"{y}.png")
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+
+        png = encode_png(self._render_tile(z, x, y))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache tile {z}/{x}/{y}: {e}")
+        return png
+
+    def stats(self):
+        """Chunk and cache counters"""
+        return {
+            'directory': self.directory,
+            'chunks': self.chunk_count,
+            'levels': self.levels,
+            'open_arrays': len(self._arrays),
+            'floor': self.floor
+        }
+
+    def clear_tiles(self):
+        """Remove every cached tile"""
+        shutil.rmtree(os.path.join(self.directory, 'tiles'), ignore_errors=True)
+
+    def _fingerprints(self, lats, lngs, severities, radius_km):
+        """Digest of the hotspots reaching each chunk, keyed by chunk"""
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        severities = np.asarray(severities, dtype=float)
+
+        dlat = radius_km * SEARCH_MARGIN / KM_PER_DEG_LAT
+        cos_lat = np.cos(np.radians(np.minimum(89.9, np.abs(lats) + dlat)))
+        dlng = np.minimum(180.0, radius_km * SEARCH_MARGIN / (KM_PER_DEG_LNG * cos_lat))
+
+        row_lo = np.floor((lats - dlat) / CHUNK_DEG).astype(np.int64)
+        row_hi = np.floor((lats + dlat) / CHUNK_DEG).astype(np.int64)
+        col_lo = np.floor((lngs - dlng) / CHUNK_DEG).astype(np.int64)
+        col_hi = np.floor((lngs + dlng) / CHUNK_DEG).astype(np.int64)
+
+        reaching = {}
+        for index in range(lats.size):
+            for row in range(row_lo[index], row_hi[index] + 1):
+                for col in range(col_lo[index], col_hi[index] + 1):
+                    reaching.setdefault(f"{row}_{col}", []).append(index)
+
+        fingerprints = {}
+        for key, ids in reaching.items():
+            records = np.stack([lats[ids], lngs[ids], severities[ids]], axis=1)
+            records = records[np.lexsort(records.T[::-1])]
+            fingerprints[key] = hashlib.sha1(records.tobytes()).hexdigest()
+        return fingerprints
+
+    def _build_chunk(self, key, near_risk_fn):
+        """Compute and store every level of one chunk"""
+        row, col = map(int, key.split('_'))
+        steps = np.arange(CHUNK_CELLS + 1) / CHUNK_CELLS
+        lats = (row + steps) * CHUNK_DEG
+        lngs = (col + steps) * CHUNK_DEG
+        grid_lats, grid_lngs = np.meshgrid(lats, lngs, indexing='ij')
+
+        grid = np.asarray(near_risk_fn(grid_lats.ravel(), grid_lngs.ravel()), dtype=np.float32)
+        grid = grid.reshape(CHUNK_CELLS + 1, CHUNK_CELLS + 1)
+
+        for level in range(self.levels):
+            if level:
+                grid = self._downsample(grid)
+            path = self._chunk_path(level, key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, grid)
+            os.replace(tmp_path, path)
+
+    def _remove_chunk(self, key):
+        """Delete every level of a chunk no hotspot reaches any more"""
+        for level in range(self.levels):
+            try:
+                os.remove(self._chunk_path(level, key))
+            except FileNotFoundError:
+                pass
+
+    def _chunk_array(self, level, key):
+        """Memory-mapped samples for a chunk, or None if it holds no risk"""
+        array_key = (level, key)
+        grid = self._arrays.get(array_key)
+        if grid is not None or key not in self._manifest['chunks']:
+            return grid
+
+        with self._lock:
+            grid = self._arrays.get(array_key)
+            if grid is None:
+                try:
+                    grid = np.load(self._chunk_path(level, key), mmap_mode='r')
+                except (FileNotFoundError, ValueError):
+                    return None
+                self._arrays[array_key] = grid
+        return grid
+
+    def _chunk_path(self, level, key):
+        return os.path.join(self.directory, f"L{level}", f"{key}.npy")
+
+    def _render_tile(self, z, x, y):
+        """RGBA pixels for a tile"""
+        n = 2 ** z
+        pixels = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+        lngs = (x + pixels) / n * 360.0 - 180.0
+        lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixels) / n))))
+        grid_lats, grid_lngs = np.meshgrid(lats, lngs, indexing='ij')
+
+        # Read the coarsest level that is still finer than a pixel
+        pixel_deg = 360.0 / (n * TILE_SIZE)
+        cell_deg = CHUNK_DEG / CHUNK_CELLS
+        level = int(min(self.levels - 1, max(0, math.floor(math.log2(pixel_deg / cell_deg)))))
+
+        risk = self.sample(grid_lats.ravel(), grid_lngs.ravel(), level=level)
+        risk = np.minimum(np.maximum(risk, self.floor), 1.0)
+        return colorize(risk).reshape(TILE_SIZE, TILE_SIZE, 4)
+
+    def _invalidate_tiles(self, chunk_keys):
+        """Drop cached tiles that overlap the given chunks"""
+        tiles_dir = os.path.join(self.directory, 'tiles')
+        if not chunk_keys or not os.path.isdir(tiles_dir):
+            return
+
+        boxes = []
+        for key in chunk_keys:
+            row, col = map(int, key.split('_'))
+            boxes.append((row * CHUNK_DEG, col * CHUNK_DEG, (row + 1) * CHUNK_DEG, (col + 1) * CHUNK_DEG))
+        boxes = np.array(boxes)
+
+        for z_name in os.listdir(tiles_dir):
+            n = 2 ** int(z_name)
+            for x_name in os.listdir(os.path.join(tiles_dir, z_name)):
+                x = int(x_name)
+                west, east = x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+                hit_x = (boxes[:, 1] <= east) & (boxes[:, 3] >= west)
+                if not hit_x.any():
+                    continue
+                for file_name in os.listdir(os.path.join(tiles_dir, z_name, x_name)):
+                    y = int(file_name.split('.')[0])
+                    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+                    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+                    if (hit_x & (boxes[:, 0] <= north) & (boxes[:, 2] >= south)).any():
+                        try:
+                            os.remove(os.path.join(tiles_dir, z_name, x_name, file_name))
+                        except FileNotFoundError:
+                            pass
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+            self.floor = float(manifest.get('floor', 0.0))
+            return manifest
+        except (FileNotFoundError, ValueError):
+            return {'params': None, 'chunks': {}}
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, 'manifest.json')
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _downsample(grid):
+        """Halve the resolution, keeping the maximum around each kept sample"""
+        padded = np.pad(grid, 1, mode='edge')
+        windows = np.lib.stride_tricks.sliding_window_view(padded, (3, 3))
+        return windows[::2, ::2].max(axis=(2, 3))
+
+
+def colorize(risk):
+    """Map risk values (0-1) to RGBA bytes"""
+    stops = COLOR_STOPS[:, 0]
+    channels = [np.interp(risk, stops, COLOR_STOPS[:, c]) for c in range(1, 5)]
+    return np.stack(channels, axis=-1).round().astype(np.uint8)
+
+
+def encode_png(rgba):
+    """Encode an (h, w, 4) uint8 array as PNG"""
+    height, width = rgba.shape[:2]
+    # Every scanline starts with filter type 0 (none)
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8),
+                          rgba.reshape(height, width * 4)], axis=1).tobytes()
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw, 6)) +
+            chunk(b'IEND', b''))
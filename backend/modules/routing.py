@@ -0,0 +1,381 @@
+"""
+Safe Routing Engine
+Road graph loaded from a local OpenStreetMap extract, with per-edge crime
+risk precomputed from the hotspot set, and A* search over a tunable
+distance-vs-risk cost. Alternative routes come from re-running the search
+with penalties on edges already used.
+"""
+from modules import geo_kernels
+from modules.spatial_index import GeoGridIndex
+import numpy as np
+import xml.etree.ElementTree as ET
+import heapq
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+# Ways that pedestrians cannot (or should not) use
+EXCLUDED_HIGHWAYS = {
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'construction',
+    'proposed', 'raceway', 'bus_guideway', 'abandoned', 'platform'
+}
+EXCLUDED_ACCESS = {'no', 'private'}
+
+# Cost of an edge is length * (1 + risk_weight * risk)
+DEFAULT_RISK_WEIGHT = float(os.getenv('ROUTE_RISK_WEIGHT', '4.0'))
+
+# Edges on an already found route cost this much more for the next alternative
+ALTERNATIVE_PENALTY = 1.6
+
+# An alternative must differ from earlier routes on at least 20% of its length
+MAX_ROUTE_OVERLAP = 0.8
+
+# Cost tables kept for this many distinct risk weights
+COST_CACHE_SIZE = 4
+
+# Start/end points further than this from the road graph are not snapped
+MAX_SNAP_KM = 1.0
+
+
+class RoadGraph:
+    """Undirected road graph stored as compressed adjacency arrays"""
+
+    def __init__(self, node_lats, node_lngs, edge_sources, edge_targets):
+        """
+        Build the graph from node coordinates and undirected edges
+
+        Args:
+            node_lats, node_lngs: Arrays of node coordinates in degrees
+            edge_sources, edge_targets: Arrays of node indices, one entry per road segment
+        """
+        self.node_lats = np.asarray(node_lats, dtype=float)
+        self.node_lngs = np.asarray(node_lngs, dtype=float)
+
+        sources = np.asarray(edge_sources, dtype=np.int64)
+        targets = np.asarray(edge_targets, dtype=np.int64)
+        keep = sources != targets
+        sources, targets = sources[keep], targets[keep]
+
+        # Store both directions, sorted by source node
+        both_sources = np.concatenate([sources, targets])
+        both_targets = np.concatenate([targets, sources])
+        order = np.argsort(both_sources, kind='stable')
+        self.edge_sources = both_sources[order]
+        self.edge_targets = both_targets[order]
+        self.offsets = np.searchsorted(self.edge_sources, np.arange(self.node_count + 1))
+
+        self.edge_lengths = geo_kernels.haversine_pairwise(
+            self.node_lats[self.edge_sources], self.node_lngs[self.edge_sources],
+            self.node_lats[self.edge_targets], self.node_lngs[self.edge_targets]
+        )
+        self.edge_risk = np.zeros(self.edge_count)
+        # Crime risk at each node, set by update_risk()
+        self.node_risk = None
+
+        # Records are (lat, lng, node) tuples so the index stays light
+        self.node_index = GeoGridIndex(
+            zip(self.node_lats.tolist(), self.node_lngs.tolist(), range(self.node_count)),
+            cell_km=0.5, lat_key=0, lng_key=1
+        )
+
+    @property
+    def node_count(self):
+        return self.node_lats.size
+
+    @property
+    def edge_count(self):
+        return self.edge_targets.size
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a graph from an .osm XML extract or a saved .npz graph
+
+        Parsed OSM extracts are saved next to the source as <path>.npz and
+        reused while they are newer than the extract.
+        """
+        if path.endswith('.npz'):
+            return cls._load_npz(path)
+
+        cached = path + '.npz'
+        if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+            return cls._load_npz(cached)
+
+        graph = cls.from_osm_xml(path)
+        try:
+            graph.save(cached)
+        except OSError as e:
+            logger.warning(f"Could not save parsed road graph: {e}")
+        return graph
+
+    @classmethod
+    def from_osm_xml(cls, path):
+        """Parse walkable ways from an OpenStreetMap XML extract"""
+        node_coords = {}
+        ways = []
+        for _, elem in ET.iterparse(path, events=('end',)):
+            if elem.tag == 'node':
+                node_coords[int(elem.get('id'))] = (float(elem.get('lat')), float(elem.get('lon')))
+                elem.clear()
+            elif elem.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+                if cls._is_walkable(tags):
+                    ways.append([int(nd.get('ref')) for nd in elem.iter('nd')])
+                elem.clear()
+            elif elem.tag == 'relation':
+                elem.clear()
+
+        # Keep only nodes used by routable ways, renumbered from 0
+        node_ids = {}
+        lats, lngs, sources, targets = [], [], [], []
+        for refs in ways:
+            previous = None
+            for ref in refs:
+                coords = node_coords.get(ref)
+                if coords is None:
+                    previous = None
+                    continue
+                index = node_ids.get(ref)
+                if index is None:
+                    index = node_ids[ref] = len(lats)
+                    lats.append(coords[0])
+                    lngs.append(coords[1])
+                if previous is not None:
+                    sources.append(previous)
+                    targets.append(index)
+                previous = index
+
+        logger.info(f"✅ Road graph parsed: {len(lats)} nodes, {len(sources)} segments")
+        return cls(lats, lngs, sources, targets)
+
+    def save(self, path):
+        """Save the graph topology to an .npz file"""
+        with open(path, 'wb') as f:
+            np.savez(f, node_lats=self.node_lats, node_lngs=self.node_lngs,
+                     edge_sources=self.edge_sources, edge_targets=self.edge_targets)
+
+    @classmethod
+    def _load_npz(cls, path):
+        """Rebuild a graph saved with save()"""
+        data = np.load(path)
+        sources, targets = data['edge_sources'], data['edge_targets']
+        # Saved edges hold both directions; keep one of each pair
+        forward = sources < targets
+        return cls(data['node_lats'], data['node_lngs'], sources[forward], targets[forward])
+
+    def update_risk(self, risk_fn):
+        """
+        Precompute per-edge crime risk
+
+        An edge takes the highest risk found at its two ends and its midpoint.
+        The node risks are kept in node_risk for describing routes.
+
+        Args:
+            risk_fn (callable): Maps (latitudes, longitudes) arrays to risk arrays
+        """
+        node_risk = np.asarray(risk_fn(self.node_lats, self.node_lngs), dtype=float)
+        self.node_risk = node_risk
+        if self.edge_count == 0:
+            self.edge_risk = np.zeros(0)
+            return
+
+        # Each undirected segment appears twice; score its midpoint once
+        forward = self.edge_sources < self.edge_targets
+        mid_lats = (self.node_lats[self.edge_sources[forward]] + self.node_lats[self.edge_targets[forward]]) / 2
+        mid_lngs = (self.node_lngs[self.edge_sources[forward]] + self.node_lngs[self.edge_targets[forward]]) / 2
+        mid_risk = np.asarray(risk_fn(mid_lats, mid_lngs), dtype=float)
+
+        pair = np.minimum(self.edge_sources, self.edge_targets) * self.node_count + \
+            np.maximum(self.edge_sources, self.edge_targets)
+        forward_pairs = pair[forward]
+        order = np.argsort(forward_pairs)
+        edge_mid_risk = mid_risk[order][np.searchsorted(forward_pairs[order], pair)]
+
+        self.edge_risk = np.maximum.reduce([
+            node_risk[self.edge_sources], node_risk[self.edge_targets], edge_mid_risk
+        ])
+
+    def nearest_node(self, latitude, longitude, max_km=MAX_SNAP_KM):
+        """Index of the closest graph node, or None if none is within max_km"""
+        nearest = self.node_index.nearest(latitude, longitude, k=1, max_km=max_km)
+        return nearest[0][1][2] if nearest else None
+
+    @staticmethod
+    def _is_walkable(tags):
+        """Whether an OSM way can be used for walking routes"""
+        highway = tags.get('highway')
+        if not highway or highway in EXCLUDED_HIGHWAYS:
+            return False
+        if tags.get('foot') == 'no' or tags.get('access') in EXCLUDED_ACCESS:
+            return tags.get('foot') in ('yes', 'designated')
+        return True
+
+
+class RouteEngine:
+    """A* routing on a RoadGraph with a distance-vs-risk cost"""
+
+    def __init__(self, graph):
+        """
+        Args:
+            graph (RoadGraph): Graph with edge risk already computed
+        """
+        self.graph = graph
+        self._prepare()
+
+    def refresh(self):
+        """Rebuild search tables after the graph's edge risk changed"""
+        self._prepare()
+
+    def find_routes(self, start_lat, start_lng, end_lat, end_lng, k=1, risk_weight=None):
+        """
+        Find up to k low-cost routes between two points
+
+        Args:
+            start_lat, start_lng: Starting coordinates
+            end_lat, end_lng: Destination coordinates
+            k (int): Number of distinct routes to return
+            risk_weight (float): How strongly risk is traded against distance
+
+        Returns:
+            list: Route dicts with node indices, distance_km, cost and
+                  risk_exposure, ordered by cost. Empty if the points cannot
+                  be snapped to the graph or are not connected.
+        """
+        source = self.graph.nearest_node(start_lat, start_lng)
+        target = self.graph.nearest_node(end_lat, end_lng)
+        if source is None or target is None:
+            return []
+
+        risk_weight = DEFAULT_RISK_WEIGHT if risk_weight is None else max(0.0, float(risk_weight))
+        base_costs = self._edge_costs(risk_weight)
+        # Every edge costs at least this multiple of its length
+        min_factor = 1 + risk_weight * self._min_risk
+
+        costs = base_costs if k <= 1 else list(base_costs)
+        routes = []
+        used_edges = []
+        for _ in range(max(1, k) * 2):
+            path = self._astar(source, target, costs, min_factor)
+            if path is None:
+                break
+            nodes, edges = path
+
+            lengths = [self._lengths[e] for e in edges]
+            distance = sum(lengths)
+            edge_set = {min(e, self._reverse[e]) for e in edges}
+            if not any(self._overlap(edge_set, lengths, edges, other) > MAX_ROUTE_OVERLAP
+                       for other in used_edges):
+                used_edges.append(edge_set)
+                risks = [self._risk[e] for e in edges]
+                routes.append({
+                    'nodes': nodes,
+                    'distance_km': distance,
+                    'cost': sum(base_costs[e] for e in edges),
+                    'risk_exposure': (sum(l * r for l, r in zip(lengths, risks)) / distance) if distance else 0.0
+                })
+                if len(routes) >= k:
+                    break
+
+            # Make the next search prefer edges not used so far
+            for e in edges:
+                costs[e] *= ALTERNATIVE_PENALTY
+                costs[self._reverse[e]] *= ALTERNATIVE_PENALTY
+
+        routes.sort(key=lambda route: route['cost'])
+        return routes
+
+    def _edge_costs(self, risk_weight):
+        """Per-edge search costs for a risk weight, cached for repeat queries"""
+        costs = self._cost_cache.get(risk_weight)
+        if costs is None:
+            costs = (self.graph.edge_lengths * (1 + risk_weight * self.graph.edge_risk)).tolist()
+            if len(self._cost_cache) >= COST_CACHE_SIZE:
+                self._cost_cache.pop(next(iter(self._cost_cache)))
+            self._cost_cache[risk_weight] = costs
+        return costs
+
+    def _overlap(self, edge_set, lengths, edges, other):
+        """Share of a route's length that runs along another route"""
+        total = sum(lengths)
+        if not total:
+            return 1.0
+        shared = sum(length for length, e in zip(lengths, edges) if min(e, self._reverse[e]) in other)
+        return shared / total
+
+    def _prepare(self):
+        """Convert graph arrays to Python lists for the search loop"""
+        graph = self.graph
+        self._cost_cache = {}
+        self._min_risk = float(graph.edge_risk.min()) if graph.edge_count else 0.0
+        self._offsets = graph.offsets.tolist()
+        self._sources = graph.edge_sources.tolist()
+        self._targets = graph.edge_targets.tolist()
+        self._lengths = graph.edge_lengths.tolist()
+        self._risk = graph.edge_risk.tolist()
+        self._lat_rad = np.radians(graph.node_lats).tolist()
+        self._lng_rad = np.radians(graph.node_lngs).tolist()
+        self._cos_lat = np.cos(np.radians(graph.node_lats)).tolist()
+
+        # Index of the opposite direction of every edge
+        pair_keys = graph.edge_sources * graph.node_count + graph.edge_targets
+        reverse_keys = graph.edge_targets * graph.node_count + graph.edge_sources
+        order = np.argsort(pair_keys)
+        self._reverse = order[np.searchsorted(pair_keys[order], reverse_keys)].tolist()
+
+    def _astar(self, source, target, costs, min_factor=1.0):
+        """
+        A* search with a great-circle heuristic
+
+        The heuristic never overestimates because every edge costs at least
+        min_factor times its own great-circle length.
+
+        Returns:
+            tuple: (node list, edge list) or None if target is unreachable
+        """
+        offsets, targets = self._offsets, self._targets
+        lat_rad, lng_rad, cos_lat = self._lat_rad, self._lng_rad, self._cos_lat
+        target_lat, target_lng, target_cos = lat_rad[target], lng_rad[target], cos_lat[target]
+        diameter = 2 * geo_kernels.EARTH_RADIUS_KM * min_factor
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+
+        def heuristic(node):
+            a = (sin((target_lat - lat_rad[node]) / 2) ** 2 +
+                 cos_lat[node] * target_cos * sin((target_lng - lng_rad[node]) / 2) ** 2)
+            return diameter * asin(sqrt(min(1.0, a)))
+
+        best = {source: 0.0}
+        via_edge = {source: -1}
+        heap = [(heuristic(source), 0.0, source)]
+        push, pop = heapq.heappush, heapq.heappop
+        inf = math.inf
+
+        while heap:
+            _, cost, node = pop(heap)
+            if node == target:
+                break
+            if cost > best[node]:
+                continue
+
+            for edge in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[edge]
+                new_cost = cost + costs[edge]
+                if new_cost < best.get(neighbour, inf):
+                    best[neighbour] = new_cost
+                    via_edge[neighbour] = edge
+                    push(heap, (new_cost + heuristic(neighbour), new_cost, neighbour))
+        else:
+            return None
+
+        sources = self._sources
+        nodes, edges = [target], []
+        node = target
+        while node != source:
+            edge = via_edge[node]
+            node = sources[edge]
+            nodes.append(node)
+            edges.append(edge)
+        nodes.reverse()
+        edges.reverse()
+        return nodes, edges
@@ -5,25 +5,70 @@ Provides safety scores for locations and safe route suggestions
 """
 import numpy as np
 import pandas as pd
-from geopy.distance import geodesic
 from geopy.geocoders import Nominatim
 import folium
 from datetime import datetime, time
+from modules import geo_kernels, lazy
+from modules.geocoding import ReverseGeocoder
+from modules.metrics import metrics
+from modules.risk_raster import RiskRaster, RISK_RASTER_DIR
+from modules.routing import RoadGraph, RouteEngine
+from modules.spatial_index import GeoGridIndex
 import logging
 import json
+import os
 
 logger = logging.getLogger(__name__)
 
+# Optional CSV of crime hotspots (columns: lat, lng, severity, severity_score, type)
+CRIME_DATA_PATH = os.getenv('CRIME_DATA_PATH', '')
+
+# Hotspot risk is full strength within this radius (km)...
+FULL_RISK_RADIUS_KM = 0.5
+# ...decays exponentially out to this radius (km)...
+DECAY_RADIUS_KM = 2
+# ...and is a flat fraction of the severity beyond it
+FAR_RISK_FACTOR = 0.1
+
+# 'haversine' (fastest) or 'ellipsoidal' (matches geopy's geodesic)
+DISTANCE_MODE = os.getenv('SAFETY_DISTANCE_MODE', 'ellipsoidal')
+
+# Batch scoring groups points into tiles of this size (degrees, ~2 km)
+# and scores at most SCORE_BLOCK_SIZE points of a tile at a time
+SCORE_TILE_DEG = 0.02
+SCORE_BLOCK_SIZE = 256
+
+# Optional road network (.osm extract or saved .npz graph) for find_safe_route
+ROAD_GRAPH_PATH = os.getenv('ROAD_GRAPH_PATH', '')
+ROUTE_ALTERNATIVES = int(os.getenv('ROUTE_ALTERNATIVES', '3'))
+MAX_ROUTE_ALTERNATIVES = 5
+
+# URL template of the heatmap tiles added to generated maps
+RISK_TILE_URL = os.getenv('RISK_TILE_URL', '/api/safety/tiles/{z}/{x}/{y}.png')
+
 
 class SafetyScorer:
     """Location safety scoring and crime prediction"""
     
-    def __init__(self):
+    def __init__(self, distance_mode=None):
         """Initialize safety scoring system"""
         self.geolocator = Nominatim(user_agent="shesafe_app")
         
+        # Cached reverse geocoding; never blocks scoring unless configured to
+        self.reverse_geocoder = ReverseGeocoder(self.geolocator)
+        
+        self.distance_mode = distance_mode or DISTANCE_MODE
+        if self.distance_mode not in geo_kernels.DISTANCE_MODES:
+            raise ValueError(f"Unknown distance mode: {self.distance_mode}")
+        
+        # Road graph routing; without one, routes are straight lines
+        self.route_engine = self._initialize_route_engine()
+        
+        # Precomputed risk grid for point lookups and heatmap tiles (optional)
+        self.risk_raster = RiskRaster(RISK_RASTER_DIR) if RISK_RASTER_DIR else None
+        
         # Sample crime hotspot data (in production, use real crime database)
-        self.crime_hotspots = self._initialize_crime_data()
+        self.load_crime_hotspots(self._initialize_crime_data())
         
         # Time-based risk factors
         self.time_risk_factors = {
@@ -49,15 +94,12 @@ class SafetyScorer:
         try:
             location = (latitude, longitude)
             
-            # Calculate proximity to crime hotspots
-            crime_risk = self._calculate_crime_risk(location)
-            
-            # Time-based risk
-            time_risk = self._calculate_time_risk(current_time)
-            
-            # Calculate overall safety score (0-100, higher is safer)
-            base_safety = 100 - (crime_risk * 100)
-            adjusted_safety = max(0, min(100, base_safety / time_risk))
+            crime_risks, time_risks, safety_scores = self._score_arrays(
+                [latitude], [longitude], current_time
+            )
+            crime_risk = float(crime_risks[0])
+            time_risk = float(time_risks[0])
+            adjusted_safety = float(safety_scores[0])
             
             # Determine safety level
             safety_level = self._get_safety_level(adjusted_safety)
@@ -80,52 +122,88 @@ class SafetyScorer:
             logger.error(f"Error calculating safety score: {e}")
             return {"error": str(e)}
     
-    def find_safe_route(self, start_lat, start_lng, end_lat, end_lng):
+    def score_points(self, latitudes, longitudes, times=None, include_location_name=False):
+        """
+        Score many locations at once
+        
+        Distances and risks are computed in vectorized blocks. Reverse
+        geocoding is opt-in, so by default thousands of points take
+        milliseconds.
+        
+        Args:
+            latitudes (list): Point latitudes
+            longitudes (list): Point longitudes
+            times (datetime or list): One time for all points, or one per point
+            include_location_name (bool): Reverse geocode each point
+            
+        Returns:
+            list: Compact score dicts, one per point
+        """
+        crime_risks, time_risks, safety_scores = self._score_arrays(latitudes, longitudes, times)
+        
+        results = [
+            {
+                'latitude': float(lat),
+                'longitude': float(lng),
+                'safety_score': round(float(safety), 2),
+                'safety_level': self._get_safety_level(safety),
+                'crime_risk': round(float(crime), 2),
+                'time_risk_factor': round(float(time_risk), 2)
+            }
+            for lat, lng, crime, time_risk, safety in zip(
+                latitudes, longitudes, crime_risks, time_risks, safety_scores
+            )
+        ]
+        
+        if include_location_name:
+            for result in results:
+                result['location_name'] = self._get_location_name(result['latitude'], result['longitude'])
+        
+        return results
+    
+    def find_safe_route(self, start_lat, start_lng, end_lat, end_lng, alternatives=None, risk_weight=None):
         """
         Find safer route between two points
         
+        With a road graph loaded, routes follow the road network and are
+        chosen by a distance-vs-risk cost. Otherwise the direct line is
+        scored.
+        
         Args:
             start_lat, start_lng: Starting coordinates
             end_lat, end_lng: Destination coordinates
+            alternatives (int): Number of routes to return (road graph only)
+            risk_weight (float): Weight of crime risk against distance (road graph only)
             
         Returns:
-            dict: Route information with safety scores
+            dict: Route information with safety scores. With a road graph,
+                  the top-level fields are the route with the lowest combined
+                  distance-plus-risk cost (not necessarily the one with the
+                  least risk); 'routes' lists every option, lowest cost first.
         """
         try:
+            if self.route_engine is not None:
+                result = self._find_graph_routes(start_lat, start_lng, end_lat, end_lng,
+                                                 alternatives, risk_weight)
+                if result is not None:
+                    return result
+            
             # Calculate direct route
             start = (start_lat, start_lng)
             end = (end_lat, end_lng)
-            distance = geodesic(start, end).kilometers
+            distance = self._distance_km(start, end)
             
             # Sample multiple waypoints along the route
             num_waypoints = max(3, int(distance * 2))
-            waypoints = []
-            
-            for i in range(num_waypoints + 1):
-                fraction = i / num_waypoints
-                lat = start_lat + (end_lat - start_lat) * fraction
-                lng = start_lng + (end_lng - start_lng) * fraction
-                
-                safety = self.get_location_safety_score(lat, lng)
-                waypoints.append({
-                    'latitude': lat,
-                    'longitude': lng,
-                    'safety_score': safety.get('safety_score', 50)
-                })
-            
-            # Calculate route safety score
-            avg_safety = np.mean([w['safety_score'] for w in waypoints])
-            min_safety = min([w['safety_score'] for w in waypoints])
+            fractions = np.arange(num_waypoints + 1) / num_waypoints
+            lats = start_lat + (end_lat - start_lat) * fractions
+            lngs = start_lng + (end_lng - start_lng) * fractions
             
+            route = self._describe_route(lats, lngs, distance)
             return {
                 'start': {'latitude': start_lat, 'longitude': start_lng},
                 'end': {'latitude': end_lat, 'longitude': end_lng},
-                'distance_km': round(distance, 2),
-                'waypoints': waypoints,
-                'average_safety_score': round(avg_safety, 2),
-                'minimum_safety_score': round(min_safety, 2),
-                'overall_route_safety': self._get_safety_level(avg_safety),
-                'warnings': self._get_route_warnings(waypoints)
+                **route
             }
         except Exception as e:
             logger.error(f"Error finding safe route: {e}")
@@ -151,6 +229,16 @@ class SafetyScorer:
                 tiles='OpenStreetMap'
             )
             
+            # Precomputed risk heatmap, served as tiles by /api/safety/tiles
+            if self.risk_raster is not None:
+                folium.TileLayer(
+                    tiles=RISK_TILE_URL,
+                    attr='SafeCircle risk raster',
+                    name='Crime risk',
+                    overlay=True,
+                    opacity=0.7
+                ).add_to(safety_map)
+            
             # Add center marker
             folium.Marker(
                 [center_lat, center_lng],
@@ -159,20 +247,18 @@ class SafetyScorer:
             ).add_to(safety_map)
             
             # Add crime hotspots
-            for hotspot in self.crime_hotspots:
-                if geodesic((center_lat, center_lng), 
-                           (hotspot['lat'], hotspot['lng'])).kilometers <= radius_km:
-                    
-                    color = 'red' if hotspot['severity'] == 'high' else 'orange'
-                    folium.CircleMarker(
-                        location=[hotspot['lat'], hotspot['lng']],
-                        radius=hotspot['severity_score'] * 20,
-                        popup=f"Risk: {hotspot['severity']} - {hotspot['type']}",
-                        color=color,
-                        fill=True,
-                        fillColor=color,
-                        fillOpacity=0.4
-                    ).add_to(safety_map)
+            ids, _ = self._hotspots_within(center_lat, center_lng, radius_km)
+            for hotspot in (self.crime_hotspots[i] for i in ids):
+                color = 'red' if hotspot['severity'] == 'high' else 'orange'
+                folium.CircleMarker(
+                    location=[hotspot['lat'], hotspot['lng']],
+                    radius=hotspot['severity_score'] * 20,
+                    popup=f"Risk: {hotspot['severity']} - {hotspot['type']}",
+                    color=color,
+                    fill=True,
+                    fillColor=color,
+                    fillOpacity=0.4
+                ).add_to(safety_map)
             
             # Save map
             map_path = f"../frontend/static/{output_file}"
@@ -187,8 +273,63 @@ class SafetyScorer:
             logger.error(f"Error generating safety map: {e}")
             return {"error": str(e)}
     
+    def load_crime_hotspots(self, hotspots):
+        """
+        Replace the crime hotspot set and rebuild the spatial index
+        
+        Args:
+            hotspots (list): Dicts with lat, lng, severity, severity_score and type
+        """
+        self.crime_hotspots = list(hotspots)
+        
+        # Cells match the decay radius so a score touches at most a few cells
+        self.hotspot_index = GeoGridIndex(self.crime_hotspots, cell_km=DECAY_RADIUS_KM)
+        
+        # Column arrays in index order for the vectorized kernels
+        self._hotspot_lats = np.array([h['lat'] for h in self.crime_hotspots], dtype=float)
+        self._hotspot_lngs = np.array([h['lng'] for h in self.crime_hotspots], dtype=float)
+        self._hotspot_severity = np.array([h['severity_score'] for h in self.crime_hotspots], dtype=float)
+        
+        # Every hotspot contributes at least its far-field risk, wherever it is
+        self._far_field_risk = float(self._hotspot_severity.max() * FAR_RISK_FACTOR) if self.crime_hotspots else 0.0
+        
+        # Rebuild the raster chunks whose hotspots changed
+        if self.risk_raster is not None:
+            self.risk_raster.update(
+                self._hotspot_lats, self._hotspot_lngs, self._hotspot_severity,
+                self._calculate_near_field_risks, DECAY_RADIUS_KM,
+                floor=self._far_field_risk if self.crime_hotspots else 0.3,
+                params={'distance_mode': self.distance_mode, 'full_radius_km': FULL_RISK_RADIUS_KM,
+                        'far_factor': FAR_RISK_FACTOR}
+            )
+        
+        # Edge risk depends on the hotspots, so recompute it with them
+        if self.route_engine is not None:
+            self.route_engine.graph.update_risk(self._calculate_crime_risks)
+            self.route_engine.refresh()
+    
+    def _initialize_route_engine(self):
+        """Load the road graph from ROAD_GRAPH_PATH, if configured"""
+        if not ROAD_GRAPH_PATH:
+            return None
+        try:
+            graph = RoadGraph.load(ROAD_GRAPH_PATH)
+            logger.info(f"✅ Loaded road graph with {graph.node_count} nodes from {ROAD_GRAPH_PATH}")
+            return RouteEngine(graph)
+        except Exception as e:
+            logger.error(f"❌ Error loading road graph, using direct routes: {e}")
+            return None
+    
     def _initialize_crime_data(self):
         """Initialize sample crime hotspot data"""
+        if CRIME_DATA_PATH:
+            try:
+                hotspots = pd.read_csv(CRIME_DATA_PATH).to_dict('records')
+                logger.info(f"✅ Loaded {len(hotspots)} crime hotspots from {CRIME_DATA_PATH}")
+                return hotspots
+            except Exception as e:
+                logger.error(f"❌ Error loading crime data, using sample data: {e}")
+        
         # In production, load this from a real crime database
         return [
             {'lat': 28.6139, 'lng': 77.2090, 'severity': 'high', 'severity_score': 0.8, 'type': 'theft'},
@@ -200,26 +341,159 @@ class SafetyScorer:
     
     def _calculate_crime_risk(self, location):
         """Calculate crime risk based on proximity to hotspots"""
+        return float(self._calculate_crime_risks([location[0]], [location[1]])[0])
+    
+    def _calculate_crime_risks(self, latitudes, longitudes):
+        """Calculate crime risk for arrays of points"""
         if not self.crime_hotspots:
-            return 0.3  # Default moderate risk
+            return np.full(np.size(latitudes), 0.3)  # Default moderate risk
+        
+        # Grid lookup when the risk raster is enabled
+        if self.risk_raster is not None:
+            return self.risk_raster.risk(latitudes, longitudes)
+        
+        # Hotspots outside the decay radius only add their far-field risk
+        risks = np.maximum(self._calculate_near_field_risks(latitudes, longitudes), self._far_field_risk)
+        
+        # Return maximum risk from nearby hotspots
+        return np.minimum(risks, 1.0)
+    
+    def _calculate_near_field_risks(self, latitudes, longitudes):
+        """Strongest risk from hotspots within the decay radius of each point"""
+        lats = np.asarray(latitudes, dtype=float)
+        lngs = np.asarray(longitudes, dtype=float)
+        risks = np.zeros(lats.size)
+        
+        # Group points by tile so each block only pulls in hotspots near it
+        tiles = np.floor(lats / SCORE_TILE_DEG) * 100000 + np.floor(lngs / SCORE_TILE_DEG)
+        order = np.argsort(tiles, kind='stable')
+        _, tile_starts = np.unique(tiles[order], return_index=True)
+        tile_bounds = list(tile_starts) + [lats.size]
+        
+        for tile_start, tile_end in zip(tile_bounds[:-1], tile_bounds[1:]):
+            for start in range(tile_start, tile_end, SCORE_BLOCK_SIZE):
+                block = order[start:min(start + SCORE_BLOCK_SIZE, tile_end)]
+                ids = np.asarray(self.hotspot_index.candidates_in_box(
+                    lats[block].min(), lngs[block].min(),
+                    lats[block].max(), lngs[block].max(),
+                    DECAY_RADIUS_KM
+                ), dtype=np.intp)
+                if ids.size == 0:
+                    continue
+                
+                with metrics.stage('geodesic', mode=self.distance_mode):
+                    risks[block] = geo_kernels.max_risk(
+                        lats[block], lngs[block],
+                        self._hotspot_lats[ids], self._hotspot_lngs[ids], self._hotspot_severity[ids],
+                        FULL_RISK_RADIUS_KM, DECAY_RADIUS_KM, 0.0,
+                        mode=self.distance_mode
+                    )
+        
+        return risks
+    
+    def _score_arrays(self, latitudes, longitudes, times=None, crime_risks=None):
+        """Crime risk, time risk and safety score arrays for many points (crime risk may be precomputed)"""
+        if crime_risks is None:
+            crime_risks = self._calculate_crime_risks(latitudes, longitudes)
         
-        risks = []
-        for hotspot in self.crime_hotspots:
-            hotspot_location = (hotspot['lat'], hotspot['lng'])
-            distance = geodesic(location, hotspot_location).kilometers
+        if times is None or isinstance(times, datetime):
+            time_risks = np.full(crime_risks.size, self._calculate_time_risk(times))
+        else:
+            time_risks = np.array([self._calculate_time_risk(t) for t in times], dtype=float)
+        
+        # Calculate overall safety score (0-100, higher is safer)
+        base_safety = 100 - (crime_risks * 100)
+        safety_scores = np.clip(base_safety / time_risks, 0, 100)
+        
+        return crime_risks, time_risks, safety_scores
+    
+    def _hotspots_within(self, latitude, longitude, radius_km):
+        """Ids and distances (km) of hotspots within a radius, nearest first"""
+        ids = np.asarray(
+            self.hotspot_index.candidates_in_box(latitude, longitude, latitude, longitude, radius_km),
+            dtype=np.intp
+        )
+        if ids.size == 0:
+            return ids, np.zeros(0)
+        
+        distances = geo_kernels.distance_matrix(
+            [latitude], [longitude], self._hotspot_lats[ids], self._hotspot_lngs[ids],
+            mode=self.distance_mode
+        )[0]
+        keep = distances <= radius_km
+        ids, distances = ids[keep], distances[keep]
+        
+        order = np.argsort(distances, kind='stable')
+        return ids[order], distances[order]
+    
+    def _distance_km(self, point_a, point_b):
+        """Distance in kilometres between two (lat, lng) tuples"""
+        return float(geo_kernels.distance_matrix(
+            [point_a[0]], [point_a[1]], [point_b[0]], [point_b[1]], mode=self.distance_mode
+        )[0, 0])
+    
+    def _find_graph_routes(self, start_lat, start_lng, end_lat, end_lng, alternatives, risk_weight):
+        """Routes over the road graph, or None if the points are off the network"""
+        k = ROUTE_ALTERNATIVES if alternatives is None else int(alternatives)
+        k = min(max(1, k), MAX_ROUTE_ALTERNATIVES)
+        
+        found = self.route_engine.find_routes(start_lat, start_lng, end_lat, end_lng,
+                                              k=k, risk_weight=risk_weight)
+        if not found:
+            return None
+        
+        graph = self.route_engine.graph
+        routes = []
+        for found_route in found:
+            nodes = np.asarray(found_route['nodes'], dtype=np.intp)
+            lats = np.concatenate([[start_lat], graph.node_lats[nodes], [end_lat]])
+            lngs = np.concatenate([[start_lng], graph.node_lngs[nodes], [end_lng]])
             
-            # Risk decreases with distance (exponential decay)
-            if distance < 0.5:
-                risk = hotspot['severity_score']
-            elif distance < 2:
-                risk = hotspot['severity_score'] * np.exp(-distance/2)
-            else:
-                risk = hotspot['severity_score'] * 0.1
+            # Graph nodes keep the risk computed with the edge risk; only the endpoints are scored here
+            crime_risks = None
+            if graph.node_risk is not None:
+                end_risks = self._calculate_crime_risks([start_lat, end_lat], [start_lng, end_lng])
+                crime_risks = np.concatenate([end_risks[:1], graph.node_risk[nodes], end_risks[1:]])
             
-            risks.append(risk)
+            # Include the walk to and from the snapped graph nodes
+            access = geo_kernels.haversine_pairwise(lats[[0, -2]], lngs[[0, -2]], lats[[1, -1]], lngs[[1, -1]])
+            route = self._describe_route(lats, lngs, found_route['distance_km'] + float(access.sum()), crime_risks)
+            route['risk_exposure'] = round(found_route['risk_exposure'], 3)
+            routes.append(route)
         
-        # Return maximum risk from nearby hotspots
-        return min(max(risks) if risks else 0.3, 1.0)
+        return {
+            'start': {'latitude': start_lat, 'longitude': start_lng},
+            'end': {'latitude': end_lat, 'longitude': end_lng},
+            **routes[0],
+            'routes': routes,
+            'routing': 'graph'
+        }
+    
+    def _describe_route(self, lats, lngs, distance, crime_risks=None):
+        """Waypoint scores and summary for a route through the given points"""
+        # Score all waypoints in one pass
+        _, _, safety_scores = self._score_arrays(lats, lngs, crime_risks=crime_risks)
+        waypoints = [
+            {
+                'latitude': float(lat),
+                'longitude': float(lng),
+                'safety_score': round(float(safety), 2)
+            }
+            for lat, lng, safety in zip(lats, lngs, safety_scores)
+        ]
+        
+        # Calculate route safety score
+        avg_safety = np.mean([w['safety_score'] for w in waypoints])
+        min_safety = min([w['safety_score'] for w in waypoints])
+        
+        return {
+            'distance_km': round(distance, 2),
+            'waypoints': waypoints,
+            'average_safety_score': round(avg_safety, 2),
+            'minimum_safety_score': round(min_safety, 2),
+            'overall_route_safety': self._get_safety_level(avg_safety),
+            'warnings': self._get_route_warnings(waypoints)
+        }
     
     def _calculate_time_risk(self, current_time=None):
         """Calculate risk factor based on time of day"""
@@ -238,26 +512,25 @@ class SafetyScorer:
     def _get_location_name(self, latitude, longitude):
         """Get human-readable location name"""
         try:
-            location = self.geolocator.reverse(f"{latitude}, {longitude}")
-            return location.address if location else "Unknown Location"
-        except:
+            return self.reverse_geocoder.reverse(latitude, longitude)
+        except Exception as e:
+            logger.error(f"Error resolving location name: {e}")
             return "Unknown Location"
     
     def _get_nearby_incidents(self, location):
         """Get nearby crime incidents"""
         incidents = []
-        for hotspot in self.crime_hotspots:
-            hotspot_location = (hotspot['lat'], hotspot['lng'])
-            distance = geodesic(location, hotspot_location).kilometers
-            
+        ids, distances = self._hotspots_within(location[0], location[1], 1)
+        for i, distance in zip(ids, distances):
             if distance < 1:  # Within 1 km
+                hotspot = self.crime_hotspots[i]
                 incidents.append({
                     'type': hotspot['type'],
                     'severity': hotspot['severity'],
-                    'distance_km': round(distance, 2)
+                    'distance_km': round(float(distance), 2)
                 })
         
-        return sorted(incidents, key=lambda x: x['distance_km'])[:5]
+        return incidents[:5]
     
     @staticmethod
     def _get_safety_level(score):
@@ -304,5 +577,5 @@ class SafetyScorer:
 
 
 # Initialize global safety scorer instance
-safety_scorer = SafetyScorer()
+safety_scorer = lazy.register('safety', SafetyScorer)
 
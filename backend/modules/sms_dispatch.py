@@ -0,0 +1,38 @@
+"""
+SMS Transport
+Twilio HTTP client tuned for many concurrent sends: pooled keep-alive
+connections, a per-request timeout, and an overridable API host.
+"""
+from requests.adapters import HTTPAdapter
+from twilio.http.http_client import TwilioHttpClient
+import os
+
+# Keep-alive connections to the API host (at least the alert worker count)
+SMS_POOL_SIZE = int(os.getenv('SMS_POOL_SIZE', '16'))
+SMS_SEND_TIMEOUT = float(os.getenv('SMS_SEND_TIMEOUT', '10'))
+
+# Point the Twilio client at another host (e.g. a local fake server)
+TWILIO_API_BASE = os.getenv('TWILIO_API_BASE', '')
+TWILIO_DEFAULT_BASE = 'https://api.twilio.com'
+
+
+class PooledTwilioHttpClient(TwilioHttpClient):
+    """Twilio HTTP client with a connection pool sized for concurrent sends"""
+
+    def __init__(self, timeout=SMS_SEND_TIMEOUT, pool_size=SMS_POOL_SIZE, api_base=None):
+        """
+        Args:
+            timeout (float): Per-request timeout in seconds
+            pool_size (int): Connections kept open to the API host
+            api_base (str): Replacement for https://api.twilio.com (optional)
+        """
+        super().__init__(pool_connections=True, timeout=timeout)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.api_base = (TWILIO_API_BASE if api_base is None else api_base).rstrip('/')
+
+    def request(self, method, url, *args, **kwargs):
+        if self.api_base and url.startswith(TWILIO_DEFAULT_BASE):
+            url = self.api_base + url[len(TWILIO_DEFAULT_BASE):]
+        return super().request(method, url, *args, **kwargs)
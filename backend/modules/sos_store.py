@@ -0,0 +1,205 @@
+"""
+SOS History Store
+Persistent record of SOS alerts with indexes on time, user and location,
+cursor-based pagination, and a retention policy so storage stays bounded.
+"""
+from sqlalchemy import Table, Column, Integer, Float, String, Text, Index, select, delete, func, and_, or_, true
+from modules import database
+from datetime import datetime
+import base64
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Events older than this are deleted (0 keeps everything)
+SOS_HISTORY_RETENTION_DAYS = float(os.getenv('SOS_HISTORY_RETENTION_DAYS', '365'))
+# At most this many events are kept, oldest dropped first (0 means no cap)
+SOS_HISTORY_MAX_EVENTS = int(os.getenv('SOS_HISTORY_MAX_EVENTS', '0'))
+
+# Retention runs at most this often (seconds), from the recording thread
+RETENTION_INTERVAL = 3600
+
+MAX_PAGE_SIZE = 500
+
+sos_events = Table(
+    'sos_events', database.metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('timestamp', Float, nullable=False),
+    Column('user_id', String(128)),
+    Column('user_name', String(256)),
+    Column('latitude', Float),
+    Column('longitude', Float),
+    Column('message', Text),
+    Column('contacts_alerted', Integer, nullable=False, default=0),
+    Column('results', Text),
+    Index('ix_sos_events_timestamp', 'timestamp', 'id'),
+    Index('ix_sos_events_user_timestamp', 'user_id', 'timestamp'),
+    Index('ix_sos_events_location', 'latitude', 'longitude'),
+)
+
+
+class SosStore:
+    """Indexed, paginated SOS event history"""
+
+    def __init__(self, engine=None, retention_days=None, max_events=None):
+        """
+        Args:
+            engine: SQLAlchemy engine (defaults to the shared DATABASE_URL engine)
+            retention_days (float): Age after which events are deleted (0 keeps all)
+            max_events (int): Cap on stored events (0 means no cap)
+        """
+        self._engine = engine
+        self.retention_days = SOS_HISTORY_RETENTION_DAYS if retention_days is None else retention_days
+        self.max_events = SOS_HISTORY_MAX_EVENTS if max_events is None else max_events
+        self._last_retention = 0.0
+        self._retention_lock = threading.Lock()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            return database.get_engine()
+        return self._engine
+
+    def record(self, event):
+        """
+        Store an SOS event
+
+        Args:
+            event (dict): timestamp (ISO string), user_id, user_name,
+                location {'latitude', 'longitude'}, message,
+                contacts_alerted and results
+
+        Returns:
+            int: Event id
+        """
+        location = event.get('location') or {}
+        with self.engine.begin() as conn:
+            event_id = conn.execute(sos_events.insert().values(
+                timestamp=datetime.fromisoformat(event['timestamp']).timestamp(),
+                user_id=event.get('user_id'),
+                user_name=event.get('user_name'),
+                latitude=location.get('latitude'),
+                longitude=location.get('longitude'),
+                message=event.get('message'),
+                contacts_alerted=event.get('contacts_alerted', 0),
+                results=json.dumps(event.get('results', []))
+            )).inserted_primary_key[0]
+
+        if time.time() - self._last_retention > RETENTION_INTERVAL:
+            self.apply_retention()
+        return event_id
+
+    def query(self, limit=10, cursor=None, since=None, until=None, bbox=None, user_id=None):
+        """
+        Page through events, newest first
+
+        Args:
+            limit (int): Page size (capped at MAX_PAGE_SIZE)
+            cursor (str): next_cursor from the previous page
+            since, until (datetime): Time range (inclusive, exclusive)
+            bbox (tuple): (min_lat, min_lng, max_lat, max_lng)
+            user_id (str): Only this user's events
+
+        Returns:
+            tuple: (events, next_cursor); next_cursor is None on the last page
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        conditions = []
+        if since is not None:
+            conditions.append(sos_events.c.timestamp >= since.timestamp())
+        if until is not None:
+            conditions.append(sos_events.c.timestamp < until.timestamp())
+        if bbox is not None:
+            min_lat, min_lng, max_lat, max_lng = bbox
+            conditions.append(sos_events.c.latitude.between(min_lat, max_lat))
+            conditions.append(sos_events.c.longitude.between(min_lng, max_lng))
+        if user_id is not None:
+            conditions.append(sos_events.c.user_id == user_id)
+        if cursor:
+            cursor_ts, cursor_id = self._decode_cursor(cursor)
+            conditions.append(or_(
+                sos_events.c.timestamp < cursor_ts,
+                and_(sos_events.c.timestamp == cursor_ts, sos_events.c.id < cursor_id)
+            ))
+
+        statement = (
+            select(sos_events)
+            .where(and_(true(), *conditions))
+            .order_by(sos_events.c.timestamp.desc(), sos_events.c.id.desc())
+            .limit(limit + 1)
+        )
+        with self.engine.connect() as conn:
+            rows = conn.execute(statement).mappings().all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+        return [self._to_event(row) for row in rows], next_cursor
+
+    def count(self):
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(sos_events)).scalar_one()
+
+    def apply_retention(self):
+        """
+        Delete events past the retention age or beyond the event cap
+
+        Returns:
+            int: Number of events deleted
+        """
+        if not self._retention_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._last_retention = time.time()
+            deleted = 0
+            with self.engine.begin() as conn:
+                if self.retention_days:
+                    cutoff = time.time() - self.retention_days * 86400
+                    deleted += conn.execute(delete(sos_events).where(sos_events.c.timestamp < cutoff)).rowcount
+                if self.max_events:
+                    # Timestamp of the newest event that falls outside the cap
+                    boundary = conn.execute(
+                        select(sos_events.c.timestamp, sos_events.c.id)
+                        .order_by(sos_events.c.timestamp.desc(), sos_events.c.id.desc())
+                        .offset(self.max_events).limit(1)
+                    ).first()
+                    if boundary is not None:
+                        deleted += conn.execute(delete(sos_events).where(or_(
+                            sos_events.c.timestamp < boundary[0],
+                            and_(sos_events.c.timestamp == boundary[0], sos_events.c.id <= boundary[1])
+                        ))).rowcount
+            if deleted:
+                logger.info(f"SOS history retention removed {deleted} events")
+            return deleted
+        finally:
+            self._retention_lock.release()
+
+    @staticmethod
+    def _to_event(row):
+        return {
+            'id': row['id'],
+            'timestamp': datetime.fromtimestamp(row['timestamp']).isoformat(),
+            'user_id': row['user_id'],
+            'user_name': row['user_name'],
+            'location': {'latitude': row['latitude'], 'longitude': row['longitude']},
+            'message': row['message'],
+            'contacts_alerted': row['contacts_alerted'],
+            'results': json.loads(row['results'] or '[]')
+        }
+
+    @staticmethod
+    def _encode_cursor(timestamp, event_id):
+        return base64.urlsafe_b64encode(f"{timestamp!r}:{event_id}".encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            timestamp, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+            return float(timestamp), int(event_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
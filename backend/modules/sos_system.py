@@ -5,9 +5,17 @@ Provides panic button, location sharing, and emergency notifications
 """
 import os
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
 from datetime import datetime
+from modules import lazy
+from modules.alert_queue import AlertQueue, LANE_SOS, LANE_LOCATION, LANE_CHECKIN
+from modules.metrics import metrics
+from modules.sms_dispatch import PooledTwilioHttpClient
+from modules.sos_store import SosStore
+from modules.contact_store import ContactStore, normalize_phone
 import logging
 import json
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +32,10 @@ class SOSSystem:
         # Initialize Twilio client if credentials available
         if self.twilio_sid and self.twilio_token:
             try:
-                self.client = Client(self.twilio_sid, self.twilio_token)
+                self.client = Client(
+                    self.twilio_sid, self.twilio_token,
+                    http_client=PooledTwilioHttpClient()
+                )
                 logger.info("✅ Twilio SOS system initialized")
             except Exception as e:
                 logger.error(f"❌ Error initializing Twilio: {e}")
@@ -34,12 +45,18 @@ class SOSSystem:
             self.client = None
         
         # Emergency contacts
-        self.emergency_contacts = self._load_emergency_contacts()
+        self.contact_store = ContactStore()
+        self._load_emergency_contacts()
+        
+        # SOS history (persistent, indexed by time, user and location)
+        self.history_store = SosStore()
         
-        # SOS history
-        self.sos_history = []
+        # Durable outbox; messages are sent in parallel by its workers
+        self.alert_queue = AlertQueue(self._send_sms)
+        self.alert_queue.resume()
     
-    def send_sos_alert(self, user_name, latitude, longitude, message="", contacts=None):
+    def send_sos_alert(self, user_name, latitude, longitude, message="", contacts=None, idempotency_key=None,
+                       user_id=None):
         """
         Send SOS alert to emergency contacts
         
@@ -49,18 +66,22 @@ class SOSSystem:
             longitude (float): Current longitude
             message (str): Optional additional message
             contacts (list): Phone numbers to alert
+            idempotency_key (str): Repeating a request with the same key sends nothing new
+            user_id (str): Stable user identifier; selects the stored contacts
+                and tags the history event (defaults to user_name there)
             
         Returns:
             dict: Status of SOS alert
         """
         try:
-            # Use provided contacts or default emergency contacts
-            recipients = contacts or self.emergency_contacts
+            # Use provided contacts or the user's emergency contacts
+            recipients, rejected = self._resolve_recipients(contacts, user_id)
             
             if not recipients:
                 return {
                     "status": "error",
-                    "message": "No emergency contacts configured"
+                    "message": "No valid emergency contacts" if rejected else "No emergency contacts configured",
+                    "contacts_alerted": rejected
                 }
             
             # Create Google Maps link
@@ -69,30 +90,26 @@ class SOSSystem:
             # Compose SOS message
             sos_message = self._compose_sos_message(user_name, maps_link, message)
             
-            # Send alerts
-            results = []
-            for contact in recipients:
-                result = self._send_sms(contact, sos_message)
-                results.append({
-                    'contact': contact,
-                    'status': result['status'],
-                    'message_sid': result.get('message_sid')
-                })
+            # Queue alerts (delivery statuses are tracked in the alert queue)
+            results = self._enqueue(recipients, sos_message, LANE_SOS, 'sos', idempotency_key) + rejected
             
             # Log SOS event
             sos_event = {
                 'timestamp': datetime.now().isoformat(),
+                'user_id': user_id or user_name,
                 'user_name': user_name,
                 'location': {'latitude': latitude, 'longitude': longitude},
                 'message': message,
                 'contacts_alerted': len(recipients),
                 'results': results
             }
-            self.sos_history.append(sos_event)
+            # A replayed request (same idempotency key) is already recorded
+            if not all(r.get('duplicate') for r in results if r['status'] != 'invalid'):
+                self.history_store.record(sos_event)
             
             return {
                 'status': 'success',
-                'message': f'SOS alert sent to {len(recipients)} contacts',
+                'message': f'SOS alert dispatched to {len(recipients)} contacts',
                 'timestamp': sos_event['timestamp'],
                 'location_link': maps_link,
                 'contacts_alerted': results
@@ -105,7 +122,8 @@ class SOSSystem:
                 "message": str(e)
             }
     
-    def share_live_location(self, user_name, latitude, longitude, contacts=None):
+    def share_live_location(self, user_name, latitude, longitude, contacts=None, idempotency_key=None,
+                            user_id=None):
         """
         Share live location with trusted contacts
         
@@ -114,17 +132,20 @@ class SOSSystem:
             latitude (float): Current latitude
             longitude (float): Current longitude
             contacts (list): Phone numbers to share with
+            idempotency_key (str): Repeating a request with the same key sends nothing new
+            user_id (str): Whose stored contacts to use when contacts is empty
             
         Returns:
             dict: Status of location sharing
         """
         try:
-            recipients = contacts or self.emergency_contacts
+            recipients, rejected = self._resolve_recipients(contacts, user_id)
             
             if not recipients:
                 return {
                     "status": "error",
-                    "message": "No contacts configured for location sharing"
+                    "message": "No valid contacts" if rejected else "No contacts configured for location sharing",
+                    "contacts": rejected
                 }
             
             maps_link = f"https://www.google.com/maps?q={latitude},{longitude}"
@@ -136,13 +157,7 @@ class SOSSystem:
                 f"Track location: Follow the link above"
             )
             
-            results = []
-            for contact in recipients:
-                result = self._send_sms(contact, location_message)
-                results.append({
-                    'contact': contact,
-                    'status': result['status']
-                })
+            results = self._enqueue(recipients, location_message, LANE_LOCATION, 'location', idempotency_key) + rejected
             
             return {
                 'status': 'success',
@@ -158,7 +173,7 @@ class SOSSystem:
                 "message": str(e)
             }
     
-    def send_safety_checkin(self, user_name, status, contacts=None):
+    def send_safety_checkin(self, user_name, status, contacts=None, idempotency_key=None, user_id=None):
         """
         Send safety check-in to contacts
         
@@ -166,12 +181,14 @@ class SOSSystem:
             user_name (str): User's name
             status (str): Safety status message
             contacts (list): Phone numbers to notify
+            idempotency_key (str): Repeating a request with the same key sends nothing new
+            user_id (str): Whose stored contacts to use when contacts is empty
             
         Returns:
             dict: Status of check-in
         """
         try:
-            recipients = contacts or self.emergency_contacts
+            recipients, rejected = self._resolve_recipients(contacts, user_id)
             
             checkin_message = (
                 f"✅ Safety Check-in from {user_name}\n\n"
@@ -180,13 +197,7 @@ class SOSSystem:
                 f"All is well!"
             )
             
-            results = []
-            for contact in recipients:
-                result = self._send_sms(contact, checkin_message)
-                results.append({
-                    'contact': contact,
-                    'status': result['status']
-                })
+            results = self._enqueue(recipients, checkin_message, LANE_CHECKIN, 'checkin', idempotency_key) + rejected
             
             return {
                 'status': 'success',
@@ -201,36 +212,60 @@ class SOSSystem:
                 "message": str(e)
             }
     
-    def get_sos_history(self, limit=10):
+    def get_sos_history(self, limit=10, cursor=None, since=None, until=None, bbox=None, user_id=None):
         """
-        Retrieve recent SOS history
+        Retrieve SOS history, newest first
         
         Args:
-            limit (int): Number of recent events to retrieve
+            limit (int): Number of events per page
+            cursor (str): next_cursor from the previous page
+            since, until (datetime): Time range filter
+            bbox (tuple): (min_lat, min_lng, max_lat, max_lng) location filter
+            user_id (str): Only this user's events
             
         Returns:
-            list: Recent SOS events
+            dict: 'history' (events with current delivery statuses) and 'next_cursor'
         """
-        return self.sos_history[-limit:]
+        events, next_cursor = self.history_store.query(
+            limit, cursor=cursor, since=since, until=until, bbox=bbox, user_id=user_id
+        )
+        
+        # Delivery statuses live in the alert queue
+        message_ids = [r['message_id'] for e in events for r in e['results'] if r.get('message_id')]
+        statuses = self.alert_queue.get_status(message_ids)
+        for event in events:
+            for result in event['results']:
+                state = statuses.get(result.get('message_id'))
+                if state:
+                    result['status'] = 'queued' if state['status'] in ('pending', 'sending') else state['status']
+                    if state.get('message_sid'):
+                        result['message_sid'] = state['message_sid']
+        
+        return {'history': events, 'next_cursor': next_cursor}
     
-    def add_emergency_contact(self, phone_number, name=""):
+    @property
+    def emergency_contacts(self):
+        """Default user's emergency contact numbers"""
+        return list(self.contact_store.numbers())
+    
+    def add_emergency_contact(self, phone_number, name="", user_id=None):
         """
         Add emergency contact
         
         Args:
             phone_number (str): Contact phone number
             name (str): Contact name (optional)
+            user_id (str): Owner of the contact (optional, default contacts otherwise)
             
         Returns:
             dict: Status of addition
         """
         try:
-            if phone_number not in self.emergency_contacts:
-                self.emergency_contacts.append(phone_number)
-                self._save_emergency_contacts()
+            added, phone = self.contact_store.add(phone_number, name, user_id)
+            if added:
                 return {
                     'status': 'success',
-                    'message': f'Contact added: {name or phone_number}'
+                    'message': f'Contact added: {name or phone}'
                 }
             else:
                 return {
@@ -243,12 +278,10 @@ class SOSSystem:
                 'message': str(e)
             }
     
-    def remove_emergency_contact(self, phone_number):
+    def remove_emergency_contact(self, phone_number, user_id=None):
         """Remove emergency contact"""
         try:
-            if phone_number in self.emergency_contacts:
-                self.emergency_contacts.remove(phone_number)
-                self._save_emergency_contacts()
+            if self.contact_store.remove(phone_number, user_id):
                 return {
                     'status': 'success',
                     'message': 'Contact removed'
@@ -264,24 +297,59 @@ class SOSSystem:
                 'message': str(e)
             }
     
+    def _resolve_recipients(self, contacts, user_id=None):
+        """
+        Normalized, de-duplicated recipients (stored contacts if none given)
+        
+        Returns:
+            tuple: (numbers to alert, {'contact', 'status': 'invalid', 'error'} per rejected number)
+        """
+        if not contacts:
+            return list(self.contact_store.numbers(user_id)), []
+        
+        recipients = {}
+        rejected = []
+        for contact in contacts:
+            try:
+                recipients[normalize_phone(contact)] = None
+            except ValueError as e:
+                logger.warning(f"Invalid recipient: {e}")
+                rejected.append({'contact': contact, 'status': 'invalid', 'error': str(e)})
+        return list(recipients), rejected
+    
+    def _enqueue(self, recipients, message, lane, kind, idempotency_key=None):
+        """Queue a message for every recipient"""
+        key = f"{kind}:{idempotency_key or uuid.uuid4().hex}"
+        return self.alert_queue.enqueue(recipients, message, lane, key)
+    
     def _send_sms(self, to_number, message):
         """Send SMS via Twilio or simulate if not configured"""
         if self.client and self.twilio_phone:
             try:
-                message_obj = self.client.messages.create(
-                    body=message,
-                    from_=self.twilio_phone,
-                    to=to_number
-                )
+                with metrics.stage('twilio'):
+                    message_obj = self.client.messages.create(
+                        body=message,
+                        from_=self.twilio_phone,
+                        to=to_number
+                    )
                 return {
                     'status': 'sent',
                     'message_sid': message_obj.sid
                 }
+            except TwilioRestException as e:
+                logger.error(f"Twilio error: {e}")
+                return {
+                    'status': 'failed',
+                    'error': str(e),
+                    # Rate limits and server errors are worth retrying; bad numbers are not
+                    'retryable': e.status == 429 or e.status >= 500
+                }
             except Exception as e:
                 logger.error(f"Twilio error: {e}")
                 return {
                     'status': 'failed',
-                    'error': str(e)
+                    'error': str(e),
+                    'retryable': True
                 }
         else:
             # Simulate SMS for testing
@@ -311,18 +379,13 @@ class SOSSystem:
         return message
     
     def _load_emergency_contacts(self):
-        """Load emergency contacts from environment or storage"""
+        """Seed the default contacts from EMERGENCY_CONTACTS on first run"""
         contacts_env = os.getenv('EMERGENCY_CONTACTS', '')
+        # Seeded once; after that contacts are managed through the API
         if contacts_env:
-            return [c.strip() for c in contacts_env.split(',') if c.strip()]
-        return []
-    
-    def _save_emergency_contacts(self):
-        """Save emergency contacts (in production, use database)"""
-        # This is a placeholder - in production, save to database
-        logger.info(f"Emergency contacts updated: {len(self.emergency_contacts)} contacts")
+            self.contact_store.seed(c.strip() for c in contacts_env.split(',') if c.strip())
 
 
 # Initialize global SOS system instance
-sos_system = SOSSystem()
+sos_system = lazy.register('sos', SOSSystem)
 
@@ -0,0 +1,220 @@
+"""
+Spatial Index for Geographic Points
+Uniform latitude/longitude grid (geohash-style buckets) supporting radius
+and k-nearest-neighbour queries, so lookups only touch nearby points instead
+of scanning the whole dataset.
+"""
+import heapq
+import math
+
+# Kilometres per degree of latitude (lower bound over the ellipsoid) and per
+# degree of longitude at the equator. Both keep the search boxes conservative.
+KM_PER_DEG_LAT = 110.5
+KM_PER_DEG_LNG = 111.32
+EARTH_RADIUS_KM = 6371.0088
+
+# Extra room on every search box for the sphere/ellipsoid mismatch
+SEARCH_MARGIN = 1.01
+
+
+def haversine_km(point_a, point_b):
+    """Great-circle distance in kilometres between two (lat, lng) tuples"""
+    lat1, lng1 = map(math.radians, point_a)
+    lat2, lng2 = map(math.radians, point_b)
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GeoGridIndex:
+    """Grid index over records that carry a latitude and longitude"""
+
+    def __init__(self, points=(), cell_km=1.0, lat_key='lat', lng_key='lng'):
+        """
+        Build the index
+
+        Args:
+            points (iterable): Records (dicts) to index
+            cell_km (float): Approximate cell edge length in kilometres
+            lat_key (str): Record key holding the latitude
+            lng_key (str): Record key holding the longitude
+        """
+        self.cell_deg = cell_km / KM_PER_DEG_LAT
+        self.lat_key = lat_key
+        self.lng_key = lng_key
+
+        self._cells = {}
+        self._items = []
+        self._bounds = None
+        self._max_abs_lat = 0.0
+
+        for point in points:
+            self.insert(point)
+
+    def __len__(self):
+        return len(self._items)
+
+    def insert(self, point):
+        """
+        Add a record to the index
+
+        Args:
+            point (dict): Record with latitude and longitude keys
+
+        Returns:
+            int: Position of the record in the index
+        """
+        lat, lng = float(point[self.lat_key]), float(point[self.lng_key])
+        cell = self._cell(lat, lng)
+
+        item_id = len(self._items)
+        self._items.append((lat, lng, point))
+        self._cells.setdefault(cell, []).append(item_id)
+
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else:
+            self._bounds[0] = min(self._bounds[0], cell[0])
+            self._bounds[1] = max(self._bounds[1], cell[0])
+            self._bounds[2] = min(self._bounds[2], cell[1])
+            self._bounds[3] = max(self._bounds[3], cell[1])
+        self._max_abs_lat = max(self._max_abs_lat, abs(lat))
+
+        return item_id
+
+    def query_radius(self, latitude, longitude, radius_km, distance_fn=haversine_km):
+        """
+        Find records within a radius
+
+        Args:
+            latitude (float): Query latitude
+            longitude (float): Query longitude
+            radius_km (float): Search radius in kilometres
+            distance_fn (callable): Distance in km between two (lat, lng) tuples
+
+        Returns:
+            list: (distance_km, record) tuples sorted by distance
+        """
+        origin = (latitude, longitude)
+        matches = []
+        for item_id in self.candidates_in_box(latitude, longitude, latitude, longitude, radius_km):
+            lat, lng, point = self._items[item_id]
+            distance = distance_fn(origin, (lat, lng))
+            if distance <= radius_km:
+                matches.append((distance, item_id, point))
+
+        matches.sort()
+        return [(distance, point) for distance, _, point in matches]
+
+    def nearest(self, latitude, longitude, k=1, max_km=None, distance_fn=haversine_km):
+        """
+        Find the k nearest records
+
+        Searches rings of cells outwards from the query cell and stops once no
+        unvisited cell can hold anything closer than the current k-th match.
+
+        Args:
+            latitude (float): Query latitude
+            longitude (float): Query longitude
+            k (int): Number of records to return
+            max_km (float): Ignore records further away than this (optional)
+            distance_fn (callable): Distance in km between two (lat, lng) tuples
+
+        Returns:
+            list: Up to k (distance_km, record) tuples sorted by distance
+        """
+        if not self._items or k <= 0:
+            return []
+
+        origin = (latitude, longitude)
+        row, col = self._cell(latitude, longitude)
+
+        # Smallest distance a step of one cell can cover anywhere in the index
+        max_lat = min(89.9, max(self._max_abs_lat, abs(latitude)))
+        cell_km = self.cell_deg * min(KM_PER_DEG_LAT, KM_PER_DEG_LNG * math.cos(math.radians(max_lat)))
+        cell_km /= SEARCH_MARGIN
+
+        min_row, max_row, min_col, max_col = self._bounds
+        last_ring = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+        if max_km is not None:
+            last_ring = min(last_ring, int(max_km / cell_km) + 1)
+
+        # Max-heap of the best k matches, stored with negated distances
+        best = []
+        for ring in range(last_ring + 1):
+            for cell in self._ring(row, col, ring):
+                for item_id in self._cells.get(cell, ()):
+                    lat, lng, point = self._items[item_id]
+                    distance = distance_fn(origin, (lat, lng))
+                    if max_km is not None and distance > max_km:
+                        continue
+                    entry = (-distance, -item_id, point)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+
+            if len(best) == k and -best[0][0] <= ring * cell_km:
+                break
+
+        best.sort(reverse=True)
+        return [(-neg_distance, point) for neg_distance, _, point in best]
+
+    def candidates_in_box(self, min_lat, min_lng, max_lat, max_lng, margin_km=0.0):
+        """
+        Ids of records in the cells overlapping a bounding box
+
+        Ids are insertion positions, so callers can use them to index arrays
+        built in the same order as the records.
+
+        Args:
+            min_lat, min_lng, max_lat, max_lng (float): Box corners in degrees
+            margin_km (float): Grow the box by this distance on every side
+
+        Returns:
+            list: Candidate record ids (a superset of the records in the box)
+        """
+        if not self._items:
+            return []
+
+        dlat = margin_km * SEARCH_MARGIN / KM_PER_DEG_LAT
+        max_abs_lat = min(89.9, max(abs(min_lat), abs(max_lat)) + dlat)
+        dlng = min(180.0, margin_km * SEARCH_MARGIN / (KM_PER_DEG_LNG * math.cos(math.radians(max_abs_lat))))
+
+        row_lo, col_lo = self._cell(min_lat - dlat, min_lng - dlng)
+        row_hi, col_hi = self._cell(max_lat + dlat, max_lng + dlng)
+
+        # Clamp to occupied cells, then pick whichever walk is shorter
+        min_row, max_row, min_col, max_col = self._bounds
+        row_lo, row_hi = max(row_lo, min_row), min(row_hi, max_row)
+        col_lo, col_hi = max(col_lo, min_col), min(col_hi, max_col)
+        if row_lo > row_hi or col_lo > col_hi:
+            return []
+
+        ids = []
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) <= len(self._cells):
+            for cell_row in range(row_lo, row_hi + 1):
+                for cell_col in range(col_lo, col_hi + 1):
+                    ids.extend(self._cells.get((cell_row, cell_col), ()))
+        else:
+            for (cell_row, cell_col), cell_ids in self._cells.items():
+                if row_lo <= cell_row <= row_hi and col_lo <= cell_col <= col_hi:
+                    ids.extend(cell_ids)
+        return ids
+
+    def _cell(self, latitude, longitude):
+        """Grid cell containing a coordinate"""
+        return (math.floor(latitude / self.cell_deg), math.floor(longitude / self.cell_deg))
+
+    @staticmethod
+    def _ring(row, col, ring):
+        """Cells at Chebyshev distance `ring` from (row, col)"""
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
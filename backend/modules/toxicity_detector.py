@@ -3,25 +3,93 @@ Module 1: Toxicity Detection
 Uses Detoxify (MIT License) - https://github.com/unitaryai/detoxify
 Detects: Toxicity, Threat, Insult, Sexual content, Profanity, Hate speech
 """
-from detoxify import Detoxify
+from modules import lazy
+from modules.conversation_state import ConversationState
+from modules.metrics import metrics
+from modules.result_cache import result_cache
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Number of messages sent through the model in one forward pass
+DEFAULT_BATCH_SIZE = int(os.getenv('TOXICITY_BATCH_SIZE', '32'))
+
+# 'torch' or 'onnx' (ONNX Runtime, INT8 quantized; see modules/onnx_backend.py)
+TOXICITY_BACKEND = os.getenv('TOXICITY_BACKEND', 'torch')
+
 
 class ToxicityDetector:
     """Toxicity detection using Detoxify model"""
     
-    def __init__(self):
+    # Using 'original' model - you can also use 'unbiased' or 'multilingual'
+    MODEL_TYPE = 'original'
+    
+    def __init__(self, batch_size=None, cache=None, backend=None):
         """Initialize the Detoxify model"""
+        self.batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+        self.cache = cache if cache is not None else result_cache
+        self.backend = backend or TOXICITY_BACKEND
+        self.model_name = f"detoxify-{self.MODEL_TYPE}"
+        self.load_error = None
         try:
-            # Using 'original' model - you can also use 'unbiased' or 'multilingual'
-            self.model = Detoxify('original')
-            logger.info("✅ Toxicity detection model loaded successfully")
+            self.model = self._load_onnx() if self.backend == 'onnx' else None
+            if self.model is None:
+                self.backend = 'torch'
+                self.model = self._load_torch()
+            logger.info(f"✅ Toxicity detection model loaded successfully ({self.backend})")
         except Exception as e:
             logger.error(f"❌ Error loading toxicity model: {e}")
+            self.load_error = str(e)
             self.model = None
     
+    def _load_torch(self):
+        """Detoxify model, with its weights mapped from the model store when enabled"""
+        from detoxify import Detoxify
+        from modules.model_store import model_store
+        
+        if not model_store.enabled:
+            return Detoxify(self.MODEL_TYPE)
+        
+        def load():
+            detoxify = Detoxify(self.MODEL_TYPE)
+            return detoxify.model, detoxify.tokenizer, {'labels': detoxify.class_names}
+        
+        try:
+            model, tokenizer, meta = model_store.load(self.model_name, load)
+        except Exception as e:
+            logger.error(f"❌ Model store unavailable for toxicity, loading normally: {e}")
+            return Detoxify(self.MODEL_TYPE)
+        
+        # What Detoxify() builds, without reading its checkpoint into memory
+        detoxify = Detoxify.__new__(Detoxify)
+        detoxify.model, detoxify.tokenizer, detoxify.class_names = model, tokenizer, meta['labels']
+        detoxify.device = 'cpu'
+        return detoxify
+    
+    def _load_onnx(self):
+        """ONNX Runtime copy of the model, or None to fall back to PyTorch"""
+        from modules import onnx_backend
+        
+        if not onnx_backend.available():
+            logger.warning("onnx/onnxruntime not installed - using PyTorch for toxicity")
+            return None
+        
+        def load_torch():
+            from detoxify import Detoxify
+            detoxify = Detoxify(self.MODEL_TYPE)
+            return detoxify.model, detoxify.tokenizer, detoxify.class_names, 'sigmoid'
+        
+        try:
+            classifier = onnx_backend.load_classifier(self.model_name, load_torch)
+        except Exception as e:
+            logger.error(f"❌ ONNX toxicity model unavailable, using PyTorch: {e}")
+            return None
+        
+        # ONNX scores differ slightly, so they are cached separately
+        self.model_name += '-onnx-int8' if classifier.meta['quantized'] else '-onnx'
+        return onnx_backend.OnnxDetoxify(classifier)
+    
     def analyze_text(self, text):
         """
         Analyze text for various types of toxicity
@@ -35,37 +103,85 @@ class ToxicityDetector:
         if not self.model:
             return {"error": "Model not loaded"}
         
+        key = self.cache.make_key(self.model_name, text) if isinstance(text, str) else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return self._with_preview(cached, text)
+        
         try:
-            results = self.model.predict(text)
-            
-            # Calculate overall risk level
-            max_score = max(results.values())
-            risk_level = self._get_risk_level(max_score)
-            
-            return {
-                'scores': {
-                    'toxicity': float(results['toxicity']),
-                    'severe_toxicity': float(results['severe_toxicity']),
-                    'obscene': float(results['obscene']),
-                    'threat': float(results['threat']),
-                    'insult': float(results['insult']),
-                    'identity_attack': float(results['identity_attack'])
-                },
-                'max_score': float(max_score),
-                'risk_level': risk_level,
-                'is_toxic': bool(max_score > 0.5),
-                'text_analyzed': text[:100] + '...' if len(text) > 100 else text
-            }
+            with metrics.stage('inference', model='toxicity'):
+                results = self.model.predict(text)
+            analysis = self._build_result(text, results)
+            if key:
+                self.cache.set(key, analysis)
+            return analysis
         except Exception as e:
             logger.error(f"Error analyzing text: {e}")
             return {"error": str(e)}
     
-    def analyze_conversation(self, messages):
+    def analyze_batch(self, texts, batch_size=None):
+        """
+        Analyze a list of texts, running the model on micro-batches
+        
+        Each micro-batch is tokenized and passed through the model once.
+        
+        Args:
+            texts (list): List of text strings
+            batch_size (int): Messages per forward pass (defaults to self.batch_size)
+            
+        Returns:
+            list: One result dict per text, same format as analyze_text
+        """
+        if not self.model:
+            return [{"error": "Model not loaded"} for _ in texts]
+        
+        batch_size = max(1, int(batch_size or self.batch_size))
+        results = [None] * len(texts)
+        
+        # Cached texts are answered directly; identical misses share one inference
+        pending = {}
+        for i, text in enumerate(texts):
+            if not isinstance(text, str):
+                # Only strings can be tokenized together; anything else is analyzed alone
+                results[i] = self.analyze_text(text)
+                continue
+            key = self.cache.make_key(self.model_name, text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[i] = self._with_preview(cached, text)
+            else:
+                pending.setdefault(key, []).append(i)
+        
+        keys = list(pending)
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            batch = [texts[pending[key][0]] for key in chunk]
+            try:
+                with metrics.stage('inference', model='toxicity'):
+                    predictions = self.model.predict(batch)
+                for row, key in enumerate(chunk):
+                    scores = {label: values[row] for label, values in predictions.items()}
+                    analysis = self._build_result(batch[row], scores)
+                    self.cache.set(key, analysis)
+                    for i in pending[key]:
+                        results[i] = self._with_preview(analysis, texts[i])
+            except Exception as e:
+                # Fall back to per-message analysis so one bad input does not sink the batch
+                logger.error(f"Error analyzing batch, retrying messages individually: {e}")
+                for key in chunk:
+                    for i in pending[key]:
+                        results[i] = self.analyze_text(texts[i])
+        
+        return results
+    
+    def analyze_conversation(self, messages, include_results=True):
         """
         Analyze multiple messages in a conversation
         
         Args:
             messages (list): List of message strings
+            include_results (bool): Include every message's result
             
         Returns:
             dict: Aggregated toxicity analysis
@@ -73,33 +189,84 @@ class ToxicityDetector:
         if not messages:
             return {"error": "No messages provided"}
         
-        results = []
-        toxic_count = 0
+        return self.summarize_conversation(messages, self.analyze_batch(messages), include_results)
+    
+    @classmethod
+    def summarize_conversation(cls, messages, analyses, include_results=True):
+        """
+        Aggregate per-message results into the conversation summary
         
-        for msg in messages:
-            analysis = self.analyze_text(msg)
-            if not analysis.get('error'):
-                results.append(analysis)
-                if analysis.get('is_toxic'):
-                    toxic_count += 1
+        Args:
+            messages (list): The conversation's messages
+            analyses (list): One analyze_text result per message
+            include_results (bool): Include the valid per-message results
+            
+        Returns:
+            dict: Aggregated toxicity analysis
+        """
+        state = ConversationState()
+        for analysis in analyses:
+            state.add_toxicity(analysis)
+        state.message_count = len(messages)
         
-        if not results:
+        summary = cls.summary_from_state(state)
+        if summary is None:
             return {"error": "No valid analyses"}
+        if include_results:
+            summary['individual_results'] = [a for a in analyses if not a.get('error')]
+        return summary
+    
+    @classmethod
+    def summary_from_state(cls, state):
+        """
+        Conversation summary from running aggregates
+        
+        Args:
+            state (ConversationState): Aggregates of the conversation so far
+            
+        Returns:
+            dict: Aggregated toxicity analysis, or None before any valid result
+        """
+        if not state.toxicity_count:
+            return None
         
-        # Calculate average scores
-        avg_scores = {}
-        for key in results[0]['scores'].keys():
-            avg_scores[key] = sum(r['scores'][key] for r in results) / len(results)
+        avg_scores = state.toxicity_averages()
         
         return {
-            'message_count': len(messages),
-            'toxic_message_count': toxic_count,
-            'toxicity_percentage': (toxic_count / len(messages)) * 100,
+            'message_count': state.message_count,
+            'toxic_message_count': state.toxic_count,
+            'toxicity_percentage': (state.toxic_count / state.message_count) * 100,
             'average_scores': avg_scores,
-            'individual_results': results,
-            'overall_risk_level': self._get_risk_level(max(avg_scores.values()))
+            'overall_risk_level': cls._get_risk_level(max(avg_scores.values()))
         }
     
+    @classmethod
+    def _build_result(cls, text, results):
+        """Build the response dict from raw model scores for one text"""
+        # Calculate overall risk level
+        max_score = max(results.values())
+        risk_level = cls._get_risk_level(max_score)
+        
+        return {
+            'scores': {
+                'toxicity': float(results['toxicity']),
+                'severe_toxicity': float(results['severe_toxicity']),
+                'obscene': float(results['obscene']),
+                'threat': float(results['threat']),
+                'insult': float(results['insult']),
+                'identity_attack': float(results['identity_attack'])
+            },
+            'max_score': float(max_score),
+            'risk_level': risk_level,
+            'is_toxic': bool(max_score > 0.5),
+            'text_analyzed': text[:100] + '...' if len(text) > 100 else text
+        }
+    
+    @staticmethod
+    def _with_preview(analysis, text):
+        """Return a copy of a (possibly cached) result labelled with this text"""
+        return dict(analysis, text_analyzed=text[:100] + '...' if len(text) > 100 else text)
+    
     @staticmethod
     def _get_risk_level(score):
         """Determine risk level based on score"""
@@ -114,5 +281,5 @@ class ToxicityDetector:
 
 
 # Initialize global detector instance
-toxicity_detector = ToxicityDetector()
+toxicity_detector = lazy.register('toxicity', ToxicityDetector)
 
@@ -2,3 +2,9 @@
 SheSafe Routes Package
 """
 
+
+def is_truthy(value):
+    """Interpret query-string and JSON flags ("false" and "0" are false)"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
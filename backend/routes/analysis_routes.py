@@ -0,0 +1,40 @@
+"""
+API Routes for Combined Text Analysis
+"""
+from flask import Blueprint, request, jsonify
+from modules.inference_server import inference_server, InferenceUnavailable
+from modules.conversation_stream import conversation_streams
+from modules.multi_analyzer import multi_analyzer
+
+analysis_bp = Blueprint('analysis', __name__)
+
+
+@analysis_bp.route('/analyze', methods=['POST'])
+def analyze_text():
+    """Analyze text for toxicity, emotions and sentiment in one call"""
+    try:
+        data = request.get_json()
+        text = data.get('text', '')
+        
+        if not text:
+            return jsonify({'error': 'No text provided'}), 400
+        
+        result = inference_server.analyze('multi', text)
+        return jsonify(result)
+    
+    except InferenceUnavailable as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@analysis_bp.route('/analyze/check', methods=['GET'])
+def check_status():
+    """Check if combined analysis is working"""
+    return jsonify({
+        'status': 'active',
+        'analyzer': multi_analyzer.stats(),
+        'inference': inference_server.stats('multi'),
+        'streams': conversation_streams.stats()
+    })
@@ -2,7 +2,9 @@
 API Routes for Emotion Detection Module
 """
 from flask import Blueprint, request, jsonify
-from modules.emotion_detector import emotion_detector
+from modules.inference_server import inference_server, InferenceUnavailable
+from modules.result_cache import result_cache
+from routes import is_truthy
 
 emotion_bp = Blueprint('emotion', __name__)
 
@@ -17,9 +19,12 @@ def analyze_emotion():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        result = emotion_detector.analyze_emotion(text)
+        result = inference_server.analyze('emotion', text)
         return jsonify(result)
     
+    except InferenceUnavailable as e:
+        return jsonify({'error': str(e)}), e.status
+    
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -34,9 +39,14 @@ def analyze_conversation_emotions():
         if not messages:
             return jsonify({'error': 'No messages provided'}), 400
         
-        result = emotion_detector.analyze_conversation_emotions(messages)
+        # Per-message results make long conversations' responses large
+        include_results = is_truthy(data.get('include_results', False))
+        result = inference_server.analyze_conversation('emotion', messages, include_results=include_results)
         return jsonify(result)
     
+    except InferenceUnavailable as e:
+        return jsonify({'error': str(e)}), e.status
+    
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -46,7 +56,9 @@ def check_status():
     """Check if emotion detection is working"""
     return jsonify({
         'status': 'active',
-        'emotion_model_loaded': emotion_detector.emotion_classifier is not None,
-        'sentiment_model_loaded': emotion_detector.sentiment_analyzer is not None
+        'emotion_model_loaded': inference_server.is_loaded('emotion'),
+        'sentiment_model_loaded': inference_server.is_loaded('emotion'),
+        'inference': inference_server.stats('emotion'),
+        'cache': result_cache.stats()
     })
 
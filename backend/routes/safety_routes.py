@@ -1,31 +1,30 @@
 """
 API Routes for Safety Scoring Module
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from modules.safety_scorer import safety_scorer
+from modules.geocoding import ForwardGeocoder
+from routes import is_truthy
 from datetime import datetime
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+import json
+import os
 
 safety_bp = Blueprint('safety', __name__)
 
-# Initialize geocoder
-geocoder = Nominatim(user_agent="safecircle_app")
+# Upper bound on points accepted by one /score-batch request
+MAX_BATCH_POINTS = int(os.getenv('SAFETY_BATCH_MAX_POINTS', '10000'))
+
+MAX_TILE_ZOOM = 19
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonlines', 'application/jsonl')
+
+# Initialize geocoder (cached, with concurrent identical lookups coalesced)
+forward_geocoder = ForwardGeocoder()
 
 
 def geocode_place(place_name):
     """Convert place name to coordinates"""
-    try:
-        location = geocoder.geocode(place_name, timeout=10)
-        if location:
-            return {
-                'latitude': location.latitude,
-                'longitude': location.longitude,
-                'address': location.address
-            }
-        return None
-    except (GeocoderTimedOut, GeocoderServiceError) as e:
-        return None
+    return forward_geocoder.geocode(place_name)
 
 
 @safety_bp.route('/score', methods=['POST'])
@@ -66,6 +65,102 @@ def get_safety_score():
         return jsonify({'error': str(e)}), 500
 
 
+@safety_bp.route('/score-batch', methods=['POST'])
+def get_safety_scores_batch():
+    """Score many GPS points in one call (JSON array or NDJSON stream)"""
+    try:
+        ndjson = request.mimetype in NDJSON_MIMETYPES
+        reverse_geocode = is_truthy(request.args.get('reverse_geocode'))
+        
+        # NDJSON errors name the line (1-based) rather than the point index
+        line_numbers = None
+        if ndjson:
+            raw_points, line_numbers = [], []
+            for line_number, line in enumerate(request.stream, start=1):
+                if line.strip():
+                    try:
+                        raw_points.append(json.loads(line))
+                    except ValueError as e:
+                        reason = e.msg if isinstance(e, json.JSONDecodeError) else e
+                        return jsonify({'error': f'Invalid JSON on line {line_number}: {reason}'}), 400
+                    line_numbers.append(line_number)
+                    if len(raw_points) > MAX_BATCH_POINTS:
+                        break
+        else:
+            data = request.get_json()
+            if isinstance(data, dict):
+                raw_points = data.get('points', [])
+                reverse_geocode = reverse_geocode or is_truthy(data.get('reverse_geocode'))
+            else:
+                raw_points = data
+        
+        if not isinstance(raw_points, list) or not raw_points:
+            return jsonify({'error': 'No points provided'}), 400
+        if len(raw_points) > MAX_BATCH_POINTS:
+            return jsonify({'error': f'Too many points (max {MAX_BATCH_POINTS})'}), 413
+        
+        latitudes, longitudes, times = [], [], []
+        for index, raw_point in enumerate(raw_points):
+            try:
+                latitude, longitude, timestamp = _parse_point(raw_point)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                where = f'line {line_numbers[index]}' if line_numbers else f'index {index}'
+                return jsonify({'error': f'Invalid point at {where}: {e}'}), 400
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+            times.append(timestamp)
+        
+        results = safety_scorer.score_points(
+            latitudes, longitudes, times, include_location_name=reverse_geocode
+        )
+        
+        if ndjson:
+            body = ''.join(json.dumps(result) + '\n' for result in results)
+            return Response(body, mimetype='application/x-ndjson')
+        
+        return jsonify({'count': len(results), 'results': results})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def _parse_point(raw_point):
+    """
+    Parse one batch point
+    
+    Accepts {"latitude", "longitude", "timestamp"} objects (lat/lng also
+    accepted) or [latitude, longitude, timestamp] arrays. The timestamp is
+    optional and may be epoch seconds or an ISO 8601 string. Times are
+    scored in server-local time, like the default current time; ISO
+    strings with an offset (or Z) are converted to it, ones without are
+    taken as server-local already.
+    """
+    if isinstance(raw_point, dict):
+        latitude = raw_point['latitude'] if 'latitude' in raw_point else raw_point['lat']
+        longitude = raw_point['longitude'] if 'longitude' in raw_point else raw_point['lng']
+        timestamp = raw_point.get('timestamp')
+    elif isinstance(raw_point, (list, tuple)):
+        latitude, longitude = raw_point[0], raw_point[1]
+        timestamp = raw_point[2] if len(raw_point) > 2 else None
+    else:
+        raise TypeError('expected an object or an array')
+    
+    latitude, longitude = float(latitude), float(longitude)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('coordinates out of range')
+    
+    if timestamp is None:
+        current_time = None
+    elif isinstance(timestamp, (int, float)):
+        current_time = datetime.fromtimestamp(timestamp)
+    else:
+        current_time = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+        if current_time.tzinfo is not None:
+            current_time = current_time.astimezone().replace(tzinfo=None)
+    
+    return latitude, longitude, current_time
+
+
 @safety_bp.route('/geocode', methods=['POST'])
 def geocode_location():
     """Convert place name to coordinates"""
@@ -103,6 +198,9 @@ def find_safe_route():
         end_lat = data.get('end_latitude')
         end_lng = data.get('end_longitude')
         
+        alternatives = data.get('alternatives')
+        risk_weight = data.get('risk_weight')
+        
         if None in [start_lat, start_lng, end_lat, end_lng]:
             return jsonify({'error': 'All coordinates required'}), 400
         
@@ -110,7 +208,9 @@ def find_safe_route():
             float(start_lat),
             float(start_lng),
             float(end_lat),
-            float(end_lng)
+            float(end_lng),
+            alternatives=int(alternatives) if alternatives is not None else None,
+            risk_weight=float(risk_weight) if risk_weight is not None else None
         )
         return jsonify(result)
     
@@ -141,11 +241,29 @@ def generate_map():
         return jsonify({'error': str(e)}), 500
 
 
+@safety_bp.route('/tiles/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def get_risk_tile(z, x, y):
+    """Serve a precomputed risk heatmap tile"""
+    if safety_scorer.risk_raster is None:
+        return jsonify({'error': 'Risk raster not enabled (set RISK_RASTER_DIR)'}), 404
+    if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tile out of range'}), 400
+    
+    try:
+        png = safety_scorer.risk_raster.tile_png(z, x, y)
+        return Response(png, mimetype='image/png', headers={'Cache-Control': 'public, max-age=300'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @safety_bp.route('/check', methods=['GET'])
 def check_status():
     """Check if safety scoring is working"""
     return jsonify({
         'status': 'active',
-        'crime_hotspots_loaded': len(safety_scorer.crime_hotspots) > 0
+        'crime_hotspots_loaded': len(safety_scorer.crime_hotspots) > 0,
+        'reverse_geocoder': safety_scorer.reverse_geocoder.stats(),
+        'forward_geocoder': forward_geocoder.stats(),
+        'risk_raster': safety_scorer.risk_raster.stats() if safety_scorer.risk_raster else None
     })
 
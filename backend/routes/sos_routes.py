@@ -3,10 +3,16 @@ API Routes for SOS System Module
 """
 from flask import Blueprint, request, jsonify
 from modules.sos_system import sos_system
+from datetime import datetime
 
 sos_bp = Blueprint('sos', __name__)
 
 
+def _idempotency_key(data):
+    """Client-supplied key that makes a repeated request a no-op"""
+    return request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+
+
 @sos_bp.route('/alert', methods=['POST'])
 def send_sos_alert():
     """Send SOS alert to emergency contacts"""
@@ -26,7 +32,9 @@ def send_sos_alert():
             float(latitude),
             float(longitude),
             message,
-            contacts
+            contacts,
+            idempotency_key=_idempotency_key(data),
+            user_id=data.get('user_id')
         )
         return jsonify(result)
     
@@ -51,7 +59,9 @@ def share_location():
             user_name,
             float(latitude),
             float(longitude),
-            contacts
+            contacts,
+            idempotency_key=_idempotency_key(data),
+            user_id=data.get('user_id')
         )
         return jsonify(result)
     
@@ -68,7 +78,11 @@ def safety_checkin():
         status = data.get('status', 'Safe')
         contacts = data.get('contacts')
         
-        result = sos_system.send_safety_checkin(user_name, status, contacts)
+        result = sos_system.send_safety_checkin(
+            user_name, status, contacts,
+            idempotency_key=_idempotency_key(data),
+            user_id=data.get('user_id')
+        )
         return jsonify(result)
     
     except Exception as e:
@@ -77,11 +91,30 @@ def safety_checkin():
 
 @sos_bp.route('/history', methods=['GET'])
 def get_history():
-    """Get SOS history"""
+    """Get SOS history (newest first, paginated with next_cursor)"""
     try:
         limit = request.args.get('limit', 10, type=int)
-        history = sos_system.get_sos_history(limit)
-        return jsonify({'history': history})
+        since = request.args.get('since')
+        until = request.args.get('until')
+        bbox = request.args.get('bbox')
+        
+        try:
+            if bbox:
+                bbox = tuple(float(v) for v in bbox.split(','))
+                if len(bbox) != 4:
+                    raise ValueError("bbox must be min_lat,min_lng,max_lat,max_lng")
+            result = sos_system.get_sos_history(
+                limit,
+                cursor=request.args.get('cursor'),
+                since=datetime.fromisoformat(since) if since else None,
+                until=datetime.fromisoformat(until) if until else None,
+                bbox=bbox or None,
+                user_id=request.args.get('user_id')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify(result)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -90,7 +123,11 @@ def get_history():
 @sos_bp.route('/contacts', methods=['GET'])
 def get_contacts():
     """Get emergency contacts"""
-    return jsonify({'contacts': sos_system.emergency_contacts})
+    user_id = request.args.get('user_id')
+    return jsonify({
+        'contacts': list(sos_system.contact_store.numbers(user_id)),
+        'details': sos_system.contact_store.contacts(user_id)
+    })
 
 
 @sos_bp.route('/contacts', methods=['POST'])
@@ -104,7 +141,7 @@ def add_contact():
         if not phone:
             return jsonify({'error': 'Phone number required'}), 400
         
-        result = sos_system.add_emergency_contact(phone, name)
+        result = sos_system.add_emergency_contact(phone, name, data.get('user_id'))
         return jsonify(result)
     
     except Exception as e:
@@ -115,7 +152,7 @@ def add_contact():
 def remove_contact(phone_number):
     """Remove emergency contact"""
     try:
-        result = sos_system.remove_emergency_contact(phone_number)
+        result = sos_system.remove_emergency_contact(phone_number, request.args.get('user_id'))
         return jsonify(result)
     
     except Exception as e:
@@ -128,6 +165,8 @@ def check_status():
     return jsonify({
         'status': 'active',
         'twilio_configured': sos_system.client is not None,
-        'emergency_contacts_count': len(sos_system.emergency_contacts)
+        'emergency_contacts_count': len(sos_system.emergency_contacts),
+        'alert_queue': sos_system.alert_queue.stats(),
+        'history_events': sos_system.history_store.count()
     })
 
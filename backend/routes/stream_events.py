@@ -0,0 +1,109 @@
+"""
+Socket.IO Events for Streaming Conversation Analysis
+
+Client -> server:
+    conversation_start   {conversation_id?, resume_token?, user_id?}
+    conversation_message {conversation_id, text}
+    conversation_end     {conversation_id}
+
+conversation_start without a conversation_id starts a new conversation with
+an id chosen by the server; with one, it resumes that conversation. Only the
+connection that started a conversation, or a new connection presenting the
+resume_token it was given, can resume it, send to it or end it. Rooms are
+named "conversation:<id>", apart from the rooms Socket.IO gives each
+connection (named after its sid). Sessions are kept by the
+worker process that started them, so a client that reconnects to another
+worker cannot resume (see DEPLOYMENT.md).
+
+Server -> client (to everyone in the conversation's room):
+    conversation_started {conversation_id, resume_token, aggregates} (only to the client that sent conversation_start)
+    conversation_update  {conversation_id, message_index, message, aggregates, alerts}
+    conversation_alert   {conversation_id, message_index, alerts}
+    conversation_ended   {conversation_id, aggregates}
+    conversation_error   {error, conversation_id?}
+"""
+from flask import request
+from flask_socketio import emit, join_room, leave_room
+from modules.conversation_stream import conversation_streams
+from modules.inference_server import inference_server, InferenceUnavailable
+
+
+def conversation_room(conversation_id):
+    """Socket.IO room of a conversation, never the name of a connection's own room"""
+    return f"conversation:{conversation_id}"
+
+
+def register_stream_events(socketio):
+    """Attach the streaming conversation handlers to the app's SocketIO server"""
+
+    @socketio.on('conversation_start')
+    def conversation_start(data=None):
+        data = data or {}
+        session = conversation_streams.open(data.get('conversation_id'), data.get('user_id'), request.sid,
+                                            data.get('resume_token'))
+        if session is None:
+            emit('conversation_error', {'error': 'Cannot resume this conversation; start a new one',
+                                        'conversation_id': data.get('conversation_id')})
+            return
+        join_room(conversation_room(session.conversation_id))
+        emit('conversation_started', {
+            'conversation_id': session.conversation_id,
+            'resume_token': session.resume_token,
+            'aggregates': session.snapshot()
+        })
+
+    @socketio.on('conversation_message')
+    def conversation_message(data=None):
+        data = data or {}
+        conversation_id = data.get('conversation_id')
+        text = data.get('text', '')
+        session = conversation_streams.get(conversation_id, request.sid)
+        if session is None:
+            emit('conversation_error', {'error': 'Unknown or expired conversation', 'conversation_id': conversation_id})
+            return
+        if not text:
+            emit('conversation_error', {'error': 'No text provided', 'conversation_id': conversation_id})
+            return
+
+        # Numbered on arrival, before scoring, which may finish out of order
+        with session.lock:
+            number = session.receive()
+
+        room = conversation_room(conversation_id)
+
+        # Only the new message is scored; the session holds the rest
+        result = None
+        try:
+            result = inference_server.analyze('multi', text)
+        except InferenceUnavailable as e:
+            result = {'error': str(e)}
+        finally:
+            error = result.get('error') if result else 'Scoring failed'
+            with session.lock:
+                # Applied (and emitted) strictly in arrival order; a later message
+                # that finishes first waits here for the earlier ones
+                updates = session.complete(number, None if error else result)
+                if error:
+                    emit('conversation_error', {'error': error, 'conversation_id': conversation_id})
+                for update in updates:
+                    emit('conversation_update', dict(update, conversation_id=conversation_id), to=room)
+                    if update['alerts']:
+                        emit('conversation_alert', {
+                            'conversation_id': conversation_id,
+                            'message_index': update['message_index'],
+                            'alerts': update['alerts']
+                        }, to=room)
+
+    @socketio.on('conversation_end')
+    def conversation_end(data=None):
+        data = data or {}
+        conversation_id = data.get('conversation_id')
+        session = conversation_streams.close(conversation_id, request.sid)
+        if session is None:
+            emit('conversation_error', {'error': 'Unknown or expired conversation', 'conversation_id': conversation_id})
+            return
+        emit('conversation_ended', {
+            'conversation_id': conversation_id,
+            'aggregates': session.snapshot()
+        }, to=conversation_room(conversation_id))
+        leave_room(conversation_room(conversation_id))
@@ -2,7 +2,9 @@
 API Routes for Toxicity Detection Module
 """
 from flask import Blueprint, request, jsonify
-from modules.toxicity_detector import toxicity_detector
+from modules.inference_server import inference_server, InferenceUnavailable
+from modules.result_cache import result_cache
+from routes import is_truthy
 
 toxicity_bp = Blueprint('toxicity', __name__)
 
@@ -17,9 +19,12 @@ def analyze_text():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        result = toxicity_detector.analyze_text(text)
+        result = inference_server.analyze('toxicity', text)
         return jsonify(result)
     
+    except InferenceUnavailable as e:
+        return jsonify({'error': str(e)}), e.status
+    
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -34,9 +39,14 @@ def analyze_conversation():
         if not messages:
             return jsonify({'error': 'No messages provided'}), 400
         
-        result = toxicity_detector.analyze_conversation(messages)
+        # Per-message results make long conversations' responses large
+        include_results = is_truthy(data.get('include_results', True))
+        result = inference_server.analyze_conversation('toxicity', messages, include_results=include_results)
         return jsonify(result)
     
+    except InferenceUnavailable as e:
+        return jsonify({'error': str(e)}), e.status
+    
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -46,6 +56,8 @@ def check_status():
     """Check if toxicity detection is working"""
     return jsonify({
         'status': 'active',
-        'model_loaded': toxicity_detector.model is not None
+        'model_loaded': inference_server.is_loaded('toxicity'),
+        'inference': inference_server.stats('toxicity'),
+        'cache': result_cache.stats()
     })
 
@@ -0,0 +1,248 @@
+"""
+SafeCircle Production Server
+Prefork launcher for app.py. The parent imports the app, loads the hosted
+models once and freezes its heap (gc.freeze). It then forks N workers that
+share the weights copy-on-write, so extra workers add little memory. Each
+worker serves HTTP and Socket.IO with gevent from a listening socket that
+all workers share, and is pinned to its share of the CPUs. The parent
+supervises the workers and restarts any that die.
+
+Only the model weights, the frozen heap and the listening sockets are
+meant to be shared. Everything else is per process and is not opened in
+the parent (it is never used there). Each of these singletons keeps the
+pid that opened its resources and opens new ones on first use in a worker:
+- the database engine (modules/database.py)
+- the result cache and geocoding cache SQLite connections (result_cache.py)
+- the alert queue's connections and delivery threads (alert_queue.py); the
+  SOS system is not preloaded, so each worker builds its own
+- the inference batcher threads and executor (inference_server.py)
+- the reverse geocoder's lookup thread (geocoding.py)
+run_worker re-creates the rest itself: the gevent hub, the metrics registry
+and the warm-up thread.
+
+A Socket.IO session has to stay on one worker. By default, workers sharing
+a port accept only the WebSocket transport: one connection carries the
+whole session, so it cannot move between workers. With --sticky-port each
+worker also listens on a port of its own (sticky-port + index). A proxy
+that pins clients to a worker (e.g. nginx ip_hash) can then send
+/socket.io there, and long polling works too.
+
+Usage:
+    python serve.py --workers 4 --port 5000
+    python serve.py --workers 4 --port 5000 --sticky-port 5100
+"""
+from gevent import monkey
+
+# Must run before anything imports socket, threading or ssl. os stays
+# unpatched: the supervisor reaps workers with the plain waitpid.
+monkey.patch_all(os=False, signal=False)
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import gevent
+
+logger = logging.getLogger('serve')
+
+# Worker processes (0 = one per available CPU)
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', '0'))
+# torch threads per worker (0 splits the CPUs evenly)
+SERVE_THREADS = int(os.getenv('SERVE_THREADS', '0'))
+# Seconds a stopping worker gets to finish open requests
+SERVE_GRACEFUL_TIMEOUT = float(os.getenv('SERVE_GRACEFUL_TIMEOUT', '30'))
+
+# Loaded in the parent and shared with the workers. The SOS system has no
+# model and starts delivery threads, so each worker loads its own.
+PRELOADED = ('safety', 'toxicity', 'emotion')
+
+# A worker that dies sooner than this after starting is restarted with a delay
+MIN_WORKER_UPTIME = 10
+
+
+def configure_environment(workers, sticky):
+    """Settings the app's modules read at import time"""
+    os.environ['SOCKETIO_ASYNC_MODE'] = 'gevent'
+    # The parent loads everything before forking; a warm-up thread would not survive fork
+    os.environ['MODEL_WARMUP'] = '0'
+    if workers > 1 and not sticky:
+        os.environ.setdefault('SOCKETIO_TRANSPORTS', 'websocket')
+    # Runtime thread pools started in the parent do not survive fork either:
+    # ONNX sessions run single-threaded (one worker per core) and tokenizers sequentially
+    os.environ.setdefault('ONNX_THREADS', '1')
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+    if int(os.getenv('INFERENCE_PROCESSES', '0')) > 0:
+        raise SystemExit("serve.py workers already spread inference over the CPUs; set INFERENCE_PROCESSES=0")
+
+
+def listen(host, port, backlog=2048):
+    """Bind a listening socket in the parent; workers inherit it across fork"""
+    listener = socket.create_server((host, port), backlog=backlog)
+    listener.setblocking(False)
+    return listener
+
+
+def preload(hosted):
+    """Load the shared components, then freeze the heap so workers keep its pages shared"""
+    try:
+        import torch
+        # No intra-op pool in the parent: OpenMP threads do not survive fork
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+    from modules import lazy
+
+    started = time.monotonic()
+    names = [name for name in hosted if name in PRELOADED]
+    lazy.warm_up(names)
+    for name, state in lazy.status(names).items():
+        if state['state'] != 'ready':
+            logger.error(f"❌ {name} failed to load in the parent ({state.get('error')}); workers will retry")
+    logger.info(f"✅ Preloaded {', '.join(names) or 'nothing'} in {time.monotonic() - started:.1f}s")
+
+    # Objects that exist now are never scanned by the collector again, so the
+    # workers' collections do not write to (and un-share) their pages
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(index, workers, threads, listeners):
+    """
+    Body of a worker process: serve until SIGTERM/SIGINT
+
+    Per-process resources are re-created here or on first use (see the module docstring).
+    """
+    gevent.reinit()
+
+    from gevent import pywsgi
+    from app import app, HOSTED_MODULES
+    from modules import lazy
+    from modules.inference_server import pin_process
+    from modules.metrics import metrics
+
+    threads = pin_process(index, workers, threads)
+    # Whatever the parent recorded while loading belongs to no worker
+    metrics.reset()
+    # Components left out of the preload (or that failed there) load here
+    lazy.start_warmup(HOSTED_MODULES)
+
+    try:
+        from geventwebsocket.handler import WebSocketHandler
+        options = {'handler_class': WebSocketHandler}
+    except ImportError:
+        # Flask-SocketIO falls back to simple-websocket
+        options = {}
+    servers = [pywsgi.WSGIServer(listener, app, log=None, **options) for listener in listeners]
+
+    def stop():
+        for server in servers:
+            gevent.spawn(server.stop, SERVE_GRACEFUL_TIMEOUT)
+
+    # Replace the supervisor's handlers inherited across fork
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+        gevent.signal_handler(signum, stop)
+    logger.info(f"Worker {index} (pid {os.getpid()}) serving with {threads} torch threads")
+    gevent.joinall([gevent.spawn(server.serve_forever) for server in servers])
+
+
+class Supervisor:
+    """Forks the workers and keeps them running"""
+
+    def __init__(self, workers, threads, shared, sticky=None):
+        """
+        Args:
+            workers (int): Worker processes
+            threads (int): torch threads per worker (0 splits the CPUs)
+            shared (socket): Listening socket every worker accepts on
+            sticky (list): Optional per-worker listening sockets
+        """
+        self.workers = workers
+        self.threads = threads
+        self.shared = shared
+        self.sticky = sticky or []
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self, index):
+        listeners = [self.shared] + ([self.sticky[index]] if self.sticky else [])
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(index, self.workers, self.threads, listeners)
+            except BaseException as e:
+                logger.exception(f"❌ Worker {index} crashed: {e}")
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self.children[pid] = (index, time.monotonic())
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            index, started = self.children.pop(pid, (None, None))
+            if index is None or self.stopping:
+                continue
+            uptime = time.monotonic() - started
+            logger.error(f"❌ Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)} "
+                         f"after {uptime:.0f}s; restarting")
+            if uptime < MIN_WORKER_UPTIME:
+                time.sleep(1)
+            if not self.stopping:
+                self.spawn(index)
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')))
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS, help='worker processes (0 = one per CPU)')
+    parser.add_argument('--threads', type=int, default=SERVE_THREADS, help='torch threads per worker (0 = split)')
+    parser.add_argument('--sticky-port', type=int, help='also serve worker i on port STICKY_PORT + i')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s')
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    workers = args.workers or cpus or 1
+    configure_environment(workers, args.sticky_port is not None)
+
+    shared = listen(args.host, args.port)
+    sticky = [listen(args.host, args.sticky_port + i) for i in range(workers)] if args.sticky_port else None
+
+    from app import HOSTED_MODULES
+    preload(HOSTED_MODULES)
+
+    print("🚀 Starting SheSafe production server...")
+    print(f"📍 {workers} workers on http://{args.host}:{args.port}" +
+          (f" (worker ports {args.sticky_port}-{args.sticky_port + workers - 1})" if sticky else ''))
+    return Supervisor(workers, args.threads, shared, sticky).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
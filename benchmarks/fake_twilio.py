@@ -0,0 +1,108 @@
+"""
+Fake Twilio SMS API
+Local stand-in for api.twilio.com that accepts message sends, waits a
+configurable latency and answers like Twilio. Point the backend at it with
+TWILIO_API_BASE=http://127.0.0.1:<port> and any TWILIO_* credentials.
+
+Usage:
+    python benchmarks/fake_twilio.py --port 8765 --latency 0.25
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+
+
+class FakeTwilioServer(ThreadingHTTPServer):
+    """Threaded HTTP server recording every message it receives"""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, failure_rate=0.0):
+        """
+        Args:
+            address (tuple): (host, port); port 0 picks a free one
+            latency (float): Seconds to wait before answering each send
+            failure_rate (float): Fraction of sends answered with HTTP 500
+        """
+        super().__init__(address, FakeTwilioHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.messages = []
+        self.lock = threading.Lock()
+        self._sids = itertools.count(1)
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        """Serve in a background thread and return self"""
+        threading.Thread(target=self.serve_forever, name='fake-twilio', daemon=True).start()
+        return self
+
+    def next_sid(self):
+        return f"SM{next(self._sids):032x}"
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    """Handles POST /2010-04-01/Accounts/<sid>/Messages.json"""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+
+        if not self.path.endswith('/Messages.json'):
+            return self._reply(404, {'code': 20404, 'message': 'Not found'})
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.failure_rate and random.random() < self.server.failure_rate:
+            return self._reply(500, {'code': 20500, 'message': 'Internal error (simulated)'})
+
+        sid = self.server.next_sid()
+        with self.server.lock:
+            self.server.messages.append({'sid': sid, 'to': form.get('To'), 'body': form.get('Body'),
+                                         'received_at': time.time()})
+        self._reply(201, {
+            'sid': sid,
+            'status': 'queued',
+            'to': form.get('To'),
+            'from': form.get('From'),
+            'body': form.get('Body'),
+        })
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.25, help='seconds per send')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeTwilioServer((args.host, args.port), args.latency, args.failure_rate)
+    print(f"Fake Twilio listening on {server.base_url} (latency {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
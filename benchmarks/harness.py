@@ -0,0 +1,208 @@
+"""
+Benchmark Harness
+Timing, latency percentiles, peak RSS sampling and baseline comparison
+shared by the benchmark scripts in this directory.
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+# Default allowed slowdown before a case counts as a regression (0.2 = 20%)
+DEFAULT_TOLERANCE = 0.2
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # No procfs (macOS): fall back to the lifetime peak
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler:
+    """Context manager tracking the peak RSS while its block runs"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name='rss-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+
+def summarize(latencies, elapsed, calls=None):
+    """
+    Latency and throughput statistics
+
+    Args:
+        latencies (list): Seconds per measured call
+        elapsed (float): Wall-clock seconds of the measured run
+        calls (int): Operations completed (defaults to len(latencies))
+
+    Returns:
+        dict: throughput (ops/s), mean/p50/p95/p99/max in milliseconds
+    """
+    values = np.asarray(latencies, dtype=float) * 1000
+    calls = len(values) if calls is None else calls
+    if values.size == 0:
+        return {'iterations': 0, 'throughput': 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'iterations': calls,
+        'throughput': round(calls / elapsed, 2) if elapsed > 0 else 0.0,
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(values.max()), 3)
+    }
+
+
+def measure(fn, iterations=100, min_seconds=0.0, max_seconds=60.0, warmup=3):
+    """
+    Call fn(i) repeatedly and summarize its latency
+
+    Runs at least `iterations` calls (and at least `min_seconds`), stopping
+    early once `max_seconds` have passed.
+
+    Returns:
+        dict: summarize() fields plus peak_rss_mb
+    """
+    for i in range(warmup):
+        fn(i)
+
+    latencies = []
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        deadline = started + max_seconds
+        i = 0
+        while True:
+            call_started = time.perf_counter()
+            fn(i)
+            now = time.perf_counter()
+            latencies.append(now - call_started)
+            i += 1
+            if (i >= iterations and now - started >= min_seconds) or now >= deadline:
+                break
+        elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, elapsed)
+    result['peak_rss_mb'] = round(rss.peak / 2 ** 20, 1)
+    return result
+
+
+def case_key(result):
+    """Stable identity of a case across runs: name plus its parameters"""
+    params = ','.join(f"{k}={v}" for k, v in sorted(result.get('params', {}).items()))
+    return f"{result['name']}[{params}]" if params else result['name']
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare results with a baseline run
+
+    A case regresses when its p95 latency grows, or its throughput drops,
+    by more than `tolerance`.
+
+    Returns:
+        list: One dict per case found in both runs, with 'regressed' flags
+    """
+    previous = {case_key(r): r for r in baseline.get('results', [])}
+    comparisons = []
+    for result in results:
+        base = previous.get(case_key(result))
+        if base is None or result.get('status') != 'ok' or base.get('status') != 'ok':
+            continue
+        p95_change = _change(base.get('p95_ms'), result.get('p95_ms'))
+        throughput_change = _change(base.get('throughput'), result.get('throughput'))
+        comparisons.append({
+            'case': case_key(result),
+            'p95_ms': [base.get('p95_ms'), result.get('p95_ms')],
+            'throughput': [base.get('throughput'), result.get('throughput')],
+            'p95_change': p95_change,
+            'throughput_change': throughput_change,
+            'regressed': bool((p95_change is not None and p95_change > tolerance) or
+                              (throughput_change is not None and throughput_change < -tolerance))
+        })
+    return comparisons
+
+
+def _change(before, after):
+    if not before or after is None:
+        return None
+    return round((after - before) / before, 4)
+
+
+def environment():
+    """Machine and revision the results were measured on"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+
+
+def format_table(results):
+    """Plain-text table of results for the console"""
+    header = f"{'case':<58} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RSS MB':>8}"
+    lines = [header, '-' * len(header)]
+    for result in results:
+        if result.get('status') != 'ok':
+            lines.append(f"{case_key(result):<58} {result.get('status')}: {result.get('reason', '')}")
+            continue
+        lines.append(
+            f"{case_key(result):<58} {result['throughput']:>10.1f} {result['p50_ms']:>9.2f} "
+            f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['peak_rss_mb']:>8.1f}"
+        )
+    return '\n'.join(lines)
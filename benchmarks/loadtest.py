@@ -0,0 +1,478 @@
+"""
+SheSafe Load Test
+Open-loop load generator for one app.py node. Requests arrive as a Poisson
+process at each offered rate. Latency is measured from the scheduled
+arrival time, so a slow server cannot slow the generator down and hide its
+own queueing. The request mix follows the frontend's calls (default: 60%
+toxicity, 20% safety score, 10% route, 10% SOS). Socket.IO clients can also
+stream conversation messages over the socket path.
+
+The report gives a latency curve (throughput and p50/p95/p99 per offered
+rate) and the saturation point. The saturation point is the highest rate
+at which the node kept up, with p99 under the SLO and under 1% errors.
+
+The server can run fully offline:
+    - stub models (--models stub) or the real ones (--models real)
+    - a local fake Twilio server
+    - offline reverse geocoding
+    - optionally a synthetic street grid for routing
+
+Usage:
+    # Start a stub-model server and ramp the load in one command
+    python benchmarks/loadtest.py run --spawn --models stub --rates 20,50,100,200 --step-seconds 20
+
+    # Or run the server and the generator separately (e.g. on different cores or machines)
+    python benchmarks/loadtest.py serve --models stub --port 5055 --road-grid
+    python benchmarks/loadtest.py run --url http://127.0.0.1:5055 --rates 50,100 --socket-clients 20
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import logging
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'backend'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import harness
+
+DEFAULT_MIX = 'toxicity=60,safety=20,route=10,sos=10'
+
+# Requests a step may still finish after its last arrival
+STEP_GRACE_SECONDS = 30
+
+# Area requests are spread over (around New Delhi), as in run_benchmarks
+CENTER = (28.6139, 77.2090)
+AREA_DEG = 0.2
+
+MESSAGES = [
+    "Hey, are you coming to the meeting later?",
+    "I don't feel safe walking home alone tonight",
+    "You are so stupid, nobody wants you here",
+    "Thanks for checking in, I'm doing much better today!",
+    "He keeps following me and I'm scared",
+    "Can you share your location with me please",
+    "I can't stop crying, everything feels hopeless",
+    "Shut up or I will make you regret it",
+]
+
+
+def _point(rng):
+    return CENTER[0] + rng.uniform(-AREA_DEG, AREA_DEG) / 2, CENTER[1] + rng.uniform(-AREA_DEG, AREA_DEG) / 2
+
+
+def _text(rng, seq):
+    # A sequence number keeps texts distinct so the result cache does not answer
+    return f"{rng.choice(MESSAGES)} [{seq}]"
+
+
+def _route(rng, seq):
+    (start_lat, start_lng), (end_lat, end_lng) = _point(rng), _point(rng)
+    return {'start_latitude': start_lat, 'start_longitude': start_lng,
+            'end_latitude': end_lat, 'end_longitude': end_lng}
+
+
+def _score(rng, seq):
+    latitude, longitude = _point(rng)
+    return {'latitude': latitude, 'longitude': longitude}
+
+
+def _sos(rng, seq):
+    latitude, longitude = _point(rng)
+    return {'user_name': f"loadtest-{seq % 100}", 'latitude': latitude, 'longitude': longitude,
+            'message': 'Load test', 'idempotency_key': f"loadtest-{seq}-{time.time_ns()}"}
+
+
+# Request kinds: (path, JSON body builder), as sent by frontend/static/js/app.js
+REQUESTS = {
+    'toxicity': ('/api/toxicity/analyze', lambda rng, seq: {'text': _text(rng, seq)}),
+    'emotion': ('/api/emotion/analyze', lambda rng, seq: {'text': _text(rng, seq)}),
+    'analyze': ('/api/analyze', lambda rng, seq: {'text': _text(rng, seq)}),
+    'safety': ('/api/safety/score', _score),
+    'route': ('/api/safety/route', _route),
+    'sos': ('/api/sos/alert', _sos),
+}
+
+
+def parse_mix(mix):
+    """'toxicity=60,safety=20' -> [('toxicity', 60.0), ('safety', 20.0)]"""
+    weights = []
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in REQUESTS:
+            raise ValueError(f"Unknown request kind '{kind}' (choose from {', '.join(REQUESTS)})")
+        weights.append((kind, float(weight or 1)))
+    return weights
+
+
+class Recorder:
+    """Collects (kind, latency, ok) per step from many threads"""
+
+    def __init__(self):
+        self.records = []
+        self.lags = []
+        self.step = 0
+
+    def add(self, step, kind, latency, ok):
+        self.records.append((step, kind, latency, ok))
+
+    def for_step(self, step):
+        return [r for r in self.records if r[0] == step]
+
+
+class HttpClient:
+    """One requests session per generator thread"""
+
+    def __init__(self, base_url, timeout):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._requests = requests
+        self._local = threading.local()
+
+    def post(self, path, body):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.post(self.base_url + path, json=body, timeout=self.timeout)
+        # Errors are reported as JSON with 200 by some routes; count them as failures too
+        return response.status_code < 400 and 'error' not in response.json()
+
+
+class ConversationClient:
+    """Socket.IO client streaming one conversation"""
+
+    TAG = re.compile(r'\[(\d+)\]$')
+
+    def __init__(self, base_url, recorder):
+        import socketio
+
+        self.base_url = base_url
+        self.recorder = recorder
+        self.sio = socketio.Client(reconnection=False)
+        self.conversation_id = None
+        self.pending = {}
+        self._started = threading.Event()
+        self.sio.on('conversation_started', self._on_started)
+        self.sio.on('conversation_update', self._on_update)
+        self.sio.on('conversation_error', self._on_error)
+
+    def start(self, timeout=30):
+        self.sio.connect(self.base_url, wait_timeout=timeout)
+        self.sio.emit('conversation_start', {})
+        if not self._started.wait(timeout):
+            raise RuntimeError("conversation_start was not answered")
+
+    def send(self, step, seq, text, scheduled):
+        self.pending[seq] = (step, scheduled)
+        self.sio.emit('conversation_message', {'conversation_id': self.conversation_id, 'text': text})
+
+    def expire(self, step):
+        """Count messages of a step that never got an update as failures"""
+        for seq, (pending_step, _) in list(self.pending.items()):
+            if pending_step == step and self.pending.pop(seq, None):
+                self.recorder.add(step, 'socket', None, False)
+
+    def stop(self):
+        try:
+            self.sio.emit('conversation_end', {'conversation_id': self.conversation_id})
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+    def _on_started(self, data):
+        self.conversation_id = data['conversation_id']
+        self._started.set()
+
+    def _on_update(self, data):
+        match = self.TAG.search(data.get('message', {}).get('text_analyzed', ''))
+        pending = self.pending.pop(int(match.group(1)), None) if match else None
+        if pending:
+            step, scheduled = pending
+            self.recorder.add(step, 'socket', time.perf_counter() - scheduled, True)
+
+    def _on_error(self, data):
+        # Errors do not carry the message, so the oldest pending one is charged
+        if self.pending:
+            seq = min(self.pending)
+            step, _ = self.pending.pop(seq)
+            self.recorder.add(step, 'socket', None, False)
+
+
+def run_step(step, rate, duration, args, http, sockets, recorder, executor, rng):
+    """Offer `rate` requests/s for `duration` seconds (open loop); returns when they finish"""
+    kinds, weights = zip(*args.mix)
+    socket_rate = len(sockets) * args.socket_rate
+    total_rate = rate + socket_rate
+    futures = []
+    seq = (step + 1) * 10 ** 7
+
+    def request(kind, body, scheduled):
+        recorder.lags.append(time.perf_counter() - scheduled)
+        try:
+            ok = http.post(REQUESTS[kind][0], body)
+        except Exception:
+            ok = False
+        recorder.add(step, kind, time.perf_counter() - scheduled if ok else None, ok)
+
+    def message(client, seq, scheduled):
+        try:
+            client.send(step, seq, _text(rng, seq), scheduled)
+        except Exception:
+            recorder.add(step, 'socket', None, False)
+
+    started = time.perf_counter()
+    next_arrival = started
+    while True:
+        next_arrival += rng.expovariate(total_rate) if total_rate else duration
+        if next_arrival - started >= duration:
+            break
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        seq += 1
+        if sockets and rng.random() < socket_rate / total_rate:
+            futures.append(executor.submit(message, rng.choice(sockets), seq, next_arrival))
+        else:
+            kind = rng.choices(kinds, weights)[0]
+            futures.append(executor.submit(request, kind, REQUESTS[kind][1](rng, seq), next_arrival))
+
+    deadline = time.perf_counter() + STEP_GRACE_SECONDS
+    for future in futures:
+        future.exception(max(0.0, deadline - time.perf_counter()))
+    while sockets and any(p[0] == step for c in sockets for p in c.pending.values()):
+        if time.perf_counter() > deadline:
+            break
+        time.sleep(0.01)
+    for client in sockets:
+        client.expire(step)
+    return time.perf_counter() - started
+
+
+def step_report(step, rate, elapsed, recorder, args):
+    records = recorder.for_step(step)
+    ok = [r for r in records if r[3]]
+    report = {
+        'offered_rate': rate,
+        'socket_rate': args.socket_clients * args.socket_rate,
+        'requests': len(records),
+        'errors': len(records) - len(ok),
+        'error_rate': round((len(records) - len(ok)) / len(records), 4) if records else 0.0,
+        **harness.summarize([r[2] for r in ok], elapsed),
+        'by_kind': {}
+    }
+    report['achieved_rate'] = report.pop('throughput')
+    for kind in sorted({r[1] for r in records}):
+        kind_records = [r for r in records if r[1] == kind]
+        kind_ok = [r[2] for r in kind_records if r[3]]
+        report['by_kind'][kind] = {
+            'requests': len(kind_records),
+            'errors': len(kind_records) - len(kind_ok),
+            **harness.summarize(kind_ok, elapsed)
+        }
+    return report
+
+
+def saturation(steps, slo_ms):
+    """Highest offered rate the node kept up with (achieved >= 95%, p99 within SLO, <1% errors)"""
+    best = None
+    for step in steps:
+        total = step['offered_rate'] + step['socket_rate']
+        if (step['error_rate'] <= 0.01 and step['achieved_rate'] >= 0.95 * total
+                and step.get('p99_ms', float('inf')) <= slo_ms):
+            best = step
+    return {
+        'slo_p99_ms': slo_ms,
+        'sustained_rate': best['offered_rate'] + best['socket_rate'] if best else 0,
+        'max_achieved_rate': max((s['achieved_rate'] for s in steps), default=0)
+    }
+
+
+def spawn_server(args):
+    """Start `loadtest.py serve` on a free port and wait until it is ready"""
+    import requests
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    command = [sys.executable, os.path.abspath(__file__), 'serve', '--port', str(port),
+               '--models', args.models, '--service-ms', str(args.service_ms),
+               '--twilio-latency', str(args.twilio_latency), '--hotspots', str(args.hotspots)]
+    if args.road_grid:
+        command.append('--road-grid')
+    process = subprocess.Popen(command)
+    url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + args.ready_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            if requests.get(url + '/api/ready', timeout=2).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("server did not become ready in time")
+
+
+def run(args):
+    args.mix = parse_mix(args.mix)
+    rates = [float(r) for r in args.rates.split(',')]
+    process = None
+    if args.spawn:
+        process, args.url = spawn_server(args)
+
+    recorder = Recorder()
+    http = HttpClient(args.url, args.timeout)
+    sockets = []
+    rng = random.Random(args.seed)
+    steps = []
+    try:
+        for _ in range(args.socket_clients):
+            client = ConversationClient(args.url, recorder)
+            client.start()
+            sockets.append(client)
+
+        with ThreadPoolExecutor(max_workers=args.max_inflight, thread_name_prefix='load') as executor:
+            # Warm-up step, not reported
+            run_step(-1, min(rates), args.warmup_seconds, args, http, sockets, recorder, executor, rng)
+
+            for step, rate in enumerate(rates):
+                elapsed = run_step(step, rate, args.step_seconds, args, http, sockets, recorder, executor, rng)
+                report = step_report(step, rate, elapsed, recorder, args)
+                steps.append(report)
+                print(f"offered {rate + report['socket_rate']:>8.1f}/s  achieved {report['achieved_rate']:>8.1f}/s  "
+                      f"p50 {report.get('p50_ms', 0):>8.1f} ms  p95 {report.get('p95_ms', 0):>8.1f} ms  "
+                      f"p99 {report.get('p99_ms', 0):>8.1f} ms  errors {report['error_rate']:.1%}", flush=True)
+                if args.stop_when_saturated and (report['error_rate'] > 0.5 or
+                                                 report.get('p99_ms', 0) > 10 * args.slo_ms):
+                    print("Server saturated; stopping the ramp")
+                    break
+    finally:
+        for client in sockets:
+            client.stop()
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+
+    lag = harness.summarize(recorder.lags, 1.0)
+    summary = {
+        'environment': harness.environment(),
+        'settings': {
+            'url': args.url, 'models': args.models if args.spawn else None, 'mix': dict(args.mix),
+            'rates': rates, 'step_seconds': args.step_seconds, 'socket_clients': args.socket_clients,
+            'socket_rate': args.socket_rate, 'seed': args.seed
+        },
+        'steps': steps,
+        'saturation': saturation(steps, args.slo_ms),
+        # Send delay behind schedule; a large p99 means the generator, not the server, was the limit
+        'generator_lag_ms': {k: lag[k] for k in ('p50_ms', 'p99_ms', 'max_ms') if k in lag}
+    }
+    print(f"\nSustained {summary['saturation']['sustained_rate']:.1f} req/s within p99 {args.slo_ms:.0f} ms "
+          f"(max achieved {summary['saturation']['max_achieved_rate']:.1f} req/s)")
+    if args.output:
+        harness.write_json(args.output, summary)
+        print(f"Report written to {args.output}")
+    return 0
+
+
+def serve(args):
+    """Run app.py's server with offline dependencies (fake Twilio, offline geocoding, stub models)"""
+    from fake_twilio import FakeTwilioServer
+
+    workdir = tempfile.mkdtemp(prefix='shesafe-load-')
+    twilio = FakeTwilioServer(latency=args.twilio_latency).start()
+    os.environ.update({
+        'REVERSE_GEOCODE_MODE': 'offline',
+        'RESULT_CACHE_PATH': '',
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        'ALERT_QUEUE_PATH': os.path.join(workdir, 'alert_queue.db'),
+        'TWILIO_ACCOUNT_SID': 'ACloadtest',
+        'TWILIO_AUTH_TOKEN': 'loadtest',
+        'TWILIO_PHONE_NUMBER': '+15550000000',
+        'TWILIO_API_BASE': twilio.base_url,
+        'EMERGENCY_CONTACTS': ','.join(f"+1555{n:07d}" for n in range(1, args.contacts + 1)),
+    })
+    if args.models == 'stub':
+        # Stubs are installed in this process; worker processes would load the real models
+        os.environ['INFERENCE_PROCESSES'] = '0'
+        import modules.emotion_detector
+        import modules.toxicity_detector
+        import stub_models
+        stub_models.install(args.service_ms)
+
+    from app import app, socketio
+
+    if args.road_grid or args.hotspots:
+        from modules.routing import RouteEngine
+        from modules.safety_scorer import safety_scorer
+        import run_benchmarks
+
+        if args.road_grid:
+            safety_scorer.route_engine = RouteEngine(run_benchmarks.synthetic_road_grid())
+        hotspots = safety_scorer.crime_hotspots
+        if args.hotspots:
+            hotspots = run_benchmarks.synthetic_hotspots(random.Random(0), args.hotspots)
+        # Also computes the grid's edge risk
+        safety_scorer.load_crime_hotspots(hotspots)
+
+    print(f"Load test server on http://{args.host}:{args.port} ({args.models} models, fake Twilio at {twilio.base_url})",
+          flush=True)
+    # One access log line per request would cost more than some of the requests
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    socketio.run(app, host=args.host, port=args.port, allow_unsafe_werkzeug=True, log_output=False)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    server_options = argparse.ArgumentParser(add_help=False)
+    server_options.add_argument('--models', choices=('stub', 'real'), default='stub')
+    server_options.add_argument('--service-ms', type=float, default=8.0, help='stub forward pass time')
+    server_options.add_argument('--twilio-latency', type=float, default=0.05, help='fake Twilio seconds per send')
+    server_options.add_argument('--hotspots', type=int, default=0, help='synthetic crime hotspots (0 = sample data)')
+    server_options.add_argument('--road-grid', action='store_true', help='route over a synthetic street grid')
+
+    serve_parser = commands.add_parser('serve', parents=[server_options], help='run an offline server')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=5055)
+    serve_parser.add_argument('--contacts', type=int, default=3, help='emergency contacts each SOS goes to')
+
+    run_parser = commands.add_parser('run', parents=[server_options], help='generate load')
+    run_parser.add_argument('--url', default='http://127.0.0.1:5055')
+    run_parser.add_argument('--spawn', action='store_true', help='start an offline server for the run')
+    run_parser.add_argument('--rates', default='10,25,50,100', help='offered HTTP requests/s per step')
+    run_parser.add_argument('--step-seconds', type=float, default=20)
+    run_parser.add_argument('--warmup-seconds', type=float, default=5)
+    run_parser.add_argument('--mix', default=DEFAULT_MIX, help=f"request mix (kinds: {', '.join(REQUESTS)})")
+    run_parser.add_argument('--socket-clients', type=int, default=0, help='Socket.IO conversation clients')
+    run_parser.add_argument('--socket-rate', type=float, default=0.5, help='messages/s per socket client')
+    run_parser.add_argument('--slo-ms', type=float, default=500, help='p99 latency objective')
+    run_parser.add_argument('--timeout', type=float, default=30, help='HTTP timeout (s)')
+    run_parser.add_argument('--max-inflight', type=int, default=512, help='generator threads')
+    run_parser.add_argument('--ready-timeout', type=float, default=900, help='wait for a spawned server (s)')
+    run_parser.add_argument('--no-stop', dest='stop_when_saturated', action='store_false',
+                            help='keep ramping after the server saturates')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output', help='write the report JSON here')
+
+    args = parser.parse_args()
+    return serve(args) if args.command == 'serve' else run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
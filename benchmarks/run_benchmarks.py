@@ -0,0 +1,364 @@
+"""
+SheSafe Benchmark Suite
+Measures the hot path of every module and reports throughput, p50/p95/p99
+latency and peak RSS per case:
+
+    toxicity  analyze_text; analyze_conversation at several lengths
+    emotion   analyze_emotion
+    safety    get_location_safety_score and find_safe_route (synthetic road
+              grid) across hotspot counts and route lengths
+    sos       SOS fan-out to N contacts through a local fake Twilio server
+
+Result caches are disabled so every call reaches the models, and reverse
+geocoding is offline so nothing touches the network. Text models must be
+available locally (or downloadable); cases whose models fail to load are
+reported as skipped.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output benchmarks/results/latest.json
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json   # exit 1 on regression
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'backend'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import harness
+from fake_twilio import FakeTwilioServer
+
+SUITES = ('toxicity', 'emotion', 'safety', 'sos')
+
+CONVERSATION_LENGTHS = (5, 25, 100)
+HOTSPOT_COUNTS = (10, 1000, 20000)
+ROUTE_LENGTHS_KM = (1, 5, 15)
+SOS_FANOUT = (1, 5, 25)
+
+# Area the synthetic hotspots, points and road grid cover (around New Delhi)
+CENTER = (28.6139, 77.2090)
+AREA_DEG = 0.2
+GRID_SPACING_DEG = 0.001
+
+SAMPLE_TEXTS = [
+    "Hey, are you coming to the meeting later?",
+    "I don't feel safe walking home alone tonight",
+    "You are so stupid, nobody wants you here",
+    "Thanks for checking in, I'm doing much better today!",
+    "He keeps following me and I'm scared",
+    "Can you share your location with me please",
+    "I can't stop crying, everything feels hopeless",
+    "Shut up or I will make you regret it",
+    "Let's grab dinner this weekend, my treat",
+    "Why does nobody ever listen to me? I'm so angry",
+    "I love you all so much, see you soon",
+    "Stop messaging me. Leave me alone.",
+]
+
+
+def texts(rng, count):
+    """Distinct messages built from the samples (distinct so no cache can help)"""
+    return [f"{rng.choice(SAMPLE_TEXTS)} #{rng.randrange(10 ** 9)}" for _ in range(count)]
+
+
+def case(name, params, run):
+    """Run one case; failures are reported instead of aborting the suite"""
+    print(f"  {name} {params or ''}".rstrip(), flush=True)
+    try:
+        result = run()
+        result.update(name=name, params=params, status='ok')
+    except SkipCase as e:
+        result = {'name': name, 'params': params, 'status': 'skipped', 'reason': _first_line(e)}
+    except Exception as e:
+        result = {'name': name, 'params': params, 'status': 'error', 'reason': f"{type(e).__name__}: {_first_line(e)}"}
+    return result
+
+
+class SkipCase(Exception):
+    pass
+
+
+def _first_line(error):
+    return (str(error).strip().splitlines() or [''])[0]
+
+
+def bench_toxicity(args):
+    from modules.result_cache import ResultCache
+    from modules.toxicity_detector import ToxicityDetector
+
+    started = time.perf_counter()
+    detector = ToxicityDetector(cache=ResultCache(max_entries=0, path=''))
+    load_seconds = round(time.perf_counter() - started, 2)
+
+    def require_model():
+        if detector.model is None:
+            raise SkipCase(f"model not loaded ({detector.load_error})")
+
+    rng = random.Random(1)
+    pool = texts(rng, 1000)
+
+    def analyze_text():
+        require_model()
+        result = harness.measure(lambda i: detector.analyze_text(pool[i % len(pool)]), **args.budget)
+        result['load_seconds'] = load_seconds
+        return result
+
+    results = [case('toxicity.analyze_text', {'backend': detector.backend}, analyze_text)]
+
+    for length in CONVERSATION_LENGTHS:
+        conversations = [texts(rng, length) for _ in range(20)]
+
+        def analyze_conversation(conversations=conversations):
+            require_model()
+            return harness.measure(
+                lambda i: detector.analyze_conversation(conversations[i % len(conversations)], include_results=False),
+                **args.budget
+            )
+
+        results.append(case('toxicity.analyze_conversation',
+                            {'backend': detector.backend, 'messages': length}, analyze_conversation))
+    return results
+
+
+def bench_emotion(args):
+    from modules.emotion_detector import EmotionDetector
+    from modules.result_cache import ResultCache
+
+    started = time.perf_counter()
+    detector = EmotionDetector(cache=ResultCache(max_entries=0, path=''))
+    load_seconds = round(time.perf_counter() - started, 2)
+    pool = texts(random.Random(2), 1000)
+
+    def analyze_emotion():
+        if detector.emotion_classifier is None or detector.sentiment_analyzer is None:
+            raise SkipCase(f"models not loaded ({detector.load_error})")
+        result = harness.measure(lambda i: detector.analyze_emotion(pool[i % len(pool)]), **args.budget)
+        result['load_seconds'] = load_seconds
+        return result
+
+    return [case('emotion.analyze_emotion', {'backend': detector.backend}, analyze_emotion)]
+
+
+def synthetic_hotspots(rng, count):
+    severities = (('low', 0.3), ('medium', 0.5), ('high', 0.8))
+    hotspots = []
+    for _ in range(count):
+        severity, score = rng.choice(severities)
+        hotspots.append({
+            'lat': CENTER[0] + rng.uniform(-AREA_DEG, AREA_DEG) / 2,
+            'lng': CENTER[1] + rng.uniform(-AREA_DEG, AREA_DEG) / 2,
+            'severity': severity, 'severity_score': score, 'type': 'synthetic'
+        })
+    return hotspots
+
+
+def synthetic_road_grid():
+    """Square street grid over the benchmark area (~110 m blocks)"""
+    import numpy as np
+    from modules.routing import RoadGraph
+
+    side = int(AREA_DEG / GRID_SPACING_DEG) + 1
+    rows, cols = np.divmod(np.arange(side * side), side)
+    lats = CENTER[0] - AREA_DEG / 2 + rows * GRID_SPACING_DEG
+    lngs = CENTER[1] - AREA_DEG / 2 + cols * GRID_SPACING_DEG
+    nodes = np.arange(side * side).reshape(side, side)
+    sources = np.concatenate([nodes[:, :-1].ravel(), nodes[:-1, :].ravel()])
+    targets = np.concatenate([nodes[:, 1:].ravel(), nodes[1:, :].ravel()])
+    return RoadGraph(lats, lngs, sources, targets)
+
+
+def route_endpoints(rng, length_km):
+    """Start and end points length_km apart (straight line), both inside the area"""
+    import math
+
+    bearing = rng.uniform(0, 2 * math.pi)
+    half_lat = length_km / 2 / 111.0 * math.cos(bearing)
+    half_lng = length_km / 2 / (111.0 * math.cos(math.radians(CENTER[0]))) * math.sin(bearing)
+    # Midpoints are jittered only as far as keeps both ends on the grid
+    slack_lat = AREA_DEG / 2 - abs(half_lat)
+    slack_lng = AREA_DEG / 2 - abs(half_lng)
+    mid = (CENTER[0] + rng.uniform(-slack_lat, slack_lat) * 0.9, CENTER[1] + rng.uniform(-slack_lng, slack_lng) * 0.9)
+    return (mid[0] - half_lat, mid[1] - half_lng), (mid[0] + half_lat, mid[1] + half_lng)
+
+
+def bench_safety(args):
+    from datetime import datetime
+    from modules.routing import RouteEngine
+    from modules.safety_scorer import SafetyScorer
+
+    scorer = SafetyScorer()
+    engine = RouteEngine(synthetic_road_grid())
+    rng = random.Random(3)
+    points = [(CENTER[0] + rng.uniform(-AREA_DEG, AREA_DEG) / 2, CENTER[1] + rng.uniform(-AREA_DEG, AREA_DEG) / 2)
+              for _ in range(1000)]
+    # A fixed time keeps the time-of-day factor out of the comparison
+    evening = datetime(2024, 1, 1, 19, 0)
+
+    results = []
+    for count in HOTSPOT_COUNTS:
+        scorer.route_engine = engine
+        scorer.load_crime_hotspots(synthetic_hotspots(rng, count))
+
+        def score(count=count):
+            return harness.measure(
+                lambda i: scorer.get_location_safety_score(*points[i % len(points)], current_time=evening),
+                **args.budget
+            )
+
+        results.append(case('safety.get_location_safety_score', {'hotspots': count}, score))
+
+        for length in ROUTE_LENGTHS_KM:
+            endpoints = [route_endpoints(rng, length) for _ in range(20)]
+
+            def route(endpoints=endpoints):
+                def run(i):
+                    (start_lat, start_lng), (end_lat, end_lng) = endpoints[i % len(endpoints)]
+                    result = scorer.find_safe_route(start_lat, start_lng, end_lat, end_lng)
+                    if result.get('routing') != 'graph':
+                        raise RuntimeError(result.get('error', 'route fell back to a straight line'))
+                return harness.measure(run, **args.route_budget)
+
+            results.append(case('safety.find_safe_route', {'hotspots': count, 'route_km': length}, route))
+    return results
+
+
+def bench_sos(args):
+    from modules.sos_system import SOSSystem
+
+    server = args.twilio_server
+    sos = SOSSystem()
+    if sos.client is None:
+        raise RuntimeError("Twilio client was not configured for the fake server")
+
+    results = []
+    for fanout in SOS_FANOUT:
+        contacts = [f"+1555{n:07d}" for n in range(fanout)]
+
+        def send(i, contacts=contacts):
+            # Latency is until the fake server has received every message
+            expected = len(server.messages) + len(contacts)
+            response = sos.send_sos_alert('Benchmark', CENTER[0], CENTER[1], contacts=contacts,
+                                          idempotency_key=f"bench-{fanout}-{i}-{time.time_ns()}")
+            if response.get('status') != 'success':
+                raise RuntimeError(response.get('message'))
+            deadline = time.monotonic() + 30
+            while len(server.messages) < expected:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("messages were not delivered within 30s")
+                time.sleep(0.0005)
+
+        def fan_out(send=send):
+            return harness.measure(send, **args.sos_budget)
+
+        results.append(case('sos.send_sos_alert', {'contacts': fanout, 'twilio_latency_ms': int(args.twilio_latency * 1000)},
+                            fan_out))
+    sos.alert_queue.stop()
+    return results
+
+
+BENCHMARKS = {
+    'toxicity': bench_toxicity,
+    'emotion': bench_emotion,
+    'safety': bench_safety,
+    'sos': bench_sos,
+}
+
+
+def configure_environment(args, workdir):
+    """Keep the benchmark self-contained: temp databases, no caches, no network geocoding"""
+    args.twilio_server = FakeTwilioServer(latency=args.twilio_latency).start()
+    overrides = {
+        'RESULT_CACHE_SIZE': '0',
+        'RESULT_CACHE_PATH': '',
+        'REVERSE_GEOCODE_MODE': 'offline',
+        'GEOCODE_CACHE_PATH': '',
+        'CRIME_DATA_PATH': '',
+        'ROAD_GRAPH_PATH': '',
+        'RISK_RASTER_DIR': '',
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'ALERT_QUEUE_PATH': os.path.join(workdir, 'alert_queue.db'),
+        'TWILIO_ACCOUNT_SID': 'ACbenchmark',
+        'TWILIO_AUTH_TOKEN': 'benchmark',
+        'TWILIO_PHONE_NUMBER': '+15550000000',
+        'TWILIO_API_BASE': args.twilio_server.base_url,
+        'EMERGENCY_CONTACTS': '',
+    }
+    os.environ.update(overrides)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suites', default=','.join(SUITES), help=f"comma-separated subset of {','.join(SUITES)}")
+    parser.add_argument('--quick', action='store_true', help='fewer iterations (smoke run)')
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='compare with this results JSON; exit 1 on regression')
+    parser.add_argument('--save-baseline', help='write the results as a new baseline here')
+    parser.add_argument('--tolerance', type=float, default=harness.DEFAULT_TOLERANCE,
+                        help='allowed p95 increase / throughput drop before a regression (0.2 = 20%%)')
+    parser.add_argument('--twilio-latency', type=float, default=0.05, help='fake Twilio seconds per send')
+    args = parser.parse_args()
+
+    suites = [s.strip() for s in args.suites.split(',') if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    if args.quick:
+        args.budget = {'iterations': 20, 'max_seconds': 10, 'warmup': 2}
+        args.route_budget = {'iterations': 5, 'max_seconds': 10, 'warmup': 1}
+        args.sos_budget = {'iterations': 5, 'max_seconds': 10, 'warmup': 1}
+    else:
+        args.budget = {'iterations': 200, 'min_seconds': 2, 'max_seconds': 60, 'warmup': 5}
+        args.route_budget = {'iterations': 30, 'max_seconds': 60, 'warmup': 2}
+        args.sos_budget = {'iterations': 30, 'max_seconds': 60, 'warmup': 2}
+
+    workdir = tempfile.mkdtemp(prefix='shesafe-bench-')
+    configure_environment(args, workdir)
+
+    results = []
+    for suite in suites:
+        print(f"[{suite}]", flush=True)
+        results.extend(BENCHMARKS[suite](args))
+
+    report = {
+        'environment': harness.environment(),
+        'settings': {'quick': args.quick, 'suites': suites, 'twilio_latency': args.twilio_latency},
+        'results': results
+    }
+
+    print()
+    print(harness.format_table(results))
+
+    if args.output:
+        harness.write_json(args.output, report)
+        print(f"\nResults written to {args.output}")
+    if args.save_baseline:
+        harness.write_json(args.save_baseline, report)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        comparisons = harness.compare(results, harness.load_json(args.baseline), args.tolerance)
+        regressions = [c for c in comparisons if c['regressed']]
+        print(f"\nCompared {len(comparisons)} cases with {args.baseline} (tolerance {args.tolerance:.0%})")
+        for c in comparisons:
+            flag = 'REGRESSION' if c['regressed'] else 'ok'
+            p95 = f"{c['p95_change']:+.1%}" if c['p95_change'] is not None else 'n/a'
+            throughput = f"{c['throughput_change']:+.1%}" if c['throughput_change'] is not None else 'n/a'
+            print(f"  {flag:<10} {c['case']:<58} p95 {p95:>8}  throughput {throughput:>8}")
+        if args.output:
+            report['comparison'] = {'baseline': args.baseline, 'tolerance': args.tolerance, 'cases': comparisons}
+            harness.write_json(args.output, report)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s)")
+            return 1
+        print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
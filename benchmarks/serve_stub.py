@@ -0,0 +1,49 @@
+"""
+Stub-Model Production Server
+Runs serve.py (prefork workers under gevent) with the stub text models from
+stub_models.py and offline geocoding. Smoke and load tests can then cover
+the production server path without model downloads. SMS is simulated (no
+Twilio credentials).
+
+Usage:
+    python benchmarks/serve_stub.py --workers 2 --port 5056 --service-ms 8
+    python benchmarks/loadtest.py run --url http://127.0.0.1:5056 --mix analyze=100
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'backend'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+# Patches socket and threading; must come before the app's modules are imported
+import serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--service-ms', type=float, default=8.0, help='stub forward pass time')
+    args, serve_args = parser.parse_known_args()
+
+    workdir = tempfile.mkdtemp(prefix='shesafe-serve-')
+    os.environ.update({
+        'REVERSE_GEOCODE_MODE': 'offline',
+        'RESULT_CACHE_PATH': '',
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'serve.db')}",
+        'ALERT_QUEUE_PATH': os.path.join(workdir, 'alert_queue.db'),
+        # Read when modules.lazy is imported below, before serve.main() would set it
+        'MODEL_WARMUP': '0',
+    })
+    import modules.emotion_detector  # noqa: F401
+    import modules.toxicity_detector  # noqa: F401
+    import stub_models
+    stub_models.install(args.service_ms)
+
+    sys.argv = [serve.__file__] + serve_args
+    return serve.main()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Stub Text Models
+Offline stand-ins for the toxicity, emotion and sentiment models. They go
+through the real detector, cache, batching and combined-analyzer code. A
+real WordPiece tokenizer runs, and each forward pass sleeps for a
+configurable service time and returns deterministic pseudo-scores. Load
+tests can therefore exercise the whole server without model downloads.
+"""
+import functools
+import hashlib
+import time
+
+import numpy as np
+
+from modules import lazy, onnx_backend
+from modules.emotion_detector import EmotionDetector
+from modules.toxicity_detector import ToxicityDetector
+
+TOXICITY_LABELS = ['toxicity', 'severe_toxicity', 'obscene', 'threat', 'insult', 'identity_attack']
+EMOTION_LABELS = ['anger', 'disgust', 'fear', 'joy', 'neutral', 'sadness', 'surprise']
+SENTIMENT_LABELS = ['NEGATIVE', 'POSITIVE']
+
+VOCABULARY_SIZE = 2000
+MAX_LENGTH = 128
+
+# Training text for the stub WordPiece vocabulary
+CORPUS = [
+    "hey are you coming to the meeting later", "i don't feel safe walking home alone tonight",
+    "you are so stupid nobody wants you here", "thanks for checking in i'm doing much better today",
+    "he keeps following me and i'm scared", "can you share your location with me please",
+    "i can't stop crying everything feels hopeless", "shut up or i will make you regret it",
+    "let's grab dinner this weekend my treat", "why does nobody ever listen to me i'm so angry",
+    "i love you all so much see you soon", "stop messaging me leave me alone",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def _stub_tokenizer():
+    """Small WordPiece tokenizer trained in memory (real tokenization cost, no download)"""
+    from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, trainers
+
+    tokenizer = Tokenizer(models.WordPiece(unk_token='[UNK]'))
+    tokenizer.normalizer = normalizers.BertNormalizer(lowercase=True)
+    tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    tokenizer.train_from_iterator(CORPUS * 20, trainers.WordPieceTrainer(
+        vocab_size=VOCABULARY_SIZE, special_tokens=['[PAD]', '[UNK]'], show_progress=False
+    ))
+    tokenizer.enable_truncation(MAX_LENGTH)
+    tokenizer.enable_padding(pad_id=0, pad_token='[PAD]')
+    return tokenizer
+
+
+class StubClassifier(onnx_backend.OnnxClassifier):
+    """OnnxClassifier look-alike whose forward pass just waits"""
+
+    def __init__(self, name, labels, activation, service_ms=8.0, per_text_ms=0.5):
+        """
+        Args:
+            name (str): Model name (metrics label)
+            labels (list): Class names
+            activation (str): 'sigmoid' or 'softmax'
+            service_ms (float): Fixed time per forward pass
+            per_text_ms (float): Extra time per text in the batch
+        """
+        self.name = name
+        self.labels = list(labels)
+        self.activation = activation
+        self.service_ms = service_ms
+        self.per_text_ms = per_text_ms
+        # Shared, so every stub head has the same fingerprint and one encoding per text
+        self.tokenizer = _stub_tokenizer()
+        self.meta = {'max_length': MAX_LENGTH, 'pad_id': 0, 'pad_token': '[PAD]', 'quantized': False}
+        self._seed = int(hashlib.sha1(name.encode()).hexdigest()[:8], 16)
+
+    def run(self, input_ids, attention_mask):
+        time.sleep((self.service_ms + self.per_text_ms * len(input_ids)) / 1000)
+        # Same input, same scores: derived from the token ids
+        rows = (input_ids * attention_mask).sum(axis=1, keepdims=True) + attention_mask.sum(axis=1, keepdims=True)
+        columns = np.arange(len(self.labels)) + 1
+        logits = np.sin(rows * columns * 0.7 + self._seed) * 3 - 1.5
+        return onnx_backend.activate(logits.astype(np.float32), self.activation)
+
+
+class StubToxicityDetector(ToxicityDetector):
+    """ToxicityDetector backed by a StubClassifier"""
+
+    def __init__(self, service_ms=8.0, batch_size=None, cache=None):
+        self.service_ms = service_ms
+        # The 'onnx' backend builds its model through _load_onnx, replaced below
+        super().__init__(batch_size=batch_size, cache=cache, backend='onnx')
+        self.backend = 'stub'
+
+    def _load_onnx(self):
+        self.model_name = 'stub-toxicity'
+        return onnx_backend.OnnxDetoxify(StubClassifier('toxicity', TOXICITY_LABELS, 'sigmoid', self.service_ms))
+
+
+class StubEmotionDetector(EmotionDetector):
+    """EmotionDetector backed by StubClassifiers"""
+
+    def __init__(self, service_ms=8.0, batch_size=None, cache=None):
+        self.service_ms = service_ms
+        super().__init__(batch_size=batch_size, cache=cache, backend='onnx')
+        self.backend = 'stub'
+
+    def _load_onnx(self):
+        self.model_name = 'stub-emotion'
+        return (
+            onnx_backend.OnnxPipeline(StubClassifier('emotion', EMOTION_LABELS, 'softmax', self.service_ms),
+                                      all_scores=True),
+            onnx_backend.OnnxPipeline(StubClassifier('sentiment', SENTIMENT_LABELS, 'softmax', self.service_ms))
+        )
+
+
+def install(service_ms=8.0):
+    """Make the app's toxicity and emotion components load stub models"""
+    lazy.override('toxicity', lambda: StubToxicityDetector(service_ms))
+    lazy.override('emotion', lambda: StubEmotionDetector(service_ms))
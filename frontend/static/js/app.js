@@ -99,6 +99,37 @@ function hideLoading() {
     document.getElementById('loadingOverlay').style.display = 'none';
 }
 
+// Combined text analysis: one request returns toxicity, emotions and sentiment,
+// so analyzing the same text in both sections costs a single round trip
+const ANALYSIS_CACHE_SIZE = 50;
+const analysisCache = new Map();
+
+async function analyzeMessage(text) {
+    if (analysisCache.has(text)) {
+        return analysisCache.get(text);
+    }
+    
+    const response = await fetch(`${API_BASE}/analyze`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ text })
+    });
+    
+    // Servers not hosting both text models have no combined endpoint
+    if (response.status === 404) {
+        return null;
+    }
+    
+    const data = await response.json();
+    if (!data.error && !data.toxicity.error && !data.emotion.error) {
+        if (analysisCache.size >= ANALYSIS_CACHE_SIZE) {
+            analysisCache.delete(analysisCache.keys().next().value);
+        }
+        analysisCache.set(text, data);
+    }
+    return data;
+}
+
 // Toxicity Detection
 async function analyzeToxicity() {
     const text = document.getElementById('toxicityText').value.trim();
@@ -111,6 +142,12 @@ async function analyzeToxicity() {
     showLoading();
     
     try {
+        const combined = await analyzeMessage(text);
+        if (combined) {
+            displayToxicityResults(combined.error ? combined : combined.toxicity);
+            return;
+        }
+        
         const response = await fetch(`${API_BASE}/toxicity/analyze`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
@@ -245,6 +282,12 @@ async function analyzeEmotion() {
     showLoading();
     
     try {
+        const combined = await analyzeMessage(text);
+        if (combined) {
+            displayEmotionResults(combined.error ? combined : combined.emotion);
+            return;
+        }
+        
         const response = await fetch(`${API_BASE}/emotion/analyze`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
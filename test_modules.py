@@ -4,9 +4,14 @@ Run this to verify all modules are working
 """
 import sys
 import os
+import socket
+import subprocess
+import tempfile
+import time
 
 # Add backend to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
 
 def test_toxicity_module():
     """Test toxicity detection module"""
@@ -82,6 +87,437 @@ def test_sos_module():
         print(f"❌ Error: {e}")
         return False
 
+def test_result_cache():
+    """Test shared result cache"""
+    print("\n🧪 Testing Result Cache...")
+    try:
+        from modules.result_cache import ResultCache
+        
+        cache = ResultCache(max_entries=2, ttl=60, path='')
+        key = cache.make_key('test-model', 'Hello   world')
+        cache.set(key, {'score': 0.5})
+        cache.set(cache.make_key('test-model', 'second'), {'score': 0.1})
+        cache.set(cache.make_key('test-model', 'third'), {'score': 0.2})
+        
+        same_key = key == cache.make_key('test-model', ' Hello world ')
+        stats = cache.stats()
+        
+        if same_key and cache.get(key) is None and stats['evictions'] == 1:
+            print("✅ Result cache working!")
+            print(f"   Cache size: {stats['size']}/{stats['max_entries']}")
+            return True
+        else:
+            print("❌ Unexpected cache behaviour")
+            return False
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_alert_queue():
+    """Test the durable alert queue: idempotency, lanes, leases, backoff, giving up"""
+    print("\n🧪 Testing Alert Queue...")
+    from modules import alert_queue
+    from modules.alert_queue import AlertQueue, LANE_SOS, LANE_CHECKIN
+
+    outcomes = []
+    finished = {}
+    queue = AlertQueue(lambda to, body: outcomes.pop(0), path=os.path.join(tempfile.mkdtemp(), 'queue.db'),
+                       workers=0, sos_workers=0, max_attempts=3)
+    queue.add_listener(lambda message_id, result: finished.__setitem__(message_id, result))
+
+    def row(message_id):
+        with queue._connection() as conn:
+            return conn.execute("SELECT status, attempts, next_attempt_at, lease_expires_at FROM outbox "
+                                "WHERE id = ?", (message_id,)).fetchone()
+
+    def make_ready(message_id):
+        with queue._connection() as conn:
+            conn.execute("UPDATE outbox SET next_attempt_at = 0 WHERE id = ?", (message_id,))
+
+    # Idempotency: the same alert enqueued twice is one message per recipient
+    checkin = queue.enqueue(['+15550000001'], 'check-in', LANE_CHECKIN, 'checkin-1')
+    again = queue.enqueue(['+15550000001'], 'check-in', LANE_CHECKIN, 'checkin-1')
+    assert again[0]['message_id'] == checkin[0]['message_id'] and again[0].get('duplicate'), again
+    assert 'duplicate' not in checkin[0], checkin
+
+    # SOS lane first, even when queued later; SOS-only workers never take other lanes
+    sos = queue.enqueue(['+15550000002', '+15550000003'], 'SOS', LANE_SOS, 'sos-1')
+    sos_ids = [entry['message_id'] for entry in sos]
+    first, second = queue._claim(LANE_CHECKIN), queue._claim(LANE_CHECKIN)
+    assert [first[0], second[0]] == sos_ids, (first, second)
+    assert queue._claim(LANE_SOS) is None
+
+    # Lease: a claimed message is not handed out again until its lease expires
+    checkin_claim = queue._claim(LANE_CHECKIN)
+    assert checkin_claim[0] == checkin[0]['message_id']
+    assert queue._claim(LANE_CHECKIN) is None
+    assert row(first[0])[3] > time.time() + alert_queue.SEND_LEASE_SECONDS - 5
+    with queue._connection() as conn:
+        conn.execute("UPDATE outbox SET lease_expires_at = ? WHERE id = ?", (time.time() - 1, first[0]))
+    assert queue._claim(LANE_SOS)[0] == first[0]
+
+    # Retry backoff: BASE * 2**(attempt - 1) seconds, jittered down to half
+    outcomes.append({'status': 'failed', 'error': 'timeout', 'retryable': True})
+    before = time.time()
+    queue._deliver(*first)
+    status, attempts, next_attempt_at, lease = row(first[0])
+    assert (status, attempts, lease) == ('pending', 1, None), row(first[0])
+    assert before + 0.5 * alert_queue.RETRY_BASE_DELAY <= next_attempt_at <= time.time() + alert_queue.RETRY_BASE_DELAY
+    assert queue._claim(LANE_SOS) is None
+
+    make_ready(first[0])
+    outcomes.append({'status': 'failed', 'error': 'timeout', 'retryable': True})
+    before = time.time()
+    queue._deliver(*queue._claim(LANE_SOS))
+    status, attempts, next_attempt_at, _ = row(first[0])
+    assert (status, attempts) == ('pending', 2)
+    assert first[0] not in finished
+    assert before + alert_queue.RETRY_BASE_DELAY <= next_attempt_at <= time.time() + 2 * alert_queue.RETRY_BASE_DELAY
+
+    # Gives up after max_attempts, and reports the final state once
+    make_ready(first[0])
+    outcomes.append({'status': 'failed', 'error': 'timeout', 'retryable': True})
+    queue._deliver(*queue._claim(LANE_SOS))
+    assert row(first[0])[:2] == ('failed', 3)
+    assert finished[first[0]]['status'] == 'failed' and finished[first[0]]['attempts'] == 3
+
+    # Non-retryable failures are final at once; successes are final too
+    outcomes.append({'status': 'failed', 'error': 'invalid number', 'retryable': False})
+    queue._deliver(*second)
+    assert row(second[0])[:2] == ('failed', 1)
+    outcomes.append({'status': 'sent', 'message_sid': 'SM1'})
+    queue._deliver(*checkin_claim)
+    assert queue.get_status([checkin[0]['message_id']])[checkin[0]['message_id']]['message_sid'] == 'SM1'
+    assert not outcomes
+
+    # Worker threads drain the queue
+    sent = []
+    workers = AlertQueue(lambda to, body: sent.append(to) or {'status': 'sent'},
+                         path=os.path.join(tempfile.mkdtemp(), 'queue.db'), workers=1, sos_workers=1)
+    try:
+        workers.enqueue(['+15550000004'], 'check-in', LANE_CHECKIN, 'checkin-2')
+        workers.enqueue(['+15550000005'], 'SOS', LANE_SOS, 'sos-2')
+        assert workers.wait_idle(10)
+        assert sorted(sent) == ['+15550000004', '+15550000005'], sent
+    finally:
+        workers.stop()
+
+    print("✅ Alert queue working!")
+    return True
+
+def test_conversation_state_merge():
+    """Test that merging the states of two parts equals the state of the whole"""
+    print("\n🧪 Testing Conversation State Merge...")
+    import math
+    import random
+    from modules.conversation_state import ConversationState
+
+    rng = random.Random(7)
+    emotion_names = ['joy', 'sadness', 'fear', 'anger', 'surprise', 'neutral']
+
+    def message(i):
+        if i % 11 == 5:
+            return {'error': 'model unavailable'}, {'error': 'model unavailable'}
+        scores = {label: rng.random() for label in ('toxicity', 'insult', 'threat')}
+        emotions = {name: rng.random() for name in emotion_names}
+        dominant = max(emotions, key=emotions.get)
+        distress = rng.random()
+        toxicity = {'scores': scores, 'is_toxic': max(scores.values()) > 0.7}
+        emotion = {
+            'emotions': emotions,
+            'dominant_emotion': {'name': dominant, 'score': emotions[dominant]},
+            'mental_health_risk': {'level': rng.choice(['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']),
+                                   'net_score': rng.uniform(-1, 1), 'distress_score': distress}
+        }
+        return toxicity, emotion
+
+    messages = [message(i) for i in range(40)]
+
+    def state_of(part):
+        state = ConversationState()
+        for toxicity, emotion in part:
+            state.add(toxicity, emotion)
+        return state
+
+    def fields(state):
+        values = {name: getattr(state, name) for name in ConversationState.__slots__
+                  if name not in ('distress', 'distress_next')}
+        values['recent_distress'] = state.recent_distress()
+        values['patterns'] = state.patterns()
+        return values
+
+    def same(a, b):
+        if isinstance(a, (list, tuple)) or hasattr(a, 'typecode'):
+            return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+        if isinstance(a, float):
+            return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+        return a == b
+
+    whole = fields(state_of(messages))
+    # Every split point, including empty parts and parts shorter than the distress window
+    for split in range(len(messages) + 1):
+        first, later = state_of(messages[:split]), state_of(messages[split:])
+        merged = fields(first.merge(later))
+        for name, value in whole.items():
+            assert same(value, merged[name]), (split, name, value, merged[name])
+        # merge() leaves both inputs as they were
+        assert fields(first) == fields(state_of(messages[:split]))
+
+    # Three parts merge the same either way round
+    a, b, c = state_of(messages[:3]), state_of(messages[3:4]), state_of(messages[4:])
+    left, right = fields(a.merge(b).merge(c)), fields(a.merge(b.merge(c)))
+    assert all(same(left[name], right[name]) for name in left), (left, right)
+
+    print("✅ Conversation state merge working!")
+    return True
+
+def test_geo_kernels():
+    """Test the vectorized distance and risk kernels against geopy"""
+    print("\n🧪 Testing Geo Kernels against geopy...")
+    import numpy as np
+    from geopy.distance import geodesic, great_circle
+    from modules import geo_kernels
+
+    rng = np.random.default_rng(5)
+    # Random points worldwide, plus coincident, equatorial, polar and nearly antipodal pairs
+    lats1 = np.concatenate([rng.uniform(-85, 85, 40), [28.6139, 0.0, 0.0, 89.9, 10.0]])
+    lngs1 = np.concatenate([rng.uniform(-180, 180, 40), [77.2090, 0.0, 10.0, 0.0, 20.0]])
+    lats2 = np.concatenate([rng.uniform(-85, 85, 30), [28.6139, 0.0, 0.5, -89.9, -10.0, 28.7041]])
+    lngs2 = np.concatenate([rng.uniform(-180, 180, 30), [77.2090, 40.0, 179.7, 90.0, -160.0, 77.1025]])
+
+    expected = np.array([[geodesic((a, b), (c, d)).kilometers for c, d in zip(lats2, lngs2)]
+                         for a, b in zip(lats1, lngs1)])
+    spherical = np.array([[great_circle((a, b), (c, d)).kilometers for c, d in zip(lats2, lngs2)]
+                          for a, b in zip(lats1, lngs1)])
+
+    # Ellipsoidal mode matches geodesic to the millimetre, including the geopy fallback pairs
+    ellipsoidal = geo_kernels.distance_matrix(lats1, lngs1, lats2, lngs2, 'ellipsoidal')
+    assert np.abs(ellipsoidal - expected).max() < 1e-6, np.abs(ellipsoidal - expected).max()
+
+    # Haversine is great_circle (up to geopy's rounder Earth radius) and within 0.6% of geodesic
+    haversine = geo_kernels.distance_matrix(lats1, lngs1, lats2, lngs2, 'haversine')
+    assert np.allclose(haversine, spherical, rtol=1e-6, atol=1e-9)
+    far = expected > 1
+    assert (np.abs(haversine - expected)[far] / expected[far]).max() < 0.006
+
+    count = min(lats1.size, lats2.size)
+    pairwise = geo_kernels.haversine_pairwise(lats1[:count], lngs1[:count], lats2[:count], lngs2[:count])
+    assert np.allclose(pairwise, np.diagonal(haversine[:, :count]))
+
+    # max_risk: the strongest decayed hotspot risk, computed in blocks, as a per-pair loop would
+    query_lats, query_lngs = rng.uniform(28.4, 28.8, 50), rng.uniform(77.0, 77.4, 50)
+    hotspot_lats, hotspot_lngs = rng.uniform(28.4, 28.8, 7), rng.uniform(77.0, 77.4, 7)
+    severities = rng.uniform(0.2, 1.0, 7)
+
+    def risk(distance, severity):
+        if distance < 1.0:
+            return severity
+        return severity * (np.exp(-distance / 2) if distance < 5.0 else 0.1)
+
+    loop = [max(risk(geodesic((qa, qb), (ha, hb)).kilometers, s)
+                for ha, hb, s in zip(hotspot_lats, hotspot_lngs, severities))
+            for qa, qb in zip(query_lats, query_lngs)]
+
+    block_size = geo_kernels.MAX_PAIRS_PER_BLOCK
+    geo_kernels.MAX_PAIRS_PER_BLOCK = 20
+    try:
+        blocked = geo_kernels.max_risk(query_lats, query_lngs, hotspot_lats, hotspot_lngs, severities,
+                                       1.0, 5.0, 0.1, mode='ellipsoidal')
+    finally:
+        geo_kernels.MAX_PAIRS_PER_BLOCK = block_size
+    assert np.allclose(blocked, loop, rtol=1e-9, atol=1e-12)
+    assert not geo_kernels.max_risk(query_lats, query_lngs, [], [], [], 1.0, 5.0, 0.1).any()
+
+    try:
+        geo_kernels.distance_matrix(lats1, lngs1, lats2, lngs2, 'flat')
+        raise AssertionError("unknown distance mode accepted")
+    except ValueError:
+        pass
+
+    print("✅ Geo kernels match geopy!")
+    print(f"   Worst haversine error: {(np.abs(haversine - expected)[far] / expected[far]).max():.3%}")
+    return True
+
+def test_sos_history_pagination():
+    """Test cursor pagination of the SOS history"""
+    print("\n🧪 Testing SOS History Pagination...")
+    from datetime import datetime, timedelta
+    from modules import database
+    from modules.sos_store import SosStore
+
+    engine = database._create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'history.db')}")
+    database.metadata.create_all(engine)
+    store = SosStore(engine=engine, retention_days=0, max_events=0)
+
+    start = datetime(2024, 3, 1, 21, 0)
+    ids = []
+    for i in range(23):
+        # Pairs of events share a timestamp, so ordering has to fall back to the id
+        ids.append(store.record({
+            'timestamp': (start + timedelta(minutes=i // 2)).isoformat(),
+            'user_id': 'alice' if i % 3 else 'bob',
+            'location': {'latitude': 28.5 + i * 0.01, 'longitude': 77.2},
+            'message': f"event {i}",
+            'contacts_alerted': 1
+        }))
+    newest_first = ids[::-1]
+
+    def pages(**filters):
+        seen, cursor = [], None
+        while True:
+            events, cursor = store.query(limit=4, cursor=cursor, **filters)
+            seen.extend(event['id'] for event in events)
+            if cursor is None:
+                return seen
+            # Events recorded while paging are newer than the cursor and never shift later pages
+            store.record({'timestamp': (start + timedelta(hours=1)).isoformat(), 'user_id': 'carol'})
+
+    assert pages(user_id='alice') == [i for i, n in zip(ids, range(23)) if n % 3][::-1]
+    assert pages(user_id='bob') == [i for i, n in zip(ids, range(23)) if not n % 3][::-1]
+
+    # Time and area filters combine with the cursor
+    since, until = start + timedelta(minutes=2), start + timedelta(minutes=8)
+    assert pages(since=since, until=until) == newest_first[-16:-4]
+    assert pages(bbox=(28.5, 77.0, 28.605, 77.5)) == newest_first[-11:]
+
+    # Every event once, newest first, when paging through everything
+    everything = pages()
+    assert everything[-23:] == newest_first and len(set(everything)) == len(everything)
+
+    # Page sizes are clamped to 1..MAX_PAGE_SIZE
+    events, cursor = store.query(limit=0)
+    assert len(events) == 1 and cursor is not None
+    events, cursor = store.query(limit=10_000)
+    assert len(events) == store.count() and cursor is None
+    try:
+        store.query(cursor='not-a-cursor')
+        raise AssertionError("invalid cursor accepted")
+    except ValueError:
+        pass
+
+    print("✅ SOS history pagination working!")
+    return True
+
+def test_normalize_phone():
+    """Test emergency contact phone number normalization"""
+    print("\n🧪 Testing Phone Number Normalization...")
+    from modules.contact_store import normalize_phone
+
+    cases = [
+        # (entered, default country code, expected)
+        ('+91 98765-43210', None, '+919876543210'),
+        ('+1 (555) 010-0000', None, '+15550100000'),
+        ('0091 98765 43210', None, '+919876543210'),
+        ('098765 43210', '+91', '+919876543210'),
+        ('98765.43210', '91', '+919876543210'),
+        ('+44 20 7946 0958', '+91', '+442079460958'),
+        ('9876543210', '', '9876543210'),
+        ('98765/43210', '', '9876543210'),
+    ]
+    for entered, country_code, expected in cases:
+        assert normalize_phone(entered, country_code) == expected, (entered, normalize_phone(entered, country_code))
+
+    # Formatting differences do not make a second contact
+    assert len({normalize_phone(n, '+91') for n in ('+919876543210', '98765 43210', '0091-98765-43210')}) == 1
+
+    for invalid in ('', None, 'call me', '+91 98765 4321x', '+12345', '+1234567890123456', '++919876543210'):
+        try:
+            normalize_phone(invalid, '+91')
+            raise AssertionError(f"accepted {invalid!r}")
+        except ValueError:
+            pass
+
+    print("✅ Phone number normalization working!")
+    return True
+
+def test_contact_seeding():
+    """Test that EMERGENCY_CONTACTS seeding happens once and deletions stick"""
+    print("\n🧪 Testing Emergency Contact Seeding...")
+    from modules import database
+    from modules.contact_store import ContactStore
+
+    engine = database._create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'contacts.db')}")
+    database.metadata.create_all(engine)
+
+    store = ContactStore(engine=engine)
+    assert store.seed(['+91 98765 43210', '+919876543210', '+15550100000', 'not a number']) == 2
+    assert store.numbers() == ('+919876543210', '+15550100000')
+
+    # Deleting every seeded contact and restarting does not bring them back
+    store.remove('+919876543210')
+    store.remove('+15550100000')
+    restarted = ContactStore(engine=engine)
+    assert restarted.seed(['+919876543210', '+15550100000']) == 0
+    assert restarted.numbers() == ()
+
+    # Users who already had contacts before seeding was recorded keep theirs as they are
+    restarted.add('+15550100001', user_id='jane')
+    assert restarted.seed(['+15550100000'], user_id='jane') == 0
+    assert restarted.numbers('jane') == ('+15550100001',)
+
+    print("✅ Contact seeding working!")
+    return True
+
+def test_serve_analyze():
+    """Test /api/analyze under serve.py (gevent workers) with the stub models"""
+    print("\n🧪 Testing /api/analyze under serve.py...")
+    import requests
+
+    # Combined analysis straight through the inference server with gevent patched
+    script = (
+        "from gevent import monkey; monkey.patch_all(os=False, signal=False)\n"
+        "import os, sys; sys.path[:0] = ['backend', 'benchmarks']\n"
+        "os.environ['RESULT_CACHE_PATH'] = ''\n"
+        "import modules.emotion_detector, modules.toxicity_detector, stub_models\n"
+        "stub_models.install(1)\n"
+        "from modules.inference_server import InferenceServer\n"
+        "print(sorted(InferenceServer(processes=0).analyze('multi', 'are you home yet', timeout=10)))\n"
+    )
+    direct = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert "'toxicity'" in direct.stdout, direct.stderr[-2000:]
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'serve_stub.py'), '--service-ms', '1',
+         '--workers', '2', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            assert server.poll() is None, f"serve.py exited with code {server.returncode}"
+            assert time.monotonic() < deadline, "serve.py did not become ready"
+            try:
+                if requests.get(f"{url}/api/ready", timeout=2).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+
+        # Several requests, so both workers answer
+        for text in ("he keeps following me", "thanks, I'm home safe", "he keeps following me"):
+            response = requests.post(f"{url}/api/analyze", json={'text': text}, timeout=15)
+            assert response.status_code == 200, response.text
+            result = response.json()
+            assert 'scores' in result['toxicity'] and 'emotions' in result['emotion'], result
+    finally:
+        server.terminate()
+        server.wait(30)
+
+    print("✅ /api/analyze answers under serve.py!")
+    return True
+
+def _run(test):
+    """Run a check; failed assertions count as a failure"""
+    try:
+        return test()
+    except Exception as e:
+        print(f"❌ {type(e).__name__}: {e}")
+        return False
+
 def main():
     print("=" * 60)
     print("🛡️  SheSafe - Module Testing")
@@ -94,6 +530,14 @@ def main():
     results.append(("Emotion Detection", test_emotion_module()))
     results.append(("Safety Scoring", test_safety_module()))
     results.append(("SOS System", test_sos_module()))
+    results.append(("Result Cache", test_result_cache()))
+    results.append(("Alert Queue", _run(test_alert_queue)))
+    results.append(("Conversation State Merge", _run(test_conversation_state_merge)))
+    results.append(("Geo Kernels", _run(test_geo_kernels)))
+    results.append(("SOS History Pagination", _run(test_sos_history_pagination)))
+    results.append(("Phone Normalization", _run(test_normalize_phone)))
+    results.append(("Contact Seeding", _run(test_contact_seeding)))
+    results.append(("serve.py /api/analyze", _run(test_serve_analyze)))
     
     # Summary
     print("\n" + "=" * 60)